@@ -0,0 +1,52 @@
+# 压测用的 spider 中间件：记录每个响应从进入回调到输出全部被取走的耗时
+import time
+
+from scrapy import signals
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class CallbackTimingMiddleware:
+    """放在最靠近 spider 的位置；耗时包含回调本身以及同步处理其输出的 item pipeline
+
+    爬虫结束时把 p50/p99/max（毫秒）写入 stats 的 benchmark/callback_* 下。
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.durations = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(crawler.stats)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_spider_input(self, response, spider):
+        response.meta["benchmark_callback_start"] = time.perf_counter()
+
+    def process_spider_output(self, response, result, spider):
+        yield from result
+        self._record(response)
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for entry in result:
+            yield entry
+        self._record(response)
+
+    def _record(self, response):
+        start = response.meta.pop("benchmark_callback_start", None)
+        if start is not None:
+            self.durations.append(time.perf_counter() - start)
+
+    def spider_closed(self, spider):
+        for name, fraction in (("p50", 0.5), ("p99", 0.99), ("max", 1.0)):
+            value = percentile(self.durations, fraction)
+            if value is not None:
+                self.stats.set_value(f"benchmark/callback_{name}_ms", round(value * 1000, 3))
+        self.stats.set_value("benchmark/callback_count", len(self.durations))
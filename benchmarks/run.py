@@ -0,0 +1,248 @@
+# 离线压测：启动本地模拟站点，在子进程中端到端运行爬虫，输出 JSON 格式的结果
+#
+#   python -m benchmarks.run --spider auto_novel_top100 --novels 20 --chapters 100 --output bench.json
+#
+# 每个爬虫在独立子进程中运行（Twisted reactor 不能重启），SQLite 使用临时数据库；
+# PostgreSQL 使用 --pg-dbname 指定的压测库，运行前会清空其中的爬虫表，不能与 PG_DBNAME 相同。
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import scrapy
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+from .site import StandInSite, serve
+
+try:
+    import resource
+
+    has_resource = True
+except ImportError:
+    has_resource = False
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPIDERS = ("auto_novel_top100", "auto_novel_top100_postgre")
+BENCH_TABLES = ("chapter_revision", "novel_chapter", "crawl_watermark", "content_dict", "schema_version", "novels")
+
+
+def parse_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROJECT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb(who):
+    if not has_resource:
+        return None
+    rss = resource.getrusage(who).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def prepare_postgres(dbname):
+    """创建压测库（如不存在）并清空爬虫表"""
+    import psycopg2
+
+    settings = get_project_settings()
+    if dbname == settings.get("PG_DBNAME"):
+        raise SystemExit(f"压测库 {dbname} 与 PG_DBNAME 相同，为避免清空业务数据请换一个库名")
+    params = {
+        "host": settings.get("PG_HOST"),
+        "port": settings.get("PG_PORT"),
+        "user": settings.get("PG_USER"),
+        "password": settings.get("PG_PASSWORD"),
+    }
+    conn = psycopg2.connect(database=settings.get("PG_DBNAME"), **params)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (dbname,))
+    if cursor.fetchone() is None:
+        cursor.execute(f'CREATE DATABASE "{dbname}"')
+    conn.close()
+    conn = psycopg2.connect(database=dbname, **params)
+    cursor = conn.cursor()
+    for table in BENCH_TABLES:
+        cursor.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
+    conn.commit()
+    conn.close()
+
+
+def run_worker(spider_name, site_url, workdir, result_path, pg_dbname, log_level, overrides):
+    """子进程入口：运行一次爬虫，把 stats 汇总写入 result_path"""
+    settings = get_project_settings()
+    spider_middlewares = dict(settings.getdict("SPIDER_MIDDLEWARES"))
+    spider_middlewares["benchmarks.instrument.CallbackTimingMiddleware"] = 1000
+    settings.setdict(
+        {
+            "NOVEL_SITE_BASE_URL": site_url,
+            "SQLITE_DB_PATH": os.path.join(workdir, "novel_data.db"),
+            "CRAWL_CHECKPOINT_FILE": os.path.join(workdir, "crawl_checkpoint.db"),
+            "PG_DBNAME": pg_dbname,
+            # 每次都从站点下载，且没有浏览器可用
+            "HTTPCACHE_ENABLED": False,
+            "SELENIUM_ENABLED": False,
+            "TELNETCONSOLE_ENABLED": False,
+            "LOG_LEVEL": log_level,
+            "SPIDER_MIDDLEWARES": spider_middlewares,
+        },
+        priority="cmdline",
+    )
+    settings.setdict(overrides, priority="cmdline")
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(spider_name)
+    process.crawl(crawler)
+    process.start()
+
+    stats = crawler.stats.get_stats()  # type: ignore
+    elapsed = stats.get("elapsed_time_seconds") or 0
+    pages = stats.get("response_received_count", 0)
+    items = stats.get("item_scraped_count", 0)
+    result = {
+        "spider": spider_name,
+        "backend": "postgres" if spider_name.endswith("_postgre") else "sqlite",
+        "finish_reason": stats.get("finish_reason"),
+        "elapsed_s": round(elapsed, 3),
+        "pages": pages,
+        "pages_per_s": round(pages / elapsed, 2) if elapsed else None,
+        "items": items,
+        "items_per_s": round(items / elapsed, 2) if elapsed else None,
+        "callback_p50_ms": stats.get("benchmark/callback_p50_ms"),
+        "callback_p99_ms": stats.get("benchmark/callback_p99_ms"),
+        "callback_max_ms": stats.get("benchmark/callback_max_ms"),
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF) if has_resource else None,
+        "peak_child_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN) if has_resource else None,
+        "requests": stats.get("downloader/request_count", 0),
+        "antibot_challenges": stats.get("antibot/challenge", 0),
+        "antibot_fallback_failed": stats.get("antibot/fallback_failed", 0),
+        "errors": stats.get("log_count/ERROR", 0),
+    }
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+def run_benchmark(args):
+    site = StandInSite(
+        novels=args.novels,
+        volumes=args.volumes,
+        chapters_per_volume=max(args.chapters // args.volumes, 1),
+        paragraphs=args.paragraphs,
+        challenge_ratio=args.challenge_ratio,
+        latency_ms=args.latency_ms,
+        seed=args.seed,
+    )
+    server, site_url = serve(site, port=args.port)
+    results = []
+    try:
+        for spider_name in args.spider or ["auto_novel_top100"]:
+            if spider_name.endswith("_postgre"):
+                prepare_postgres(args.pg_dbname)
+            before = dict(site.counters)
+            with tempfile.TemporaryDirectory(prefix="novel_bench_") as workdir:
+                result_path = os.path.join(workdir, "result.json")
+                command = [
+                    sys.executable, "-m", "benchmarks.run",
+                    "--worker", spider_name,
+                    "--site-url", site_url,
+                    "--workdir", workdir,
+                    "--result", result_path,
+                    "--pg-dbname", args.pg_dbname,
+                    "--log-level", args.log_level,
+                ]
+                for override in args.set or []:
+                    command += ["--set", override]
+                print(f"运行 {spider_name} ...", file=sys.stderr)
+                started = time.monotonic()
+                returncode = subprocess.run(command, cwd=PROJECT_DIR).returncode
+                if returncode != 0 or not os.path.exists(result_path):
+                    result = {"spider": spider_name, "error": f"子进程退出码 {returncode}"}
+                else:
+                    with open(result_path, encoding="utf-8") as f:
+                        result = json.load(f)
+                result["wall_s"] = round(time.monotonic() - started, 3)
+            result["site"] = {key: site.counters[key] - before[key] for key in site.counters}
+            results.append(result)
+    finally:
+        server.shutdown()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "scrapy": scrapy.__version__,
+        "platform": platform.platform(),
+        "params": {
+            "novels": site.novels,
+            "chapters_per_novel": site.chapters_per_novel,
+            "volumes": args.volumes,
+            "paragraphs": args.paragraphs,
+            "challenge_ratio": args.challenge_ratio,
+            "latency_ms": args.latency_ms,
+            "seed": args.seed,
+            "overrides": args.set or [],
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"压测结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用本地模拟站点离线压测爬虫")
+    parser.add_argument("--spider", action="append", choices=SPIDERS, help="要压测的爬虫，可重复，默认 auto_novel_top100")
+    parser.add_argument("--novels", type=int, default=20, help="榜单小说数（最多 100）")
+    parser.add_argument("--chapters", type=int, default=100, help="每本小说的章节数")
+    parser.add_argument("--volumes", type=int, default=2, help="每本小说的卷数")
+    parser.add_argument("--paragraphs", type=int, default=30, help="每章段落数")
+    parser.add_argument("--challenge-ratio", type=float, default=0.0, help="章节目录与正文返回验证页的概率")
+    parser.add_argument("--latency-ms", type=int, default=0, help="模拟站点每个响应的延迟（毫秒）")
+    parser.add_argument("--seed", type=int, default=0, help="验证页随机数种子")
+    parser.add_argument("--port", type=int, default=0, help="模拟站点端口，0 表示自动选择")
+    parser.add_argument("--pg-dbname", default="novel_bench", help="PostgreSQL 压测库名，运行前会清空爬虫表")
+    parser.add_argument("--log-level", default="WARNING", help="爬虫日志级别")
+    parser.add_argument("--set", action="append", metavar="NAME=VALUE", help="覆盖 Scrapy 设置，值按 JSON 解析，可重复")
+    parser.add_argument("--output", help="结果 JSON 文件，默认输出到标准输出")
+    # 以下参数仅供子进程使用
+    parser.add_argument("--worker", choices=SPIDERS, help=argparse.SUPPRESS)
+    parser.add_argument("--site-url", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        overrides = {}
+        for override in args.set or []:
+            name, _, value = override.partition("=")
+            overrides[name] = parse_value(value)
+        run_worker(args.worker, args.site_url, args.workdir, args.result, args.pg_dbname, args.log_level, overrides)
+    else:
+        run_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
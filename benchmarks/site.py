@@ -0,0 +1,151 @@
+# 本地模拟 17k.com：按参数生成 Top100 榜单、章节目录（dl.Volume）、章节正文（readAreaBox）页面，
+# 可按比例返回反爬验证页、模拟服务端延迟，用于离线压测
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOP100_PATH = "/top/refactor/top100/06_vipclick/06_click_freeBook_top_100_pc.html"
+LIST_RE = re.compile(r"^/list/(\d+)\.html$")
+CHAPTER_RE = re.compile(r"^/chapter/(\d+)/(\d+)\.html$")
+
+# 与 antibot.ANTI_SPIDER_KEYWORDS 对应的验证页
+CHALLENGE_PAGE = """<html><head><title>访问验证</title>
+<script>var _0x1a2b=["cookie"];function setCookie(k,v){document[_0x1a2b[0]]=k+"="+v;}setCookie("acw_sc__v2","0");</script>
+</head><body></body></html>"""
+
+PARAGRAPH = "夜色渐深，城中灯火一盏盏亮起，他沿着青石长街慢慢走着，心里反复想着白日里那番对话。"
+
+
+class StandInSite:
+    """页面内容由小说序号和章节序号确定，同样的参数每次生成相同的站点"""
+
+    def __init__(
+        self,
+        novels=20,
+        volumes=2,
+        chapters_per_volume=50,
+        paragraphs=30,
+        challenge_ratio=0.0,
+        latency_ms=0,
+        seed=0,
+    ):
+        self.novels = min(novels, 100)
+        self.volumes = volumes
+        self.chapters_per_volume = chapters_per_volume
+        self.paragraphs = paragraphs
+        self.challenge_ratio = challenge_ratio
+        self.latency = latency_ms / 1000.0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {"top100": 0, "list": 0, "chapter": 0, "challenge": 0, "not_found": 0}
+
+    @property
+    def chapters_per_novel(self):
+        return self.volumes * self.chapters_per_volume
+
+    def _count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def _challenged(self):
+        if not self.challenge_ratio:
+            return False
+        with self.lock:
+            return self.random.random() < self.challenge_ratio
+
+    def render(self, path):
+        """返回 (状态码, 页面)"""
+        if self.latency:
+            time.sleep(self.latency)
+        if path == TOP100_PATH:
+            self._count("top100")
+            return 200, self.top100_page()
+        match = LIST_RE.match(path)
+        if match and 1 <= int(match.group(1)) <= self.novels:
+            if self._challenged():
+                self._count("challenge")
+                return 200, CHALLENGE_PAGE
+            self._count("list")
+            return 200, self.list_page(int(match.group(1)))
+        match = CHAPTER_RE.match(path)
+        if match and 1 <= int(match.group(1)) <= self.novels and 1 <= int(match.group(2)) <= self.chapters_per_novel:
+            if self._challenged():
+                self._count("challenge")
+                return 200, CHALLENGE_PAGE
+            self._count("chapter")
+            return 200, self.chapter_page(int(match.group(1)), int(match.group(2)))
+        self._count("not_found")
+        return 404, "<html><body>404</body></html>"
+
+    def top100_page(self):
+        rows = []
+        for book in range(1, self.novels + 1):
+            rows.append(
+                f"<tr><td>{book}</td><td><a href=\"/all/{book % 7}.html\">分类{book % 7}</a></td>"
+                f"<td><a href=\"/book/{book}.html\" title=\"压测小说{book}\">压测小说{book}</a></td>"
+                f"<td><a href=\"/chapter/{book}/{self.chapters_per_novel}.html\" "
+                f"title=\"第{self.chapters_per_novel}章\">第{self.chapters_per_novel}章</a></td>"
+                f"<td>2026-01-01 00:00</td><td><a href=\"/author/{book}.html\">作者{book}</a></td>"
+                f"<td>连载</td><td>{100000 - book}</td></tr>"
+            )
+        return (
+            "<html><head><title>Top100</title></head><body>"
+            "<div class=\"BOX\" style=\"display: block\"><table>"
+            "<tr><th>排名</th><th>分类</th><th>书名</th><th>最新章节</th><th>更新时间</th>"
+            "<th>作者</th><th>状态</th><th>点击</th></tr>"
+            + "".join(rows)
+            + "</table></div></body></html>"
+        )
+
+    def list_page(self, book):
+        volumes = []
+        chapter = 0
+        for volume in range(1, self.volumes + 1):
+            links = []
+            for _ in range(self.chapters_per_volume):
+                chapter += 1
+                links.append(
+                    f"<dd><a href=\"/chapter/{book}/{chapter}.html\" title=\"第{chapter}章 字数：3000\">"
+                    f"<span class=\"ellipsis\">第{chapter}章 压测章节{chapter}</span></a></dd>"
+                )
+            volumes.append(
+                f"<dl class=\"Volume\"><dt><span class=\"tit\">第{volume}卷</span></dt>{''.join(links)}</dl>"
+            )
+        return f"<html><head><title>压测小说{book}</title></head><body>{''.join(volumes)}</body></html>"
+
+    def chapter_page(self, book, chapter):
+        paragraphs = "".join(f"<p>{PARAGRAPH}（{book}-{chapter}-{i}）</p>" for i in range(self.paragraphs))
+        return (
+            f"<html><head><title>第{chapter}章</title></head><body>"
+            f"<div class=\"readAreaBox content\"><h1>第{chapter}章 压测章节{chapter}</h1>"
+            f"<div class=\"p\">{paragraphs}</div></div></body></html>"
+        )
+
+
+def _make_handler(site):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            status, page = site.render(self.path.split("?", 1)[0])
+            body = page.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(site, host="127.0.0.1", port=0):
+    """在后台线程启动模拟站点，返回 (server, base_url)；port 为 0 时自动选择端口"""
+    server = ThreadingHTTPServer((host, port), _make_handler(site))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
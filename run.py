@@ -6,12 +6,13 @@
 """
 
 import argparse
+import shlex
 import sys
 import os
 import subprocess
 import platform
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 from datetime import datetime
 
 
@@ -54,6 +55,15 @@ class VenvManager:
 
         return True
 
+    def quote_arg(self, arg: str) -> str:
+        """按目标 shell 的规则转义单个参数
+
+        Windows 的 cmd 会原样保留单引号，改用 list2cmdline（只在需要时加双引号）；其他系统用 shlex.quote。
+        """
+        if self.is_windows:
+            return subprocess.list2cmdline([arg])
+        return shlex.quote(arg)
+
     def build_command(
         self, command: str, check_python: bool = True
     ) -> Tuple[str, bool, Optional[str]]:
@@ -83,7 +93,9 @@ class SpiderRunner:
     def __init__(self, base_dir: str):
         self.venv_manager = VenvManager(base_dir)
 
-    def run_spider(self, spider_name: str, local: bool = False) -> bool:
+    def run_spider(
+        self, spider_name: str, local: bool = False, incremental: bool = False
+    ) -> bool:
         """运行爬虫"""
         print_log("INFO", f"开始运行爬虫: {spider_name}")
 
@@ -103,7 +115,8 @@ class SpiderRunner:
 
         # 构建命令
         local_arg = " -a local=1" if local else ""
-        command = f"scrapy crawl {spider_name}{local_arg}"
+        incremental_arg = " -a incremental=1" if incremental else ""
+        command = f"scrapy crawl {spider_name}{local_arg}{incremental_arg}"
 
         full_command, shell_flag, executable = self.venv_manager.build_command(
             command, check_python=False
@@ -122,7 +135,13 @@ class EbookExporter:
     def __init__(self, base_dir: str):
         self.venv_manager = VenvManager(base_dir)
 
-    def export_ebooks(self, format_type: str) -> bool:
+    def export_ebooks(
+        self,
+        format_type: str,
+        jobs: int = 1,
+        novels: Optional[List[str]] = None,
+        force: bool = False,
+    ) -> bool:
         """导出电子书"""
         print_log("INFO", f"开始导出电子书，格式: {format_type}")
 
@@ -141,6 +160,12 @@ class EbookExporter:
 
         # 构建命令
         command = f"python run_export_to_ebooks.py --format {format_type}"
+        if jobs > 1:
+            command += f" --jobs {jobs}"
+        for novel in novels or []:
+            command += f" --novel {self.venv_manager.quote_arg(novel)}"
+        if force:
+            command += " --force"
 
         full_command, shell_flag, executable = self.venv_manager.build_command(command)
         if not full_command:
@@ -151,6 +176,36 @@ class EbookExporter:
         )
 
 
+class ContentMigrator:
+    """章节正文存储格式转换"""
+
+    def __init__(self, base_dir: str):
+        self.venv_manager = VenvManager(base_dir)
+
+    def migrate_content(
+        self, codec: str = "zstd", train: str = "global", vacuum: bool = False
+    ) -> bool:
+        """转换已入库章节正文的存储格式"""
+        print_log("INFO", f"开始转换章节正文存储格式: {codec}")
+
+        migrate_script = self.venv_manager.base_dir / "run_migrate_content.py"
+        if not migrate_script.exists():
+            print_log("ERROR", f"转换脚本未找到: {migrate_script}")
+            return False
+
+        command = f"python run_migrate_content.py --codec {codec} --train {train}"
+        if vacuum:
+            command += " --vacuum"
+
+        full_command, shell_flag, executable = self.venv_manager.build_command(command)
+        if not full_command:
+            return False
+
+        return CommandExecutor._execute_command(
+            full_command, shell_flag, executable, "正文转换"
+        )
+
+
 class CommandExecutor:
     """命令执行器"""
 
@@ -188,14 +243,29 @@ class NovelTool:
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
         self.spider_runner = SpiderRunner(self.base_dir)
         self.ebook_exporter = EbookExporter(self.base_dir)
+        self.content_migrator = ContentMigrator(self.base_dir)
 
-    def run_spider(self, spider_name: str, local: bool = False) -> bool:
+    def run_spider(
+        self, spider_name: str, local: bool = False, incremental: bool = False
+    ) -> bool:
         """运行爬虫"""
-        return self.spider_runner.run_spider(spider_name, local)
-
-    def export_ebooks(self, format_type: str) -> bool:
+        return self.spider_runner.run_spider(spider_name, local, incremental)
+
+    def export_ebooks(
+        self,
+        format_type: str,
+        jobs: int = 1,
+        novels: Optional[List[str]] = None,
+        force: bool = False,
+    ) -> bool:
         """导出电子书"""
-        return self.ebook_exporter.export_ebooks(format_type)
+        return self.ebook_exporter.export_ebooks(format_type, jobs, novels, force)
+
+    def migrate_content(
+        self, codec: str = "zstd", train: str = "global", vacuum: bool = False
+    ) -> bool:
+        """转换章节正文存储格式"""
+        return self.content_migrator.migrate_content(codec, train, vacuum)
 
     def show_help(self):
         """显示帮助信息"""
@@ -204,8 +274,10 @@ class NovelTool:
 小说爬虫和导出工具
 
 使用方法:
-  python run.py crawl <spider_name> [--local]    运行爬虫
-  python run.py export <format>                  导出小说
+  python run.py crawl <spider_name> [--local] [--incremental]    运行爬虫
+  python run.py export <format> [--jobs N] [--novel NAME] [--force]    导出小说
+  python run.py migrate-content [--codec zstd|none] [--train global|novel|none] [--vacuum]
+                                                 转换已入库章节正文的存储格式
 
 爬虫选项:
   auto_novel_top100              - 自动爬取小说TOP100
@@ -218,8 +290,12 @@ class NovelTool:
 示例:
   python run.py crawl auto_novel_top100
   python run.py crawl auto_novel_top100_postgre --local
+  python run.py crawl auto_novel_top100 --incremental
   python run.py export txt
   python run.py export epub
+  python run.py export epub --jobs 4
+  python run.py export txt --novel 小说名
+  python run.py migrate-content --vacuum
         """
         )
 
@@ -233,8 +309,12 @@ def main():
 示例:
   %(prog)s crawl auto_novel_top100
   %(prog)s crawl auto_novel_top100_postgre --local
+  %(prog)s crawl auto_novel_top100 --incremental
   %(prog)s export txt
   %(prog)s export epub
+  %(prog)s export epub --jobs 4
+  %(prog)s export txt --novel 小说名
+  %(prog)s migrate-content --vacuum
         """,
     )
 
@@ -251,10 +331,47 @@ def main():
         help="爬虫名称",
     )
     crawl_parser.add_argument("--local", action="store_true", help="传递local=1参数")
+    crawl_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="增量模式，只抓取榜单最新章节有变化的小说",
+    )
 
     # 导出命令
     export_parser = subparsers.add_parser("export", help="导出小说")
     export_parser.add_argument("format", choices=["epub", "txt"], help="导出格式")
+    export_parser.add_argument(
+        "--jobs", type=int, default=1, help="并行导出的进程数"
+    )
+    export_parser.add_argument(
+        "--novel",
+        action="append",
+        dest="novels",
+        help="只导出指定小说，可重复使用",
+    )
+    export_parser.add_argument(
+        "--force", action="store_true", help="忽略导出清单，全部重新导出"
+    )
+
+    # 正文存储格式转换命令
+    migrate_parser = subparsers.add_parser(
+        "migrate-content", help="转换已入库章节正文的存储格式"
+    )
+    migrate_parser.add_argument(
+        "--codec",
+        choices=["zstd", "none"],
+        default="zstd",
+        help="目标格式：zstd 压缩，none 还原为明文",
+    )
+    migrate_parser.add_argument(
+        "--train",
+        choices=["global", "novel", "none"],
+        default="global",
+        help="训练压缩字典：global 全局一个，novel 每本小说一个，none 沿用已有字典",
+    )
+    migrate_parser.add_argument(
+        "--vacuum", action="store_true", help="转换后回收数据库空间"
+    )
 
     args = parser.parse_args()
 
@@ -264,9 +381,15 @@ def main():
     # 执行命令
     success = False
     if args.command == "crawl":
-        success = tool.run_spider(args.spider, local=args.local)
+        success = tool.run_spider(
+            args.spider, local=args.local, incremental=args.incremental
+        )
     elif args.command == "export":
-        success = tool.export_ebooks(args.format)
+        success = tool.export_ebooks(
+            args.format, args.jobs, args.novels, args.force
+        )
+    elif args.command == "migrate-content":
+        success = tool.migrate_content(args.codec, args.train, args.vacuum)
     else:
         tool.show_help()
         return
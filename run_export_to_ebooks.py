@@ -1,14 +1,23 @@
 import os
-import re
 import sqlite3
 import importlib.util
 import argparse
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from seventeen_novels.codec import ContentCodec
+from seventeen_novels.epub_writer import StreamingEpubWriter
+from seventeen_novels.schema import HAS_CONTENT, NOVEL_ID_FILTER
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 OUTPUT_DIR = os.path.abspath(os.path.join(BASE_DIR, "output"))
 DB_FILE = os.path.join(OUTPUT_DIR, "novel_data.db")
 EBOOKS_DIR = os.path.join(BASE_DIR, "output", "ebooks")
 os.makedirs(EBOOKS_DIR, exist_ok=True)
+# 导出清单：记录每本书上次导出时的章节统计，用于跳过未变化的小说
+MANIFEST_FILE = os.path.join(EBOOKS_DIR, "export_manifest.json")
 
 settings_path = os.path.join(BASE_DIR, "seventeen_novels", "settings.py")
 use_pg = os.path.exists(settings_path)
@@ -21,218 +30,402 @@ if use_pg:
     settings = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(settings)
 
-try:
-    from ebooklib import epub
-
-    has_epub = True
-except ImportError:
-    has_epub = False
-
 
 def fetch_all_novels(conn, use_pg=False):
     cursor = conn.cursor()
     try:
         cursor.execute("SELECT name, author FROM novels")
-        return cursor.fetchall()
+        # 由章节补建的小说记录没有作者
+        return [(name, author or "未知") for name, author in cursor.fetchall()]
     except Exception:
         cursor.execute("SELECT DISTINCT novel_name FROM novel_chapter")
         return [(row[0], "未知") for row in cursor.fetchall()]
 
 
-# 中文数字转阿拉伯数字
-def chinese_to_arabic(cn: str) -> int:
-    cn_num = {
-        "零": 0,
-        "一": 1,
-        "二": 2,
-        "三": 3,
-        "四": 4,
-        "五": 5,
-        "六": 6,
-        "七": 7,
-        "八": 8,
-        "九": 9,
-        "〇": 0,
-        "两": 2,
-    }
-    cn_unit = {
-        "十": 10,
-        "百": 100,
-        "千": 1000,
-        "点": 1000,
-        "万": 10000,
-        "亿": 100000000,
-    }
-    unit, num = 1, 0
-    cn = cn.strip()
-    if not cn:
-        return 0
-    if cn.startswith("十"):
-        if len(cn) == 1:
-            return 10
-        else:
-            return 10 + chinese_to_arabic(cn[1:])
-    total = 0
-    unit = 1
-    i = len(cn) - 1
-    while i >= 0:
-        c = cn[i]
-        if c in cn_num:
-            num = cn_num[c]
-            total += num * unit
-            i -= 1
-        elif c in cn_unit:
-            unit = cn_unit[c]
-            if unit in (10000, 100000000):
-                if total == 0:
-                    total = 1
-                total = total * unit
-            i -= 1
-        else:
-            i -= 1
-    return total
-
-
-def clean_chapter_name(name):
-    return re.sub(r"([一二三四五六七八九十百千万亿〇两点])\1+", r"\1", name)
+# 流式导出时每批从数据库取回的章节数
+EXPORT_FETCH_SIZE = 200
+# 压缩正文的解码器，字典在 connect_db 中加载
+content_codec = ContentCodec()
+# 数据库中是否有 chapter_revision 表，在 connect_db 中检测
+has_revisions = False
 
 
-def extract_chapter_number(chapter_name):
-    # 先匹配阿拉伯数字
-    m = re.search(r"第\s*0*([0-9]+)\s*(?:章|回|节|卷|更)", chapter_name)
-    if m:
-        return int(m.group(1))
-    # 再匹配中文数字
-    m = re.search(
-        r"第\s*([一二三四五六七八九零十百千万亿〇两点]+)\s*(?:章|回|节|卷|更)",
-        chapter_name,
-    )
-    if m:
-        clean_num = clean_chapter_name(m.group(1))
-        return chinese_to_arabic(clean_num)
-    return float("inf")
-
+def fetch_chapter_stats(conn, novel_name, use_pg=False, max_chapter_index=None):
+    """统计可导出章节：数量、最大 id、最大 chapter_index、正文总长度、缺少 chapter_index 的数量，
+    以及章节正文最新修订记录的 id（正文长度不变的修改也能发现）
 
-def fetch_chapters_for_novel(conn, novel_name, use_pg=False):
+    指定 max_chapter_index 时只统计 chapter_index 不超过它的章节，用于判断已导出部分是否变化。
+    """
+    placeholder = "%s" if use_pg else "?"
+    params = [novel_name]
+    index_filter = revision_filter = ""
+    if max_chapter_index is not None:
+        index_filter = f"AND chapter_index <= {placeholder}"
+        revision_filter = f"AND c.chapter_index <= {placeholder}"
+        params.append(max_chapter_index)
     cursor = conn.cursor()
-    if use_pg:
+    cursor.execute(
+        f"""
+        SELECT COUNT(*), MAX(id), MAX(chapter_index),
+        COALESCE(SUM(COALESCE(LENGTH(chapter_content), LENGTH(content_blob))), 0),
+        COALESCE(SUM(CASE WHEN chapter_index IS NULL THEN 1 ELSE 0 END), 0)
+        FROM novel_chapter
+        WHERE {NOVEL_ID_FILTER.format(placeholder)} AND {HAS_CONTENT} {index_filter}
+        """,
+        params,
+    )
+    total, max_id, max_index, content_length, unindexed = cursor.fetchone()
+    last_revision = None
+    if has_revisions:
         cursor.execute(
-            """
-            SELECT volume_title, chapter_name, chapter_content FROM novel_chapter JOIN novels ON novels.name = novel_chapter.novel_name
-            WHERE novel_name = %s AND chapter_content is not null ORDER BY chapter_name ASC
+            f"""
+            SELECT MAX(r.id) FROM chapter_revision r JOIN novel_chapter c ON c.id = r.chapter_id
+            WHERE c.{NOVEL_ID_FILTER.format(placeholder)} {revision_filter}
             """,
-            (novel_name,),
+            params,
         )
+        last_revision = cursor.fetchone()[0]
+    cursor.close()
+    return {
+        "chapter_count": total,
+        "max_chapter_id": max_id,
+        "max_chapter_index": max_index,
+        "content_length": int(content_length),
+        "unindexed": unindexed,
+        "last_revision": last_revision,
+    }
+
+
+def decode_rows(rows):
+    """把 (卷名, 章节名, 明文, 压缩正文, 字典 id) 还原为 (卷名, 章节名, 正文)"""
+    for volume_title, chapter_name, chapter_content, content_blob, dict_id in rows:
+        yield volume_title, chapter_name, content_codec.decode(chapter_content, content_blob, dict_id)
+
+
+def iter_indexed_chapters(conn, novel_name, use_pg=False, after_index=None, indexed_only=False):
+    """按 (novel_id, chapter_index) 索引顺序扫描章节，同一位置按 id 排序
+
+    指定 after_index 时只返回其后的章节，供 TXT 追加导出使用。
+    indexed_only 时跳过 chapter_index 为 NULL 的章节：旧数据的 chapter_index 已在数据库升级时
+    按章节名回填，仍为 NULL 的解析不出章节号，不导出。
+    """
+    placeholder = "%s" if use_pg else "?"
+    params = [novel_name]
+    index_filter = ""
+    if after_index is not None:
+        index_filter = f"AND chapter_index > {placeholder}"
+        params.append(after_index)
+    elif indexed_only:
+        index_filter = "AND chapter_index IS NOT NULL"
+    if use_pg:
+        cursor = conn.cursor(name="export_chapters")
+        cursor.itersize = EXPORT_FETCH_SIZE
     else:
-        cursor.execute(
-            """
-            SELECT volume_title, chapter_name, chapter_content FROM novel_chapter JOIN novels ON novels.name = novel_chapter.novel_name
-            WHERE novel_name = ? and chapter_content is not null ORDER BY chapter_name ASC
-            """,
-            (novel_name,),
-        )
-    chapters = cursor.fetchall()
-    filtered_chapters = [
-        x
-        for x in chapters
-        if x[1]
-        and (
-            ("第" in x[1])
-            and (
-                ("章" in x[1])
-                or ("回" in x[1])
-                or ("节" in x[1])
-                or ("卷" in x[1])
-                or ("更" in x[1])
-            )
-        )
-    ]
-    filtered_chapters.sort(key=lambda x: extract_chapter_number(x[1]))
-    return filtered_chapters
+        cursor = conn.cursor()
+        cursor.arraysize = EXPORT_FETCH_SIZE
+    cursor.execute(
+        f"""
+        SELECT volume_title, chapter_name, chapter_content, content_blob, dict_id FROM novel_chapter
+        WHERE {NOVEL_ID_FILTER.format(placeholder)} AND {HAS_CONTENT} {index_filter}
+        ORDER BY chapter_index ASC, id ASC
+        """,
+        params,
+    )
+    try:
+        yield from decode_rows(cursor)
+    finally:
+        cursor.close()
+        if use_pg:
+            conn.rollback()
 
 
-def export_novel_to_txt(novel_name, author, chapters):
+def fetch_chapters_for_novel(conn, novel_name, use_pg=False, stats=None):
+    """返回按导出顺序逐章产出 (volume_title, chapter_name, chapter_content) 的迭代器，
+    没有可导出的章节时返回 None"""
+    if stats is None:
+        stats = fetch_chapter_stats(conn, novel_name, use_pg=use_pg)
+    if stats["chapter_count"] <= stats["unindexed"]:
+        return None
+    return iter_indexed_chapters(conn, novel_name, use_pg=use_pg, indexed_only=bool(stats["unindexed"]))
+
+
+def txt_path_for(novel_name):
     safe_name = "".join(
         c for c in novel_name if c.isalnum() or c in (" ", "_", "-")
     ).rstrip()
-    txt_path = os.path.join(EBOOKS_DIR, f"{safe_name}.txt")
+    return os.path.join(EBOOKS_DIR, f"{safe_name}.txt")
+
+
+def write_txt_chapters(f, chapters, last_volume=None):
+    """写入章节，返回 (章节数, 最后一个卷名)，追加导出时据此接着输出卷标题"""
+    count = 0
+    for volume, chapter, content in chapters:
+        count += 1
+        if volume and volume != last_volume:
+            f.write(f"\n【{volume}】\n")
+            last_volume = volume
+        if chapter:
+            f.write(f"\n{chapter}\n")
+        if content:
+            f.write(f"{content}\n")
+    return count, last_volume
+
+
+def export_novel_to_txt(novel_name, author, chapters):
+    txt_path = txt_path_for(novel_name)
     with open(txt_path, "w", encoding="utf-8") as f:
         f.write(f"{novel_name} 作者：{author}\n\n")
-        last_volume = None
-        for volume, chapter, content in chapters:
-            if volume and volume != last_volume:
-                f.write(f"\n【{volume}】\n")
-                last_volume = volume
-            if chapter:
-                f.write(f"\n{chapter}\n")
-            if content:
-                f.write(f"{content}\n")
+        count, last_volume = write_txt_chapters(f, chapters)
     print(f"已导出: {txt_path}")
+    return count, last_volume
+
+
+def append_novel_to_txt(novel_name, chapters, last_volume):
+    txt_path = txt_path_for(novel_name)
+    with open(txt_path, "a", encoding="utf-8") as f:
+        count, last_volume = write_txt_chapters(f, chapters, last_volume)
+    print(f"已追加: {txt_path}，新增 {count} 章")
+    return count, last_volume
 
 
 def export_novel_to_epub(novel_name, author, chapters):
-    if not has_epub:
-        print("未安装 ebooklib，无法导出 epub。请先 pip install ebooklib")
-        return
-    output_epub = os.path.join(EBOOKS_DIR, f"{novel_name}.epub")
-    book = epub.EpubBook()
-    book.set_identifier("id123456")
-    book.set_title(novel_name)
-    book.set_language("zh")
-    book.add_author(author)
-    epub_chapters = []
-    for idx, (volume_title, chapter_name, chapter_content) in enumerate(chapters):
-        c = epub.EpubHtml(
-            title=chapter_name, file_name=f"chap_{idx+1}.xhtml", lang="zh"
-        )
-        safe_content = chapter_content.replace("\n", "<br/>") if chapter_content else ""
-        c.content = (
-            f"<h1>{chapter_name}</h1><h2>{volume_title}</h2><p>{safe_content}</p>"
-        )
-        book.add_item(c)
-        epub_chapters.append(c)
-    book.toc = tuple(epub_chapters)  # type: ignore
-    book.spine = ["nav"] + epub_chapters
-    book.add_item(epub.EpubNcx())
-    book.add_item(epub.EpubNav())
-    epub.write_epub(output_epub, book, {})
+    output_epub = epub_path_for(novel_name)
+    # 章节逐个写入 zip，内存中只保留目录所需的章节名和卷名
+    with StreamingEpubWriter(output_epub, novel_name, author) as writer:
+        for volume_title, chapter_name, chapter_content in chapters:
+            writer.add_chapter(volume_title, chapter_name, chapter_content)
     print(f"已生成EPUB电子书：{output_epub}")
+    return len(writer.chapters)
 
 
-def main(format="txt"):
+def connect_db():
+    """按配置连接 PostgreSQL 或本地 SQLite，加载压缩字典并检测修订记录表；数据库不存在时返回 None"""
+    global has_revisions
     if use_pg:
-        pg_conn_params = {
-            "host": getattr(settings, "PG_HOST"),
-            "port": getattr(settings, "PG_PORT"),
-            "user": getattr(settings, "PG_USER"),
-            "password": getattr(settings, "PG_PASSWORD"),
-            "database": getattr(settings, "PG_DBNAME"),
-        }
         conn = psycopg2.connect(
-            host=pg_conn_params["host"],
-            port=pg_conn_params["port"],
-            user=pg_conn_params["user"],
-            password=pg_conn_params["password"],
-            database=pg_conn_params["database"],
+            host=getattr(settings, "PG_HOST"),
+            port=getattr(settings, "PG_PORT"),
+            user=getattr(settings, "PG_USER"),
+            password=getattr(settings, "PG_PASSWORD"),
+            database=getattr(settings, "PG_DBNAME"),
         )
+    elif not os.path.exists(DB_FILE):
+        print(f"数据库未找到: {DB_FILE}")
+        return None
     else:
-        if not os.path.exists(DB_FILE):
-            print(f"数据库未找到: {DB_FILE}")
-            return
         conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    try:
+        content_codec.load_dictionaries(cursor)
+    except Exception:
+        # 旧库尚未创建 content_dict 表，没有压缩正文
+        if use_pg:
+            conn.rollback()
+    if use_pg:
+        cursor.execute("SELECT to_regclass('chapter_revision') IS NOT NULL")
+        has_revisions = cursor.fetchone()[0]
+    else:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chapter_revision'")
+        has_revisions = cursor.fetchone() is not None
+    cursor.close()
+    if use_pg:
+        conn.rollback()
+    return conn
+
+
+def epub_path_for(novel_name):
+    return os.path.join(EBOOKS_DIR, f"{novel_name}.epub")
+
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+    try:
+        with open(MANIFEST_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"导出清单读取失败，将全部重新导出: {e}")
+        return {}
+
+
+def save_manifest(manifest):
+    # 先写临时文件再替换，避免中途退出留下损坏的清单
+    tmp_path = MANIFEST_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+
+def manifest_key(novel_name, format):
+    return f"{format}:{novel_name}"
+
+
+def _same_chapters(stats, entry):
+    return all(
+        stats[key] == entry.get(key)
+        for key in ("chapter_count", "max_chapter_id", "max_chapter_index", "content_length", "last_revision")
+    )
+
+
+def _output_intact(entry):
+    # 输出文件被删除或改动过时不能跳过/追加
+    path = entry.get("path")
+    return bool(path) and os.path.exists(path) and os.path.getsize(path) == entry.get("file_size")
+
+
+def _can_append_txt(conn, novel_name, stats, entry):
+    """TXT 只在末尾新增了章节时可以追加：已导出的那部分章节统计不变，且全部章节都有 chapter_index"""
+    last_index = entry.get("max_chapter_index")
+    if stats["unindexed"] or entry.get("unindexed") or last_index is None:
+        return False
+    if stats["max_chapter_index"] is None or stats["max_chapter_index"] <= last_index:
+        return False
+    exported = fetch_chapter_stats(conn, novel_name, use_pg=use_pg, max_chapter_index=last_index)
+    return _same_chapters(exported, entry)
+
+
+def export_novel(conn, novel_name, author, format="txt", previous=None):
+    """导出一本小说，previous 为上次的导出清单记录
+
+    返回 (小说名, 本次写入章节数, 耗时秒数, 处理方式, 新的清单记录)，
+    处理方式为 skipped / appended / exported / empty。
+    """
+    start = time.perf_counter()
+    try:
+        stats = fetch_chapter_stats(conn, novel_name, use_pg=use_pg)
+        if not stats["chapter_count"]:
+            return novel_name, 0, time.perf_counter() - start, "empty", None
+        entry = dict(stats, format=format, author=author)
+        if previous and previous.get("author") == author and _output_intact(previous):
+            if previous.get("unindexed") == stats["unindexed"] and _same_chapters(stats, previous):
+                return novel_name, 0, time.perf_counter() - start, "skipped", previous
+            if format == "txt" and _can_append_txt(conn, novel_name, stats, previous):
+                chapters = iter_indexed_chapters(
+                    conn, novel_name, use_pg=use_pg, after_index=previous["max_chapter_index"]
+                )
+                count, last_volume = append_novel_to_txt(
+                    novel_name, chapters, previous.get("last_volume")
+                )
+                entry.update(path=previous["path"], last_volume=last_volume)
+                entry["file_size"] = os.path.getsize(entry["path"])
+                return novel_name, count, time.perf_counter() - start, "appended", entry
+        chapters = fetch_chapters_for_novel(conn, novel_name, use_pg=use_pg, stats=stats)
+        if not chapters:
+            return novel_name, 0, time.perf_counter() - start, "empty", None
+        if format == "epub":
+            count = export_novel_to_epub(novel_name, author, chapters)
+            entry["path"] = epub_path_for(novel_name)
+        else:
+            count, last_volume = export_novel_to_txt(novel_name, author, chapters)
+            entry.update(path=txt_path_for(novel_name), last_volume=last_volume)
+        if not count or not os.path.exists(entry["path"]):
+            return novel_name, count, time.perf_counter() - start, "empty", None
+        entry["file_size"] = os.path.getsize(entry["path"])
+        return novel_name, count, time.perf_counter() - start, "exported", entry
+    finally:
+        if use_pg:
+            # 结束统计查询开启的只读事务
+            conn.rollback()
+
+
+# 工作进程各自持有一个数据库连接，在进程初始化时建立
+_worker_conn = None
+
+
+def _init_export_worker():
+    global _worker_conn
+    _worker_conn = connect_db()
+
+
+def _export_in_worker(novel_name, author, format, previous):
+    return export_novel(_worker_conn, novel_name, author, format, previous)
+
+
+ACTION_LABELS = {
+    "skipped": "未变化，跳过",
+    "appended": "追加",
+    "exported": "导出",
+    "empty": "无可导出章节",
+}
+
+
+def main(format="txt", jobs=1, novel_names=None, force=False):
+    conn = connect_db()
+    if conn is None:
+        return
     novels = fetch_all_novels(conn, use_pg=use_pg)
+    if novel_names:
+        wanted = set(novel_names)
+        novels = [(name, author) for name, author in novels if name in wanted]
+        missing = wanted - {name for name, _ in novels}
+        if missing:
+            print(f"未找到小说: {', '.join(sorted(missing))}")
     if not novels:
+        conn.close()
         print("未找到任何小说数据。")
         return
-    for novel_name, author in novels:
-        chapters = fetch_chapters_for_novel(conn, novel_name, use_pg=use_pg)
-        if chapters:
-            if format == "epub":
-                export_novel_to_epub(novel_name, author, chapters)
-            else:
-                export_novel_to_txt(novel_name, author, chapters)
-    conn.close()
-    print("全部小说导出完成。")
+
+    manifest = load_manifest()
+    tasks = [
+        (novel_name, author, None if force else manifest.get(manifest_key(novel_name, format)))
+        for novel_name, author in novels
+    ]
+    start = time.perf_counter()
+    results = []
+
+    def record(result):
+        novel_name, count, elapsed, action, entry = result
+        print(f"{novel_name}：{ACTION_LABELS[action]}，{count} 章，耗时 {elapsed:.2f} 秒")
+        results.append(result)
+        key = manifest_key(novel_name, format)
+        if entry is None:
+            manifest.pop(key, None)
+        elif action != "skipped":
+            manifest[key] = dict(entry, exported_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+
+    try:
+        if jobs > 1:
+            # 主进程只负责分发，连接在各工作进程中重新建立；使用 spawn 避免 fork 继承数据库连接
+            conn.close()
+            with ProcessPoolExecutor(
+                max_workers=jobs,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_export_worker,
+            ) as executor:
+                futures = {
+                    executor.submit(_export_in_worker, novel_name, author, format, previous): novel_name
+                    for novel_name, author, previous in tasks
+                }
+                for future in as_completed(futures):
+                    try:
+                        record(future.result())
+                    except Exception as e:
+                        print(f"导出失败: {futures[future]}，错误: {e}")
+        else:
+            for novel_name, author, previous in tasks:
+                # 与并行导出一致，单本失败不影响其余小说
+                try:
+                    record(export_novel(conn, novel_name, author, format, previous))
+                except Exception as e:
+                    print(f"导出失败: {novel_name}，错误: {e}")
+                    if use_pg:
+                        # 结束出错的事务，连接继续用于下一本
+                        conn.rollback()
+    finally:
+        conn.close()
+        # 中途失败也保存已完成部分，下次只处理剩余的小说
+        save_manifest(manifest)
+
+    elapsed = time.perf_counter() - start
+    written = [result for result in results if result[3] in ("exported", "appended")]
+    skipped = sum(1 for result in results if result[3] == "skipped")
+    chapters = sum(result[1] for result in written)
+    print(
+        f"全部小说导出完成：写入 {len(written)} 本，跳过未变化 {skipped} 本，{chapters} 章，"
+        f"总耗时 {elapsed:.2f} 秒，进程数 {jobs}，"
+        f"{len(written) / elapsed if elapsed else 0:.2f} 本/秒，"
+        f"{chapters / elapsed if elapsed else 0:.0f} 章/秒"
+    )
 
 
 if __name__ == "__main__":
@@ -240,5 +433,22 @@ if __name__ == "__main__":
     parser.add_argument(
         "--format", choices=["txt", "epub"], default="txt", help="导出格式"
     )
+    parser.add_argument(
+        "--jobs", type=int, default=1, help="并行导出的进程数，默认 1 即顺序导出"
+    )
+    parser.add_argument(
+        "--novel",
+        action="append",
+        dest="novels",
+        help="只导出指定小说，可重复使用",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="忽略导出清单，全部重新导出"
+    )
     args = parser.parse_args()
-    main(format=args.format)
+    main(
+        format=args.format,
+        jobs=max(args.jobs, 1),
+        novel_names=args.novels,
+        force=args.force,
+    )
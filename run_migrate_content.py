@@ -0,0 +1,181 @@
+import argparse
+
+from run_export_to_ebooks import connect_db, content_codec, use_pg
+from seventeen_novels.codec import ContentCodec, content_hash, create_content_storage, train_dictionary
+from seventeen_novels.schema import NOVEL_ID_FILTER
+
+# 每批转换的章节数，每批一个事务
+MIGRATE_BATCH_SIZE = 500
+
+
+def sample_contents(conn, novel_name=None, limit=1000):
+    """随机抽取章节正文作为字典训练样本"""
+    placeholder = "%s" if use_pg else "?"
+    novel_filter = f"AND {NOVEL_ID_FILTER.format(placeholder)}" if novel_name else ""
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT chapter_content, content_blob, dict_id FROM novel_chapter
+        WHERE (chapter_content is not null OR content_blob is not null) {novel_filter}
+        ORDER BY RANDOM() LIMIT {int(limit)}
+        """,
+        [novel_name] if novel_name else [],
+    )
+    samples = [content_codec.decode(*row) for row in cursor.fetchall()]
+    cursor.close()
+    return samples
+
+
+def save_dictionary(conn, dict_data, novel_name=None):
+    cursor = conn.cursor()
+    if use_pg:
+        cursor.execute(
+            "INSERT INTO content_dict (novel_name, dict_data) VALUES (%s, %s) RETURNING dict_id",
+            (novel_name, dict_data),
+        )
+        dict_id = cursor.fetchone()[0]
+    else:
+        cursor.execute(
+            "INSERT INTO content_dict (novel_name, dict_data) VALUES (?, ?)",
+            (novel_name, dict_data),
+        )
+        dict_id = cursor.lastrowid
+    conn.commit()
+    cursor.close()
+    return dict_id
+
+
+def train_dictionaries(conn, codec, train, dict_size, samples):
+    """global：训练一个全局字典；novel：每本小说各训练一个；样本不足的跳过"""
+    targets = [None]
+    if train == "novel":
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM novels WHERE id IN (SELECT DISTINCT novel_id FROM novel_chapter)")
+        targets = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    for novel_name in targets:
+        dict_data = train_dictionary(sample_contents(conn, novel_name, samples), dict_size)
+        label = novel_name or "全局"
+        if dict_data is None:
+            print(f"{label}：样本不足，跳过字典训练")
+            continue
+        dict_id = save_dictionary(conn, dict_data, novel_name)
+        # 导出用的解码器也需要新字典，才能解码本次转换过程中重新读取的数据
+        content_codec.add_dictionary(dict_id, dict_data, novel_name)
+        codec.add_dictionary(dict_id, dict_data, novel_name)
+        print(f"{label}：已训练字典 {dict_id}，大小 {len(dict_data)} 字节")
+
+
+def migrate(codec_name="zstd", level=3, train="global", dict_size=112640, samples=1000, vacuum=False):
+    conn = connect_db()
+    if conn is None:
+        return
+    cursor = conn.cursor()
+    create_content_storage(cursor, use_pg=use_pg)
+    conn.commit()
+
+    codec = ContentCodec(codec=codec_name, level=level)
+    if codec_name == "zstd" and not codec.enabled:
+        print("未安装 zstandard，无法压缩章节正文")
+        return
+    codec.load_dictionaries(cursor)
+    if codec.enabled and train != "none":
+        train_dictionaries(conn, codec, train, dict_size, samples)
+
+    placeholder = "%s" if use_pg else "?"
+    last_id = 0
+    converted = 0
+    hashed = 0
+    before = after = 0
+    while True:
+        cursor.execute(
+            f"""
+            SELECT id, novel_name, chapter_content, content_blob, dict_id, content_hash FROM novel_chapter
+            WHERE id > {placeholder} AND (chapter_content is not null OR content_blob is not null)
+            ORDER BY id LIMIT {MIGRATE_BATCH_SIZE}
+            """,
+            (last_id,),
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        updates = []
+        hash_updates = []
+        for chapter_id, novel_name, chapter_content, content_blob, dict_id, digest in rows:
+            last_id = chapter_id
+            if content_blob is None and not chapter_content:
+                continue
+            target_dict_id = codec.dict_id_for(novel_name) if codec.enabled else None
+            if (content_blob is not None) == codec.enabled and dict_id == target_dict_id:
+                # 已是目标格式，旧数据只补算正文哈希
+                if digest is None:
+                    text = content_codec.decode(chapter_content, content_blob, dict_id)
+                    hash_updates.append((content_hash(text), chapter_id))
+                continue
+            text = content_codec.decode(chapter_content, content_blob, dict_id)
+            if digest is None:
+                hash_updates.append((content_hash(text), chapter_id))
+            new_content, new_blob, new_dict_id = codec.encode(novel_name, text)
+            before += len(content_blob) if content_blob is not None else len(chapter_content.encode("utf-8"))
+            after += len(new_blob) if new_blob is not None else len(new_content.encode("utf-8"))
+            updates.append((new_content, new_blob, new_dict_id, chapter_id))
+        if updates:
+            cursor.executemany(
+                f"""
+                UPDATE novel_chapter SET chapter_content = {placeholder}, content_blob = {placeholder},
+                dict_id = {placeholder} WHERE id = {placeholder}
+                """,
+                updates,
+            )
+            converted += len(updates)
+        if hash_updates:
+            cursor.executemany(
+                f"UPDATE novel_chapter SET content_hash = {placeholder} WHERE id = {placeholder}",
+                hash_updates,
+            )
+            hashed += len(hash_updates)
+        conn.commit()
+        print(f"已处理到章节 id {last_id}，累计转换 {converted} 章")
+    conn.commit()
+
+    ratio = f"{after / before:.1%}" if before else "-"
+    print(f"转换完成：{converted} 章，正文 {before / 1e6:.1f}MB -> {after / 1e6:.1f}MB（{ratio}），补算正文哈希 {hashed} 章")
+    if vacuum:
+        # VACUUM 不能在事务中执行
+        if use_pg:
+            conn.autocommit = True
+            cursor.execute("VACUUM FULL novel_chapter")
+        else:
+            cursor.execute("VACUUM")
+        print("已回收数据库空间")
+    cursor.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="转换已入库章节正文的存储格式")
+    parser.add_argument(
+        "--codec",
+        choices=["zstd", "none"],
+        default="zstd",
+        help="目标格式：zstd 压缩，none 还原为明文",
+    )
+    parser.add_argument("--level", type=int, default=3, help="zstd 压缩级别")
+    parser.add_argument(
+        "--train",
+        choices=["global", "novel", "none"],
+        default="global",
+        help="训练压缩字典：global 全局一个，novel 每本小说一个，none 沿用已有字典",
+    )
+    parser.add_argument("--dict-size", type=int, default=112640, help="字典大小（字节）")
+    parser.add_argument("--samples", type=int, default=1000, help="每个字典的训练样本数")
+    parser.add_argument("--vacuum", action="store_true", help="转换后回收数据库空间")
+    args = parser.parse_args()
+    migrate(
+        codec_name=args.codec,
+        level=args.level,
+        train=args.train,
+        dict_size=args.dict_size,
+        samples=args.samples,
+        vacuum=args.vacuum,
+    )
@@ -0,0 +1,99 @@
+class KnownChapterIndex:
+    """已入库章节的内存索引
+
+    每本小说只在第一次用到时通过 loader 查询一次数据库，之后的判断都是字典查找；
+    pipeline 提交成功后调用 mark_* 同步索引，保证与数据库一致。
+    loader(novel_name) 需返回 (chapter_name, has_content, chapter_index) 的可迭代对象；
+    loader 为 None 时由调用方先异步查询，再通过 store 放入（见 auto_novel_top100_postgre）。
+    """
+
+    def __init__(self, loader=None):
+        self.loader = loader
+        self.exist_chapters = {}
+        self.content_exist_chapters = {}
+        self.chapter_indexes = {}
+
+    def loaded(self, novel_name):
+        return novel_name in self.exist_chapters
+
+    def store(self, novel_name, rows):
+        exist_chapters = set()
+        content_exist_chapters = set()
+        chapter_indexes = {}
+        for chapter_name, has_content, chapter_index in rows:
+            exist_chapters.add(chapter_name)
+            if has_content:
+                content_exist_chapters.add(chapter_name)
+            chapter_indexes[chapter_name] = chapter_index
+        self.exist_chapters[novel_name] = exist_chapters
+        self.content_exist_chapters[novel_name] = content_exist_chapters
+        self.chapter_indexes[novel_name] = chapter_indexes
+
+    def load(self, novel_name):
+        if novel_name not in self.exist_chapters:
+            if self.loader is None:
+                raise KeyError(f"小说章节索引尚未加载: {novel_name}")
+            self.store(novel_name, self.loader(novel_name))
+        return self.exist_chapters[novel_name], self.content_exist_chapters[novel_name]
+
+    def exists(self, novel_name, chapter_name):
+        return chapter_name in self.load(novel_name)[0]
+
+    def has_content(self, novel_name, chapter_name):
+        return chapter_name in self.load(novel_name)[1]
+
+    def index_of(self, novel_name, chapter_name):
+        self.load(novel_name)
+        return self.chapter_indexes[novel_name].get(chapter_name)
+
+    def mark_listed(self, novel_name, chapter_name, chapter_index=None):
+        # 未加载的小说下次 load 时会从数据库读到最新数据，无需记录
+        if novel_name in self.exist_chapters:
+            self.exist_chapters[novel_name].add(chapter_name)
+            if chapter_index is not None:
+                self.chapter_indexes[novel_name][chapter_name] = chapter_index
+
+    def mark_content(self, novel_name, chapter_name, chapter_index=None):
+        if novel_name in self.exist_chapters:
+            self.mark_listed(novel_name, chapter_name, chapter_index)
+            self.content_exist_chapters[novel_name].add(chapter_name)
+
+    def forget(self, novel_name):
+        self.exist_chapters.pop(novel_name, None)
+        self.content_exist_chapters.pop(novel_name, None)
+        self.chapter_indexes.pop(novel_name, None)
+
+
+class PendingWatermarks:
+    """章节列表处理完、但仍有章节正文未入库的小说的增量水位
+
+    spider 解析章节列表时 hold 水位及需要抓取正文的章节；pipeline 提交正文后调用 complete，
+    小说的章节全部入库时才返回水位交给 pipeline 写入。正文抓取失败或进程中断时水位不前进，
+    下一次增量爬取仍会重新处理该小说。只在 reactor 线程中使用。
+    """
+
+    def __init__(self):
+        self.pending = {}
+
+    def hold(self, watermark, chapter_names):
+        """没有待抓取的章节时直接返回水位，否则暂存并返回 None"""
+        chapter_names = set(chapter_names)
+        if not chapter_names:
+            self.pending.pop(watermark["NovelName"], None)
+            return watermark
+        self.pending[watermark["NovelName"]] = (watermark, chapter_names)
+        return None
+
+    def complete(self, keys):
+        """keys 为已提交正文的 (小说名, 章节名)，返回因此全部入库的小说的水位"""
+        released = []
+        for novel_name, chapter_name in keys:
+            entry = self.pending.get(novel_name)
+            if entry is None:
+                continue
+            watermark, chapter_names = entry
+            chapter_names.discard(chapter_name)
+            if not chapter_names:
+                del self.pending[novel_name]
+                released.append(watermark)
+        return released
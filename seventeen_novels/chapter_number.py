@@ -0,0 +1,94 @@
+# 章节号解析：从“第X章/回/节/卷/更”中提取章节序号，供入库回填与导出排序共用
+import re
+
+
+ARABIC_CHAPTER_RE = re.compile(r"第\s*0*([0-9]+)\s*(?:章|回|节|卷|更)")
+CHINESE_CHAPTER_RE = re.compile(
+    r"第\s*([一二三四五六七八九零十百千万亿〇两点]+)\s*(?:章|回|节|卷|更)"
+)
+REPEATED_UNIT_RE = re.compile(r"([一二三四五六七八九十百千万亿〇两点])\1+")
+
+
+# 中文数字转阿拉伯数字
+def chinese_to_arabic(cn: str) -> int:
+    cn_num = {
+        "零": 0,
+        "一": 1,
+        "二": 2,
+        "三": 3,
+        "四": 4,
+        "五": 5,
+        "六": 6,
+        "七": 7,
+        "八": 8,
+        "九": 9,
+        "〇": 0,
+        "两": 2,
+    }
+    cn_unit = {
+        "十": 10,
+        "百": 100,
+        "千": 1000,
+        "点": 1000,
+        "万": 10000,
+        "亿": 100000000,
+    }
+    unit, num = 1, 0
+    cn = cn.strip()
+    if not cn:
+        return 0
+    if cn.startswith("十"):
+        if len(cn) == 1:
+            return 10
+        else:
+            return 10 + chinese_to_arabic(cn[1:])
+    total = 0
+    unit = 1
+    i = len(cn) - 1
+    while i >= 0:
+        c = cn[i]
+        if c in cn_num:
+            num = cn_num[c]
+            total += num * unit
+            i -= 1
+        elif c in cn_unit:
+            unit = cn_unit[c]
+            if unit in (10000, 100000000):
+                if total == 0:
+                    total = 1
+                total = total * unit
+            i -= 1
+        else:
+            i -= 1
+    return total
+
+
+def clean_chapter_name(name):
+    return REPEATED_UNIT_RE.sub(r"\1", name)
+
+
+def extract_chapter_number(chapter_name):
+    # 先匹配阿拉伯数字
+    m = ARABIC_CHAPTER_RE.search(chapter_name)
+    if m:
+        return int(m.group(1))
+    # 再匹配中文数字
+    m = CHINESE_CHAPTER_RE.search(chapter_name)
+    if m:
+        clean_num = clean_chapter_name(m.group(1))
+        return chinese_to_arabic(clean_num)
+    return float("inf")
+
+
+def is_numbered_chapter(chapter_name):
+    # 只保留章节名中包含“第XX章/回/节/卷/更”的项
+    return bool(chapter_name) and (
+        ("第" in chapter_name)
+        and (
+            ("章" in chapter_name)
+            or ("回" in chapter_name)
+            or ("节" in chapter_name)
+            or ("卷" in chapter_name)
+            or ("更" in chapter_name)
+        )
+    )
@@ -0,0 +1,130 @@
+# 章节抓取断点续爬：待抓取的章节正文请求持久化到 SQLite 日志，
+# pipeline 提交章节后才从日志中确认删除；进程被杀后重启时直接从日志恢复请求
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from scrapy import signals
+
+logger = logging.getLogger(__name__)
+
+# 设置了 JOBDIR 时日志与 Scrapy 的作业状态放在同一目录
+JOBDIR_CHECKPOINT_FILE = "chapter_checkpoint.db"
+
+
+class CrawlCheckpoint:
+    """chapter_request：已交给调度器、但章节尚未入库的请求，按 (小说名, 章节名) 唯一
+    listed_novel：本轮已处理完章节列表的小说，恢复时不再请求其章节列表
+    checkpoint_state：本轮开始时间；存在即说明上一轮没有正常结束
+
+    record/mark_listed 的写入在 commit 时才落盘；ack 在 pipeline 提交数据库后调用，立即落盘。
+    爬虫以 finished 正常结束时清空日志，其他原因（被杀、Ctrl-C、CloseSpider）保留以便续爬。
+    """
+
+    def __init__(self, path, crawler=None):
+        self.path = path
+        # 爬虫在 from_crawler 中创建日志时 crawler.stats 尚未就绪，用到时再取
+        self.crawler = crawler
+        self.conn = None
+        self.resuming = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("CRAWL_CHECKPOINT_ENABLED", False):
+            return None
+        jobdir = settings.get("JOBDIR")
+        if jobdir:
+            path = os.path.join(jobdir, JOBDIR_CHECKPOINT_FILE)
+        else:
+            path = settings.get("CRAWL_CHECKPOINT_FILE", "output/crawl_checkpoint.db")
+        checkpoint = cls(path, crawler=crawler)
+        crawler.signals.connect(checkpoint.open, signal=signals.spider_opened)
+        crawler.signals.connect(checkpoint.close, signal=signals.spider_closed)
+        return checkpoint
+
+    def open(self, spider=None):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chapter_request (
+                novel_name TEXT NOT NULL,
+                chapter_name TEXT NOT NULL,
+                url TEXT NOT NULL,
+                meta TEXT,
+                PRIMARY KEY (novel_name, chapter_name)
+            )
+        """
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS listed_novel (novel_name TEXT PRIMARY KEY)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS checkpoint_state (started_at REAL)")
+        started_at = self.conn.execute("SELECT started_at FROM checkpoint_state").fetchone()
+        self.resuming = started_at is not None
+        if self.resuming:
+            logger.info(
+                f"发现未完成的抓取（开始于 {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started_at[0]))}），"
+                f"待抓取章节 {self.pending_count()} 个，已列出小说 {len(self.listed_novels())} 本；"
+                f"删除 {self.path} 可放弃续爬"
+            )
+        else:
+            self.conn.execute("INSERT INTO checkpoint_state (started_at) VALUES (?)", (time.time(),))
+        self.conn.commit()
+
+    def close(self, spider=None, reason=None):
+        if self.conn is None:
+            return
+        if reason == "finished":
+            # 正常结束：未抓到的章节下次由数据库中缺失的正文重新发现
+            self.conn.execute("DELETE FROM chapter_request")
+            self.conn.execute("DELETE FROM listed_novel")
+            self.conn.execute("DELETE FROM checkpoint_state")
+        else:
+            logger.info(f"抓取未正常结束（{reason}），保留断点，待抓取章节 {self.pending_count()} 个")
+        self.conn.commit()
+        self.conn.close()
+        self.conn = None
+
+    def record(self, novel_name, chapter_name, url, meta):
+        self.conn.execute(  # type: ignore
+            "INSERT OR REPLACE INTO chapter_request (novel_name, chapter_name, url, meta) VALUES (?, ?, ?, ?)",
+            (novel_name, chapter_name, url, json.dumps(meta, ensure_ascii=False)),
+        )
+        self._inc_stats("checkpoint/recorded")
+
+    def mark_listed(self, novel_name):
+        self.conn.execute("INSERT OR IGNORE INTO listed_novel (novel_name) VALUES (?)", (novel_name,))  # type: ignore
+
+    def commit(self):
+        self.conn.commit()  # type: ignore
+
+    def ack(self, keys):
+        """keys 为已提交入库的 (小说名, 章节名)"""
+        if self.conn is None:
+            return
+        keys = list(keys)
+        if not keys:
+            return
+        self.conn.executemany("DELETE FROM chapter_request WHERE novel_name = ? AND chapter_name = ?", keys)
+        self.conn.commit()
+        self._inc_stats("checkpoint/acked", len(keys))
+
+    def pending(self):
+        """返回 (url, meta) 列表"""
+        rows = self.conn.execute("SELECT url, meta FROM chapter_request ORDER BY rowid").fetchall()  # type: ignore
+        self._inc_stats("checkpoint/resumed", len(rows))
+        return [(url, json.loads(meta) if meta else {}) for url, meta in rows]
+
+    def pending_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM chapter_request").fetchone()[0]  # type: ignore
+
+    def listed_novels(self):
+        return {row[0] for row in self.conn.execute("SELECT novel_name FROM listed_novel")}  # type: ignore
+
+    def _inc_stats(self, key, count=1):
+        if self.crawler is not None:
+            self.crawler.stats.inc_value(key, count)
@@ -0,0 +1,233 @@
+# 章节正文存储编码：可选地用 zstd（配合训练好的字典）压缩后存入 content_blob 列
+# 压缩后 chapter_content 置为 NULL，读取时通过 ContentCodec.decode 透明还原
+# content_hash 为明文正文的哈希，与存储编码无关；哈希变化记录在 chapter_revision 中
+import hashlib
+import logging
+
+try:
+    import zstandard
+
+    has_zstd = True
+except ImportError:
+    has_zstd = False
+
+logger = logging.getLogger(__name__)
+
+# 训练字典时最少需要的样本数，样本太少时训练会失败或没有收益
+MIN_DICT_SAMPLES = 20
+
+
+def content_hash(content):
+    """明文正文的 128 位 BLAKE2b 十六进制摘要，没有正文时返回 None"""
+    if not content:
+        return None
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def create_content_storage(cursor, use_pg=False):
+    """为 novel_chapter 补充压缩正文列与正文哈希列，并创建字典表和修订记录表"""
+    if use_pg:
+        cursor.execute(
+            """
+            ALTER TABLE novel_chapter
+                ADD COLUMN IF NOT EXISTS content_blob BYTEA,
+                ADD COLUMN IF NOT EXISTS dict_id INTEGER,
+                ADD COLUMN IF NOT EXISTS content_hash TEXT
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS content_dict (
+                dict_id SERIAL PRIMARY KEY,
+                novel_name TEXT,
+                dict_data BYTEA,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """
+        )
+    else:
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(novel_chapter)")}
+        if "content_blob" not in columns:
+            cursor.execute("ALTER TABLE novel_chapter ADD COLUMN content_blob BLOB")
+        if "dict_id" not in columns:
+            cursor.execute("ALTER TABLE novel_chapter ADD COLUMN dict_id INTEGER")
+        if "content_hash" not in columns:
+            cursor.execute("ALTER TABLE novel_chapter ADD COLUMN content_hash TEXT")
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS content_dict (
+                dict_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                novel_name TEXT,
+                dict_data BLOB,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """
+        )
+    create_revision_tracking(cursor, use_pg=use_pg)
+
+
+def create_revision_tracking(cursor, use_pg=False):
+    """chapter_revision 按时间记录每个章节的正文哈希，由触发器在哈希变化时写入
+
+    旧数据的 content_hash 为 NULL，首次写入哈希时也会记录一条。
+    """
+    if use_pg:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chapter_revision (
+                id SERIAL PRIMARY KEY,
+                chapter_id INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE OR REPLACE FUNCTION record_chapter_revision() RETURNS trigger AS $$
+            BEGIN
+                IF NEW.content_hash IS NOT NULL
+                        AND (TG_OP = 'INSERT' OR NEW.content_hash IS DISTINCT FROM OLD.content_hash) THEN
+                    INSERT INTO chapter_revision (chapter_id, content_hash) VALUES (NEW.id, NEW.content_hash);
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """
+        )
+        # 已存在时不重建，避免每次启动都对章节表加排他锁
+        cursor.execute(
+            "SELECT 1 FROM pg_trigger WHERE tgname = 'chapter_revision_trigger' "
+            "AND tgrelid = 'novel_chapter'::regclass"
+        )
+        if cursor.fetchone() is None:
+            cursor.execute(
+                """
+                CREATE TRIGGER chapter_revision_trigger
+                AFTER INSERT OR UPDATE OF content_hash ON novel_chapter
+                FOR EACH ROW EXECUTE FUNCTION record_chapter_revision()
+            """
+            )
+    else:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chapter_revision (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chapter_id INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                recorded_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS chapter_revision_insert AFTER INSERT ON novel_chapter
+            WHEN NEW.content_hash IS NOT NULL
+            BEGIN
+                INSERT INTO chapter_revision (chapter_id, content_hash) VALUES (NEW.id, NEW.content_hash);
+            END
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS chapter_revision_update AFTER UPDATE OF content_hash ON novel_chapter
+            WHEN NEW.content_hash IS NOT NULL AND NEW.content_hash IS NOT OLD.content_hash
+            BEGIN
+                INSERT INTO chapter_revision (chapter_id, content_hash) VALUES (NEW.id, NEW.content_hash);
+            END
+        """
+        )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_revision_chapter ON chapter_revision(chapter_id, id)")
+
+
+def train_dictionary(samples, dict_size=112640):
+    """用章节正文样本训练 zstd 字典，样本不足时返回 None"""
+    samples = [sample.encode("utf-8") for sample in samples if sample]
+    if len(samples) < MIN_DICT_SAMPLES:
+        return None
+    return zstandard.train_dictionary(dict_size, samples).as_bytes()
+
+
+class ContentCodec:
+    """codec 为 none 时正文原样存入 chapter_content；为 zstd 时压缩后存入 content_blob
+
+    dict_id 指向 content_dict 中的字典，NULL 表示压缩时未使用字典。
+    小说有专属字典时优先使用，否则使用最新的全局字典（novel_name 为 NULL）。
+    decode 与 codec 设置无关，库中新旧两种格式混存时都能读取。
+    """
+
+    def __init__(self, codec="none", level=3):
+        if codec == "zstd" and not has_zstd:
+            logger.warning("未安装 zstandard，章节正文不压缩")
+            codec = "none"
+        self.codec = codec
+        self.level = level
+        self.dictionaries = {}
+        self.novel_dicts = {}
+        self.global_dict_id = None
+        self._compressors = {}
+        self._decompressors = {}
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            codec=settings.get("CHAPTER_CONTENT_CODEC", "none"),
+            level=settings.getint("CHAPTER_CONTENT_COMPRESSION_LEVEL", 3),
+        )
+
+    @property
+    def enabled(self):
+        return self.codec == "zstd"
+
+    def load_dictionaries(self, cursor):
+        cursor.execute("SELECT dict_id, novel_name, dict_data FROM content_dict ORDER BY dict_id")
+        for dict_id, novel_name, dict_data in cursor.fetchall():
+            self.add_dictionary(dict_id, bytes(dict_data), novel_name)
+
+    def add_dictionary(self, dict_id, dict_data, novel_name=None):
+        self.dictionaries[dict_id] = dict_data
+        if novel_name:
+            self.novel_dicts[novel_name] = dict_id
+        else:
+            self.global_dict_id = dict_id
+
+    def dict_id_for(self, novel_name):
+        return self.novel_dicts.get(novel_name, self.global_dict_id)
+
+    def _compressor(self, dict_id):
+        compressor = self._compressors.get(dict_id)
+        if compressor is None:
+            dict_data = None
+            if dict_id is not None:
+                dict_data = zstandard.ZstdCompressionDict(self.dictionaries[dict_id])
+            compressor = self._compressors[dict_id] = zstandard.ZstdCompressor(
+                level=self.level, dict_data=dict_data
+            )
+        return compressor
+
+    def _decompressor(self, dict_id):
+        decompressor = self._decompressors.get(dict_id)
+        if decompressor is None:
+            dict_data = None
+            if dict_id is not None:
+                if dict_id not in self.dictionaries:
+                    raise KeyError(f"content_dict 中缺少字典 {dict_id}")
+                dict_data = zstandard.ZstdCompressionDict(self.dictionaries[dict_id])
+            decompressor = self._decompressors[dict_id] = zstandard.ZstdDecompressor(
+                dict_data=dict_data
+            )
+        return decompressor
+
+    def encode(self, novel_name, content):
+        """返回写入数据库的 (chapter_content, content_blob, dict_id)"""
+        if not content or not self.enabled:
+            return content, None, None
+        dict_id = self.dict_id_for(novel_name)
+        return None, self._compressor(dict_id).compress(content.encode("utf-8")), dict_id
+
+    def decode(self, chapter_content, content_blob, dict_id):
+        if content_blob is None:
+            return chapter_content
+        if not has_zstd:
+            raise RuntimeError("读取压缩的章节正文需要安装 zstandard")
+        return self._decompressor(dict_id).decompress(bytes(content_blob)).decode("utf-8")
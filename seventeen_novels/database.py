@@ -0,0 +1,88 @@
+# PostgreSQL 访问层：线程安全连接池 + 专用线程池，spider 回调中 await 查询，不阻塞 Twisted reactor
+import logging
+
+from psycopg2 import pool
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+logger = logging.getLogger(__name__)
+
+
+def _fetchall(cursor, sql, params=None):
+    cursor.execute(sql, params)
+    return cursor.fetchall()
+
+
+class PgDatabase:
+    """spider 与 pipeline 共用的 PostgreSQL 连接池
+
+    run(fn, *args) 在工作线程中执行 fn(cursor, *args)，成功提交、异常回滚，返回 Deferred；
+    回调中用 await maybe_deferred_to_future(...) 等待，查询往返期间下载照常进行。
+    pool 是 ThreadedConnectionPool，reactor 线程中也可以直接 getconn/putconn（pipeline 写入）；
+    write-behind 的写线程（writers 个）各占一个连接，工作线程数不超过 maxconn - writers - 1，
+    同步使用时总有空闲连接，getconn 不会因连接池耗尽抛出 PoolError。
+    open/close 可重复调用，由创建者负责 close。
+    """
+
+    def __init__(self, params, minconn=1, maxconn=4, threads=4, writers=0):
+        self.params = params
+        self.minconn = max(int(minconn), 1)
+        self.writers = max(int(writers), 0)
+        self.maxconn = max(int(maxconn), self.minconn, self.writers + 2)
+        self.threads = min(max(int(threads), 1), self.maxconn - self.writers - 1)
+        self.pool = None
+        self.threadpool = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            {
+                "host": settings.get("PG_HOST"),
+                "port": settings.get("PG_PORT"),
+                "user": settings.get("PG_USER"),
+                "password": settings.get("PG_PASSWORD"),
+                "dbname": settings.get("PG_DBNAME"),
+            },
+            minconn=settings.getint("PG_MINCONN", 1),
+            maxconn=settings.getint("PG_MAXCONN", 4),
+            threads=settings.getint("PG_QUERY_THREADS", 2),
+            # pipeline 的 write-behind 写线程
+            writers=1 if settings.getbool("WRITE_BEHIND_ENABLED", True) else 0,
+        )
+
+    def open(self):
+        if self.pool is not None:
+            return
+        self.pool = pool.ThreadedConnectionPool(self.minconn, self.maxconn, **self.params)
+        self.threadpool = ThreadPool(minthreads=0, maxthreads=self.threads, name="postgres")
+        self.threadpool.start()
+        logger.debug(f"PostgreSQL 连接池已创建，最大连接数: {self.maxconn}，查询线程数: {self.threads}")
+
+    def close(self):
+        if self.threadpool is not None:
+            self.threadpool.stop()
+            self.threadpool = None
+        if self.pool is not None:
+            self.pool.closeall()
+            self.pool = None
+
+    def run(self, fn, *args):
+        from twisted.internet import reactor
+
+        return deferToThreadPool(reactor, self.threadpool, self._run, fn, *args)
+
+    def fetchall(self, sql, params=None):
+        """返回 Deferred，结果为 cursor.fetchall()"""
+        return self.run(_fetchall, sql, params)
+
+    def _run(self, fn, *args):
+        conn = self.pool.getconn()  # type: ignore
+        try:
+            result = fn(conn.cursor(), *args)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)  # type: ignore
@@ -0,0 +1,205 @@
+# 流式 EPUB 生成：章节到达即写入 zip，结束时根据章节元数据生成目录和 OPF
+# 内存占用只与单个章节大小有关，不依赖 ebooklib
+import html
+import os
+import uuid
+import zipfile
+from datetime import datetime, timezone
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+CHAPTER_XHTML = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="{lang}" xml:lang="{lang}">
+<head>
+<title>{title}</title>
+</head>
+<body>
+<h1>{title}</h1>
+{paragraphs}
+</body>
+</html>
+"""
+
+
+def book_identifier(title, author):
+    """同一作者的同名小说每次导出得到相同的标识，阅读器据此识别为同一本书"""
+    return f"urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, f'seventeen_novels/{author}/{title}')}"
+
+
+def _volume_groups(chapters):
+    """把连续的同卷章节合并为 (卷名, [章节]) ，没有卷名的章节单独成组"""
+    groups = []
+    for chapter in chapters:
+        volume = chapter[2]
+        if volume and groups and groups[-1][0] == volume:
+            groups[-1][1].append(chapter)
+        else:
+            groups.append((volume, [chapter]))
+    return groups
+
+
+class StreamingEpubWriter:
+    """按顺序调用 add_chapter 写入章节，最后调用 close 生成目录并完成文件
+
+    先写到同目录的临时文件，close 成功后才替换目标文件，中途出错不会留下损坏的 EPUB。
+    """
+
+    def __init__(self, path, title, author="未知", language="zh", identifier=None):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.title = title
+        self.author = author
+        self.language = language
+        self.identifier = identifier or book_identifier(title, author)
+        # 只保留 (文件名, 章节名, 卷名)，正文写入后即释放
+        self.chapters = []
+        self.zip = zipfile.ZipFile(self.tmp_path, "w")
+        # mimetype 必须是第一个且不压缩
+        self.zip.writestr(
+            zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED
+        )
+        self._write("META-INF/container.xml", CONTAINER_XML)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write(self, name, text):
+        self.zip.writestr(name, text.encode("utf-8"), compress_type=zipfile.ZIP_DEFLATED)
+
+    def add_chapter(self, volume_title, chapter_name, content):
+        file_name = f"chap_{len(self.chapters) + 1}.xhtml"
+        title = html.escape(chapter_name or "")
+        paragraphs = "\n".join(
+            f"<p>{html.escape(line)}</p>" for line in (content or "").split("\n") if line
+        )
+        self._write(
+            f"OEBPS/{file_name}",
+            CHAPTER_XHTML.format(lang=self.language, title=title, paragraphs=paragraphs),
+        )
+        self.chapters.append((file_name, chapter_name or "", volume_title or ""))
+
+    def close(self):
+        self._write("OEBPS/nav.xhtml", self._nav())
+        self._write("OEBPS/toc.ncx", self._ncx())
+        self._write("OEBPS/content.opf", self._opf())
+        self.zip.close()
+        os.replace(self.tmp_path, self.path)
+        return len(self.chapters)
+
+    def abort(self):
+        self.zip.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def _nav(self):
+        items = []
+        for volume, chapters in _volume_groups(self.chapters):
+            links = "\n".join(
+                f'<li><a href="{file_name}">{html.escape(name)}</a></li>'
+                for file_name, name, _ in chapters
+            )
+            if volume:
+                items.append(f"<li><span>{html.escape(volume)}</span>\n<ol>\n{links}\n</ol>\n</li>")
+            else:
+                items.append(links)
+        title = html.escape(self.title)
+        return f"""<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="{self.language}" xml:lang="{self.language}">
+<head>
+<title>{title}</title>
+</head>
+<body>
+<nav epub:type="toc" id="toc">
+<h1>{title}</h1>
+<ol>
+{chr(10).join(items)}
+</ol>
+</nav>
+</body>
+</html>
+"""
+
+    def _ncx(self):
+        play_order = 0
+        points = []
+
+        def nav_point(label, file_name, children=""):
+            nonlocal play_order
+            play_order += 1
+            return (
+                f'<navPoint id="navpoint-{play_order}" playOrder="{play_order}">'
+                f"<navLabel><text>{html.escape(label)}</text></navLabel>"
+                f'<content src="{file_name}"/>{children}</navPoint>'
+            )
+
+        for volume, chapters in _volume_groups(self.chapters):
+            if volume:
+                # 卷节点指向本卷第一章，需先占用 playOrder
+                play_order += 1
+                volume_order = play_order
+                children = "\n".join(nav_point(name, file_name) for file_name, name, _ in chapters)
+                points.append(
+                    f'<navPoint id="navpoint-{volume_order}" playOrder="{volume_order}">'
+                    f"<navLabel><text>{html.escape(volume)}</text></navLabel>"
+                    f'<content src="{chapters[0][0]}"/>\n{children}\n</navPoint>'
+                )
+            else:
+                points.extend(nav_point(name, file_name) for file_name, name, _ in chapters)
+        return f"""<?xml version="1.0" encoding="utf-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+<head>
+<meta name="dtb:uid" content="{html.escape(self.identifier)}"/>
+<meta name="dtb:depth" content="2"/>
+<meta name="dtb:totalPageCount" content="0"/>
+<meta name="dtb:maxPageNumber" content="0"/>
+</head>
+<docTitle><text>{html.escape(self.title)}</text></docTitle>
+<navMap>
+{chr(10).join(points)}
+</navMap>
+</ncx>
+"""
+
+    def _opf(self):
+        modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        manifest = "\n".join(
+            f'<item id="chap_{i}" href="{file_name}" media-type="application/xhtml+xml"/>'
+            for i, (file_name, _, _) in enumerate(self.chapters, start=1)
+        )
+        spine = "\n".join(
+            f'<itemref idref="chap_{i}"/>' for i in range(1, len(self.chapters) + 1)
+        )
+        return f"""<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id" xml:lang="{self.language}">
+<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+<dc:identifier id="id">{html.escape(self.identifier)}</dc:identifier>
+<dc:title>{html.escape(self.title)}</dc:title>
+<dc:language>{self.language}</dc:language>
+<dc:creator id="creator">{html.escape(self.author)}</dc:creator>
+<meta property="dcterms:modified">{modified}</meta>
+</metadata>
+<manifest>
+<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>
+{manifest}
+</manifest>
+<spine toc="ncx">
+<itemref idref="nav"/>
+{spine}
+</spine>
+</package>
+"""
@@ -0,0 +1,364 @@
+# 自适应限速：按反爬验证页比例和下载延迟实时调整每个下载 slot 的并发数与下载间隔
+# 分阶段统计：下载、Selenium、回调、数据库写入耗时与各队列长度的直方图
+import bisect
+import logging
+import os
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from . import signals as novel_signals
+
+logger = logging.getLogger(__name__)
+
+
+class _SlotState:
+    def __init__(self, concurrency):
+        self.concurrency = float(concurrency)
+        self.challenge_ratio = 0.0
+        self.latency = None
+        self.last_backoff = 0.0
+
+
+class AdaptiveThrottle:
+    """AIMD 方式调整下载 slot 的 concurrency 与 delay
+
+    每个经过反爬检测的响应（不含缓存命中和 Selenium 渲染）更新该 slot 的
+    验证页比例与下载延迟的指数滑动平均：
+    - 验证页比例达到 BACKOFF 或延迟超过目标 2 倍：并发乘以 BACKOFF_FACTOR、间隔翻倍，
+      COOLDOWN 秒内最多退避一次
+    - 验证页比例低于 WARN 且延迟不超过目标、本次不是验证页：并发约每轮增加 1、间隔减少 DELAY_STEP
+    - 介于两者之间时保持不变，在验证页比例升高前就停止加压
+    当前状态写入 stats 的 adaptive_throttle/<slot>/* 下。
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool("ADAPTIVE_THROTTLE_ENABLED", False):
+            raise NotConfigured("Adaptive throttle disabled")
+        if settings.getbool("AUTOTHROTTLE_ENABLED"):
+            raise NotConfigured("AutoThrottle 已开启，不再启用 AdaptiveThrottle")
+        self.crawler = crawler
+        self.stats = crawler.stats
+        max_concurrency = settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN")
+        self.max_concurrency = settings.getint("ADAPTIVE_THROTTLE_MAX_CONCURRENCY", max_concurrency)
+        self.min_concurrency = max(settings.getint("ADAPTIVE_THROTTLE_MIN_CONCURRENCY", 1), 1)
+        self.start_concurrency = min(
+            settings.getint("ADAPTIVE_THROTTLE_START_CONCURRENCY", 8), self.max_concurrency
+        )
+        self.min_delay = settings.getfloat("DOWNLOAD_DELAY")
+        self.max_delay = settings.getfloat("ADAPTIVE_THROTTLE_MAX_DELAY", 10.0)
+        self.delay_step = settings.getfloat("ADAPTIVE_THROTTLE_DELAY_STEP", 0.05)
+        self.target_latency = settings.getfloat("ADAPTIVE_THROTTLE_TARGET_LATENCY", 2.0)
+        self.warn_ratio = settings.getfloat("ADAPTIVE_THROTTLE_CHALLENGE_WARN", 0.01)
+        self.backoff_ratio = settings.getfloat("ADAPTIVE_THROTTLE_CHALLENGE_BACKOFF", 0.05)
+        self.backoff_factor = settings.getfloat("ADAPTIVE_THROTTLE_BACKOFF_FACTOR", 0.5)
+        self.cooldown = settings.getfloat("ADAPTIVE_THROTTLE_COOLDOWN", 5.0)
+        self.alpha = settings.getfloat("ADAPTIVE_THROTTLE_EWMA_ALPHA", 0.05)
+        self.states = {}
+        crawler.signals.connect(self._request_reached, signal=signals.request_reached_downloader)
+        crawler.signals.connect(self._antibot_checked, signal=novel_signals.antibot_checked)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def _get_slot(self, request):
+        key = request.meta.get("download_slot")
+        if key is None:
+            return None, None
+        return key, self.crawler.engine.downloader.slots.get(key)
+
+    def _request_reached(self, request, spider=None):
+        # slot 由下载器按需创建，空闲回收后会重建，需重新应用当前并发
+        key, slot = self._get_slot(request)
+        if slot is None:
+            return
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = _SlotState(self.start_concurrency)
+            slot.delay = max(slot.delay, self.min_delay)
+            logger.info(f"自适应限速: {key} 初始并发 {self.start_concurrency}，间隔 {slot.delay:.2f} 秒")
+            self._record(key, state, slot)
+        slot.concurrency = int(state.concurrency)
+
+    def _antibot_checked(self, request, response, spider, challenge):
+        if request.meta.get("selenium") or "cached" in response.flags:
+            return
+        key, slot = self._get_slot(request)
+        if slot is None:
+            return
+        state = self.states.setdefault(key, _SlotState(slot.concurrency))
+        state.challenge_ratio += self.alpha * ((1.0 if challenge else 0.0) - state.challenge_ratio)
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            if state.latency is None:
+                state.latency = latency
+            else:
+                state.latency += self.alpha * (latency - state.latency)
+        latency = state.latency or 0.0
+
+        if state.challenge_ratio >= self.backoff_ratio or latency > self.target_latency * 2:
+            now = time.monotonic()
+            if now - state.last_backoff < self.cooldown:
+                return
+            state.last_backoff = now
+            state.concurrency = max(state.concurrency * self.backoff_factor, self.min_concurrency)
+            slot.delay = min(max(slot.delay * 2, self.delay_step), self.max_delay)
+            self.stats.inc_value(f"adaptive_throttle/{key}/backoffs")
+            logger.warning(
+                f"自适应限速退避: {key} 验证页比例 {state.challenge_ratio:.1%}，延迟 {latency:.2f} 秒，"
+                f"并发降为 {int(state.concurrency)}，间隔 {slot.delay:.2f} 秒"
+            )
+        elif state.challenge_ratio < self.warn_ratio and latency <= self.target_latency and not challenge:
+            # 每收到约 concurrency 个干净响应，并发加 1
+            state.concurrency = min(state.concurrency + 1.0 / state.concurrency, self.max_concurrency)
+            slot.delay = max(slot.delay - self.delay_step, self.min_delay)
+        slot.concurrency = int(state.concurrency)
+        self._record(key, state, slot)
+
+    def _record(self, key, state, slot):
+        self.stats.set_value(f"adaptive_throttle/{key}/concurrency", slot.concurrency)
+        self.stats.set_value(f"adaptive_throttle/{key}/delay_ms", int(slot.delay * 1000))
+        self.stats.set_value(f"adaptive_throttle/{key}/challenge_ratio", round(state.challenge_ratio, 4))
+        if state.latency is not None:
+            self.stats.set_value(f"adaptive_throttle/{key}/latency_ms", int(state.latency * 1000))
+
+
+# 耗时直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 队列长度直方图的桶上界（个）
+DEPTH_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000)
+# Prometheus 标签名：pipeline 按写入操作区分，其余阶段按回调区分
+STAGE_LABELS = {"pipeline": "operation"}
+
+
+def callback_name(request):
+    callback = request.callback
+    if callback is None:
+        return "parse"
+    return getattr(callback, "__name__", str(callback))
+
+
+class Histogram:
+    """累积分桶直方图，对应 Prometheus histogram 的 bucket/sum/count"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # 最后一个计数对应 +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative(self):
+        """返回 [(le, 累计个数)]，最后一项为 +Inf"""
+        result = []
+        total = 0
+        for le, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            result.append((le, total))
+        return result
+
+    def quantile(self, q):
+        """与 PromQL histogram_quantile 相同，在所在桶内线性插值，不超过实际最大值"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets, self.counts):
+            if count and total + count >= rank:
+                return min(lower + (upper - lower) * (rank - total) / count, self.max)
+            total += count
+            lower = upper
+        return self.max
+
+
+class StageMetrics:
+    """记录各阶段耗时与队列长度，判断慢的爬取是卡在网络、CPU、浏览器还是数据库
+
+    - download：下载延迟（不含缓存命中），按回调区分
+    - selenium：Selenium 渲染耗时，按回调区分
+    - callback：回调耗时，由 StageTimingMiddleware 通过 stage_timed 信号上报
+    - pipeline：数据库写入耗时，按写入操作区分，由 pipeline 通过 stage_timed 信号上报
+    - queue：每 SAMPLE_INTERVAL 秒采样调度器、下载器、scraper、pipeline 中的请求/条目数
+
+    每 INTERVAL 秒及爬虫结束时写入 stats 的 stage_metrics/<stage>/<name>/*，
+    设置了 PROMETHEUS_FILE 时同时原子地写入 Prometheus 文本格式文件，供 node_exporter 的 textfile collector 读取。
+    """
+
+    def __init__(self, crawler, interval=30.0, sample_interval=1.0, prometheus_file=None):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.interval = interval
+        self.sample_interval = sample_interval
+        self.prometheus_file = prometheus_file
+        self.histograms = {}
+        # 最近一次采样的队列长度
+        self.depths = {}
+        self.spider_name = None
+        self.dump_task = None
+        self.sample_task = None
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(self._response_received, signal=signals.response_received)
+        crawler.signals.connect(self._stage_timed, signal=novel_signals.stage_timed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("STAGE_METRICS_ENABLED", False):
+            raise NotConfigured("Stage metrics disabled")
+        return cls(
+            crawler,
+            interval=settings.getfloat("STAGE_METRICS_INTERVAL", 30.0),
+            sample_interval=settings.getfloat("STAGE_METRICS_SAMPLE_INTERVAL", 1.0),
+            prometheus_file=settings.get("STAGE_METRICS_PROMETHEUS_FILE") or None,
+        )
+
+    def spider_opened(self, spider):
+        self.spider_name = spider.name
+        if self.sample_interval > 0:
+            self.sample_task = task.LoopingCall(self.sample_queues)
+            self.sample_task.start(self.sample_interval, now=False)
+        if self.interval > 0:
+            self.dump_task = task.LoopingCall(self.dump)
+            self.dump_task.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason=None):
+        for looping_call in (self.sample_task, self.dump_task):
+            if looping_call and looping_call.running:
+                looping_call.stop()
+        self.sample_task = self.dump_task = None
+        self.dump()
+
+    def observe(self, stage, name, value):
+        key = (stage, name)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(DEPTH_BUCKETS if stage == "queue" else LATENCY_BUCKETS)
+        histogram.observe(value)
+
+    def _response_received(self, response, request, spider=None):
+        meta = request.meta
+        if "selenium_latency" in meta:
+            self.observe("selenium", callback_name(request), meta["selenium_latency"])
+        elif "download_latency" in meta and "cached" not in response.flags:
+            self.observe("download", callback_name(request), meta["download_latency"])
+
+    def _stage_timed(self, stage, name, seconds, spider=None):
+        self.observe(stage, name, seconds)
+
+    def sample_queues(self):
+        engine = self.crawler.engine
+        if engine is None:
+            return
+        # Scrapy 2.19 起为 engine.scheduler，之前为 engine.slot.scheduler
+        scheduler = getattr(engine, "scheduler", None)
+        if scheduler is None and getattr(engine, "slot", None) is not None:
+            scheduler = engine.slot.scheduler
+        depths = {}
+        if scheduler is not None:
+            depths["scheduler"] = len(scheduler)
+            if hasattr(scheduler, "held_backfill"):
+                depths["held_backfill"] = int(scheduler.held_backfill is not None)
+        depths["downloader"] = len(engine.downloader.active)
+        scraper_slot = engine.scraper.slot
+        if scraper_slot is not None:
+            depths["scraper"] = len(scraper_slot.active)
+            depths["pipeline"] = scraper_slot.itemproc_size
+        for name, depth in depths.items():
+            self.observe("queue", name, depth)
+        self.depths = depths
+
+    def dump(self):
+        for (stage, name), histogram in self.histograms.items():
+            prefix = f"stage_metrics/{stage}/{name}"
+            if stage == "queue":
+                self.stats.set_value(f"{prefix}/p50", round(histogram.quantile(0.5), 1))
+                self.stats.set_value(f"{prefix}/p99", round(histogram.quantile(0.99), 1))
+                self.stats.set_value(f"{prefix}/max", histogram.max)
+                continue
+            self.stats.set_value(f"{prefix}/count", histogram.count)
+            self.stats.set_value(f"{prefix}/total_s", round(histogram.sum, 3))
+            self.stats.set_value(f"{prefix}/p50_ms", round(histogram.quantile(0.5) * 1000, 3))
+            self.stats.set_value(f"{prefix}/p99_ms", round(histogram.quantile(0.99) * 1000, 3))
+            self.stats.set_value(f"{prefix}/max_ms", round(histogram.max * 1000, 3))
+        if self.prometheus_file:
+            try:
+                self.write_prometheus(self.prometheus_file)
+            except OSError as e:
+                logger.warning(f"写入 Prometheus 指标文件失败: {self.prometheus_file}: {e}")
+
+    @staticmethod
+    def _labels(**labels):
+        escaped = []
+        for key, value in labels.items():
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            escaped.append(f'{key}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def render_prometheus(self):
+        spider = self.spider_name or ""
+        lines = [
+            "# HELP novel_spider_stage_seconds 各阶段耗时（秒）",
+            "# TYPE novel_spider_stage_seconds histogram",
+        ]
+        queues = []
+        for (stage, name), histogram in sorted(self.histograms.items()):
+            if stage == "queue":
+                queues.append((name, histogram))
+                continue
+            labels = {"spider": spider, "stage": stage, STAGE_LABELS.get(stage, "callback"): name}
+            for le, count in histogram.cumulative():
+                lines.append(f"novel_spider_stage_seconds_bucket{self._labels(**labels, le=le)} {count}")
+            lines.append(f"novel_spider_stage_seconds_sum{self._labels(**labels)} {histogram.sum:.6f}")
+            lines.append(f"novel_spider_stage_seconds_count{self._labels(**labels)} {histogram.count}")
+        lines += [
+            "# HELP novel_spider_queue_depth 队列长度采样",
+            "# TYPE novel_spider_queue_depth histogram",
+        ]
+        for name, histogram in queues:
+            labels = {"spider": spider, "queue": name}
+            for le, count in histogram.cumulative():
+                lines.append(f"novel_spider_queue_depth_bucket{self._labels(**labels, le=le)} {count}")
+            lines.append(f"novel_spider_queue_depth_sum{self._labels(**labels)} {histogram.sum:g}")
+            lines.append(f"novel_spider_queue_depth_count{self._labels(**labels)} {histogram.count}")
+        lines += [
+            "# HELP novel_spider_queue_depth_current 最近一次采样的队列长度",
+            "# TYPE novel_spider_queue_depth_current gauge",
+        ]
+        for name, depth in sorted(self.depths.items()):
+            lines.append(f"novel_spider_queue_depth_current{self._labels(spider=spider, queue=name)} {depth}")
+        for metric, stats_key, help_text in (
+            ("novel_spider_responses_total", "response_received_count", "已接收的响应数"),
+            ("novel_spider_items_total", "item_scraped_count", "已处理的 item 数"),
+        ):
+            lines += [
+                f"# HELP {metric} {help_text}",
+                f"# TYPE {metric} counter",
+                f"{metric}{self._labels(spider=spider)} {self.stats.get_value(stats_key, 0)}",
+            ]
+        lines += [
+            "# HELP novel_spider_metrics_updated_seconds 指标文件写入时间",
+            "# TYPE novel_spider_metrics_updated_seconds gauge",
+            f"novel_spider_metrics_updated_seconds{self._labels(spider=spider)} {time.time():.3f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # textfile collector 可能随时读取，先写临时文件再替换
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
@@ -0,0 +1,56 @@
+# 章节正文提取：直接用 lxml 解析一次，单次遍历正文节点下的文本并过滤广告行
+import re
+
+from lxml import etree
+
+# 广告/推广行关键字
+AD_FILTER_KEYWORDS = [
+    "本书首发来自",
+    "第一时间看正版内容",
+    "17K小说网",
+    "作者寄语",
+    "banner_content",
+    "二维码",
+    "17K客户端",
+    "签到即送VIP",
+    "免费读全站",
+]
+AD_FILTER_RE = re.compile("|".join(re.escape(keyword) for keyword in AD_FILTER_KEYWORDS))
+
+# readAreaBox 下的全部文本节点（原先的并集 XPath 中 content 部分是它的子集）
+CHAPTER_TEXT_XPATH = etree.XPath(
+    '//div[contains(@class,"readAreaBox")]//text()', smart_strings=False
+)
+
+_parsers = {}
+
+
+def _html_parser(encoding):
+    parser = _parsers.get(encoding)
+    if parser is None:
+        parser = _parsers[encoding] = etree.HTMLParser(encoding=encoding)
+    return parser
+
+
+def is_ad_line(line):
+    return AD_FILTER_RE.search(line) is not None
+
+
+def extract_chapter_lines(body, encoding="utf-8"):
+    """从章节页 HTML（bytes）中提取去空白、去广告后的正文行"""
+    if not body:
+        return []
+    root = etree.fromstring(body, _html_parser(encoding))
+    if root is None:
+        return []
+    lines = []
+    for text in CHAPTER_TEXT_XPATH(root):
+        line = text.strip()
+        if line and not AD_FILTER_RE.search(line):
+            lines.append(line)
+    return lines
+
+
+def extract_chapter_content(response):
+    """提取章节正文，按行拼接"""
+    return "\n".join(extract_chapter_lines(response.body, response.encoding))
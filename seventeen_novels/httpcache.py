@@ -0,0 +1,201 @@
+# 项目专用的 HTTP 缓存：单文件 SQLite 存储 + 按页面类型区分有效期的缓存策略
+# 在 settings.py 中通过 HTTPCACHE_STORAGE / HTTPCACHE_POLICY 启用
+import gzip
+import logging
+import re
+import sqlite3
+from pathlib import Path
+from time import time
+
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.extensions.httpcache import RFC2616Policy
+from scrapy.http import Headers, TextResponse
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+from .antibot import AntiBotDetector
+
+try:
+    import zstandard
+
+    has_zstd = True
+except ImportError:
+    has_zstd = False
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteCacheStorage:
+    """所有响应保存在一个 SQLite 文件中，正文用 zstd（未安装时用 gzip）压缩"""
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.expiration_secs = settings.getint("HTTPCACHE_EXPIRATION_SECS")
+        self.db_file = settings.get("HTTPCACHE_SQLITE_FILE", "httpcache.db")
+        codec = settings.get("HTTPCACHE_COMPRESSION", "zstd")
+        if codec == "zstd" and not has_zstd:
+            logger.warning("未安装 zstandard，HTTP 缓存改用 gzip 压缩")
+            codec = "gzip"
+        self.codec = codec
+        self.level = settings.getint("HTTPCACHE_COMPRESSION_LEVEL", 3)
+        self.conn = None
+
+    def open_spider(self, spider):
+        db_path = Path(self.cachedir, self.db_file)
+        self.conn = sqlite3.connect(str(db_path), isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                fingerprint TEXT PRIMARY KEY,
+                url TEXT,
+                status INTEGER,
+                headers BLOB,
+                body BLOB,
+                codec TEXT,
+                stored_at REAL
+            )
+        """
+        )
+        self._fingerprinter = spider.crawler.request_fingerprinter
+        logger.debug(f"HTTP 缓存文件: {db_path}，压缩方式: {self.codec}")
+
+    def close_spider(self, spider):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def retrieve_response(self, spider, request):
+        key = self._fingerprinter.fingerprint(request).hex()
+        row = self.conn.execute(  # type: ignore
+            "SELECT url, status, headers, body, codec, stored_at FROM responses WHERE fingerprint = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        url, status, raw_headers, body, codec, stored_at = row
+        if 0 < self.expiration_secs < time() - stored_at:
+            return None
+        # 供缓存策略按存入时间计算页面年龄
+        request.meta["cache_timestamp"] = stored_at
+        headers = Headers(headers_raw_to_dict(raw_headers))
+        body = self._decompress(body, codec)
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        key = self._fingerprinter.fingerprint(request).hex()
+        if "cached" in response.flags:
+            # 304 重新验证后 Scrapy 会把缓存响应再存一次，正文未变，只刷新响应头和存入时间
+            self.touch_response(spider, request, response.headers)
+            return
+        headers = response.headers.copy()
+        if isinstance(response, TextResponse) and b"Content-Type" not in headers:
+            # Selenium 渲染的页面没有响应头，保存编码以便原样还原
+            headers[b"Content-Type"] = f"text/html; charset={response.encoding}"
+        self.conn.execute(  # type: ignore
+            """
+            INSERT OR REPLACE INTO responses (
+                fingerprint, url, status, headers, body, codec, stored_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+            (
+                key,
+                response.url,
+                response.status,
+                headers_dict_to_raw(headers),
+                self._compress(response.body),
+                self.codec,
+                time(),
+            ),
+        )
+
+    def touch_response(self, spider, request, headers=None):
+        """缓存的响应通过重新验证，从现在起重新计算有效期"""
+        key = self._fingerprinter.fingerprint(request).hex()
+        if headers is None:
+            self.conn.execute("UPDATE responses SET stored_at = ? WHERE fingerprint = ?", (time(), key))  # type: ignore
+        else:
+            self.conn.execute(  # type: ignore
+                "UPDATE responses SET stored_at = ?, headers = ? WHERE fingerprint = ?",
+                (time(), headers_dict_to_raw(headers), key),
+            )
+
+    def _compress(self, body):
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress(body)
+        if self.codec == "gzip":
+            return gzip.compress(body, compresslevel=self.level)
+        return body
+
+    @staticmethod
+    def _decompress(body, codec):
+        if codec == "zstd":
+            return zstandard.ZstdDecompressor().decompress(body)
+        if codec == "gzip":
+            return gzip.decompress(body)
+        return body
+
+
+class NovelCachePolicy(RFC2616Policy):
+    """按 URL 类型设置缓存有效期，从不缓存反爬虫验证页
+
+    HTTPCACHE_URL_TTLS 中匹配到的页面只要是 200 就缓存，过期后带上
+    ETag/Last-Modified 条件请求重新验证；未匹配的页面按 RFC2616 处理。
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.url_ttls = [
+            (re.compile(pattern), int(ttl))
+            for pattern, ttl in settings.getdict("HTTPCACHE_URL_TTLS").items()
+        ]
+        self.detector = AntiBotDetector.from_settings(settings)
+
+    def _url_ttl(self, request):
+        for pattern, ttl in self.url_ttls:
+            if pattern.search(request.url):
+                return ttl
+        return None
+
+    def should_cache_response(self, response, request):
+        if self.detector.is_challenge(response.body):
+            return False
+        if self._url_ttl(request) is None:
+            return super().should_cache_response(response, request)
+        cc = self._parse_cachecontrol(response)
+        return response.status == 200 and b"no-store" not in cc
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        ttl = self._url_ttl(request)
+        if ttl is None:
+            return super().is_cached_response_fresh(cachedresponse, request)
+        if b"no-cache" in self._parse_cachecontrol(request):
+            # 强制重新验证：页面未变化时服务器返回 304，仍使用缓存
+            self._set_conditional_validators(request, cachedresponse)
+            return False
+        # TTL 为 0 表示永不过期（章节正文发布后不再变化）
+        age = time() - request.meta.get("cache_timestamp", 0)
+        if ttl == 0 or age < ttl:
+            return True
+        self._set_conditional_validators(request, cachedresponse)
+        return False
+
+
+class RevalidatingHttpCacheMiddleware(HttpCacheMiddleware):
+    """304 重新验证通过后刷新缓存的存入时间，否则之后每次命中都要重新验证
+
+    较新的 Scrapy 会自行重新存储缓存响应（见 SqliteCacheStorage.store_response），较早的版本不会。
+    """
+
+    def process_response(self, request, response, spider=None):
+        cachedresponse = request.meta.get("cached_response")
+        # 较新的 Scrapy 不再传入 spider
+        args = (spider,) if spider is not None else ()
+        result = super().process_response(request, response, *args)
+        touch_response = getattr(self.storage, "touch_response", None)
+        if touch_response and cachedresponse is not None and result is cachedresponse and response.status == 304:
+            touch_response(spider, request)
+        return result
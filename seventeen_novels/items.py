@@ -31,3 +31,12 @@ class NovelChapterItem(scrapy.Item):
     ChapterLink = scrapy.Field()
     ChapterInfo = scrapy.Field()
     ChapterContent = scrapy.Field()  # 新增字段
+    VolumeIndex = scrapy.Field()  # 卷在目录页中的序号（从 1 开始）
+    ChapterIndex = scrapy.Field()  # 章节在目录页中的序号（从 1 开始），导出按此排序
+
+
+class CrawlWatermarkItem(scrapy.Item):
+    # 章节列表处理完成后记录本次爬取时榜单上的最新章节，供增量模式比较
+    NovelName = scrapy.Field()
+    NewlesetChapter = scrapy.Field()  # 最新章节
+    NovelLastUpdateTime = scrapy.Field()  # 最后更新时间
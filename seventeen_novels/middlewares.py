@@ -3,11 +3,36 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import logging
+import os
+import queue
+import threading
+import time
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import HtmlResponse, Request, TextResponse
+from scrapy.utils.defer import maybe_deferred_to_future
+from scrapy.utils.httpobj import urlparse_cached
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from twisted.internet import defer
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+from webdriver_manager.chrome import ChromeDriverManager
+
+from . import signals as novel_signals
+from .antibot import AntiBotDetector
+from .extensions import callback_name
+from .items import NovelChapterItem
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
+logger = logging.getLogger(__name__)
+
 
 class SeventeenNovelsSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -98,3 +123,542 @@ class SeventeenNovelsDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class SeleniumDriverPool:
+    """有界的 headless Chrome 池
+
+    driver 只在专用线程池中创建和使用，渲染时不会阻塞 Twisted reactor。
+    线程数与 driver 数都不超过 size，单个 driver 渲染满 max_pages 个页面后重建，
+    recycle_on_crash 为真时 driver 崩溃（会话失效等）会被丢弃并重建。
+    """
+
+    def __init__(
+        self,
+        size=2,
+        max_pages=200,
+        recycle_on_crash=True,
+        user_agent=None,
+        chromedriver_path=None,
+        chrome_bin=None,
+        render_wait=1.0,
+        scroll_wait=0.5,
+        max_retry=3,
+        retry_wait=2.0,
+        stats=None,
+        logger=None,
+    ):
+        self.size = max(int(size), 1)
+        self.max_pages = max(int(max_pages), 0)
+        self.recycle_on_crash = recycle_on_crash
+        self.user_agent = user_agent
+        self.chromedriver_path = chromedriver_path
+        self.chrome_bin = chrome_bin
+        self.render_wait = render_wait
+        self.scroll_wait = scroll_wait
+        self.max_retry = max(int(max_retry), 1)
+        self.retry_wait = retry_wait
+        self.stats = stats
+        self.logger = logger or logging.getLogger(__name__)
+        self.idle_drivers = queue.LifoQueue()
+        self.all_drivers = set()
+        self.lock = threading.Lock()
+        self.threadpool = ThreadPool(minthreads=0, maxthreads=self.size, name="selenium")
+        self.closing = False
+
+    def start(self):
+        self.threadpool.start()
+
+    def close(self):
+        """退出所有 driver 并停止线程池，返回 Deferred
+
+        退出 driver 和等待工作线程结束都在 reactor 的线程池中进行，正在加载的页面不会阻塞 reactor；
+        driver 退出后进行中的渲染随即失败返回，不再重试。
+        """
+        from twisted.internet import reactor
+
+        self.closing = True
+        with self.lock:
+            drivers, self.all_drivers = list(self.all_drivers), set()
+        d = deferToThreadPool(reactor, reactor.getThreadPool(), self._quit_all, drivers)
+        d.addBoth(lambda _: deferToThreadPool(reactor, reactor.getThreadPool(), self.threadpool.stop))
+        return d
+
+    def render(self, url):
+        """在工作线程中渲染 url，返回 Deferred，结果为 (页面 HTML, 浏览器 cookie 列表)
+
+        重试多次仍失败时 HTML 为空字符串。
+        """
+        from twisted.internet import reactor
+
+        return deferToThreadPool(reactor, self.threadpool, self._render, url)
+
+    def _create_driver(self):
+        chrome_options = Options()
+        chrome_options.add_argument("--headless")
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        chrome_options.add_argument("--enable-unsafe-swiftshader")
+        if self.user_agent:
+            chrome_options.add_argument(f"user-agent={self.user_agent}")
+        if self.chrome_bin and os.path.exists(self.chrome_bin):
+            chrome_options.binary_location = self.chrome_bin
+
+        if not self.chromedriver_path or not os.path.exists(self.chromedriver_path):
+            self.logger.warning(
+                f"ChromeDriver not found at {self.chromedriver_path}, 使用 webdriver_manager 下载"
+            )
+            driver = webdriver.Chrome(
+                service=Service(ChromeDriverManager().install()), options=chrome_options
+            )
+        else:
+            driver = webdriver.Chrome(
+                service=Service(self.chromedriver_path), options=chrome_options
+            )
+        driver.implicitly_wait(15)
+        driver.set_page_load_timeout(25)
+        # 对之后打开的每个页面生效，隐藏 webdriver 特征
+        driver.execute_cdp_cmd(
+            "Page.addScriptToEvaluateOnNewDocument",
+            {
+                "source": """
+                Object.defineProperty(navigator, 'webdriver', {
+                    get: () => undefined
+                });
+                """
+            },
+        )
+        with self.lock:
+            self.all_drivers.add(driver)
+        self._inc_stats("selenium/driver_created")
+        return driver
+
+    def _quit_all(self, drivers):
+        for driver in drivers:
+            self._quit(driver)
+
+    def _quit(self, driver):
+        with self.lock:
+            self.all_drivers.discard(driver)
+        try:
+            driver.quit()
+        except Exception as e:
+            self.logger.warning(f"关闭 Selenium driver 失败: {e}")
+
+    def _checkout(self):
+        try:
+            return self.idle_drivers.get_nowait()
+        except queue.Empty:
+            return self._create_driver(), 0
+
+    def _checkin(self, driver, pages):
+        if self.closing:
+            # close 时已退出的 driver 不在 all_drivers 中，只退出之后才创建的
+            with self.lock:
+                pending = driver in self.all_drivers
+            if pending:
+                self._quit(driver)
+        elif self.max_pages and pages >= self.max_pages:
+            self._inc_stats("selenium/driver_retired")
+            self._quit(driver)
+        else:
+            self.idle_drivers.put((driver, pages))
+
+    def _render(self, url):
+        driver, pages = self._checkout()
+        try:
+            for attempt in range(1, self.max_retry + 1):
+                if self.closing:
+                    break
+                try:
+                    driver.get(url)
+                    time.sleep(self.render_wait)
+                    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+                    time.sleep(self.scroll_wait)
+                    pages += 1
+                    self._inc_stats("selenium/render_count")
+                    return driver.page_source, driver.get_cookies()
+                except TimeoutException as e:
+                    self.logger.warning(f"Selenium 第{attempt}次抓取超时: {e}")
+                except WebDriverException as e:
+                    self.logger.warning(f"Selenium 第{attempt}次抓取失败: {e}")
+                    if self.recycle_on_crash and not self.closing:
+                        # 会话可能已失效，换一个新的 driver 再试
+                        self._inc_stats("selenium/driver_recycled")
+                        self._quit(driver)
+                        driver = None
+                        driver, pages = self._create_driver(), 0
+                time.sleep(self.retry_wait)
+            if self.closing:
+                return "", []
+            self._inc_stats("selenium/render_failed")
+            self.logger.error(f"Selenium 多次重试仍失败: {url}")
+            return "", []
+        finally:
+            if driver is not None:
+                self._checkin(driver, pages)
+
+    def _inc_stats(self, key):
+        if self.stats is not None:
+            from twisted.internet import reactor
+
+            reactor.callFromThread(self.stats.inc_value, key)
+
+
+class SeleniumFallbackMiddleware:
+    """用 Selenium 渲染 meta["selenium"] 为真的请求
+
+    渲染在 SeleniumDriverPool 的工作线程中进行，返回 HtmlResponse，
+    spider 回调里只需重新 yield 带 selenium 标记的请求，不再直接调用 driver。
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("SELENIUM_ENABLED", True):
+            raise NotConfigured("Selenium fallback disabled")
+        pool = SeleniumDriverPool(
+            size=settings.getint("SELENIUM_POOL_SIZE", 2),
+            max_pages=settings.getint("SELENIUM_MAX_PAGES_PER_DRIVER", 200),
+            recycle_on_crash=settings.getbool("SELENIUM_RECYCLE_ON_CRASH", True),
+            user_agent=settings.get("USER_AGENT"),
+            chromedriver_path=settings.get("SELENIUM_CHROMEDRIVER_PATH"),
+            chrome_bin=settings.get("SELENIUM_CHROME_BIN"),
+            render_wait=settings.getfloat("SELENIUM_RENDER_WAIT", 1.0),
+            scroll_wait=settings.getfloat("SELENIUM_SCROLL_WAIT", 0.5),
+            max_retry=settings.getint("SELENIUM_MAX_RETRY", 3),
+            retry_wait=settings.getfloat("SELENIUM_RETRY_WAIT", 2.0),
+            stats=crawler.stats,
+            logger=logging.getLogger(cls.__name__),
+        )
+        mw = cls(pool)
+        crawler.signals.connect(mw.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
+
+    async def process_request(self, request, spider=None):
+        if not request.meta.get("selenium"):
+            return None
+        started = time.perf_counter()
+        html, cookies = await maybe_deferred_to_future(self.pool.render(request.url))
+        # 渲染耗时（含排队等待 driver），由 StageMetrics 记入 selenium 阶段
+        request.meta["selenium_latency"] = time.perf_counter() - started
+        if not html:
+            raise IgnoreRequest(f"Selenium 仍然未能获取页面: {request.url}")
+        # 交给 ChallengeCookiesMiddleware 保存，供后续普通请求复用
+        request.meta["selenium_cookies"] = cookies
+        return HtmlResponse(
+            url=request.url, body=html, encoding="utf-8", request=request
+        )
+
+    def spider_opened(self, spider):
+        self.pool.start()
+
+    def spider_closed(self, spider):
+        # 返回 Deferred，Scrapy 等 driver 退出后再继续关闭
+        return self.pool.close()
+
+
+class ChallengeCookiesMiddleware:
+    """复用 Selenium 通过反爬验证后得到的 cookie
+
+    COOKIES_ENABLED = False 时 Scrapy 不保存任何 cookie，反爬脚本写入的 cookie
+    随 Selenium 渲染结束就丢失了。这里按域名保存渲染后浏览器中的 cookie，附加到
+    之后同域名的普通请求上，直到 cookie 过期或带着它的请求再次触发验证。
+    同一域名同时只进行一次 Selenium 验证，其余触发验证的请求等待结果后直接
+    带 cookie 重新请求。进行验证的请求被丢弃或爬虫关闭时放行等待者，
+    等待超过 solve_timeout 秒的请求自行进行验证。
+    """
+
+    def __init__(self, stats, ttl=1800, solve_timeout=180):
+        self.stats = stats
+        self.ttl = ttl
+        self.solve_timeout = solve_timeout
+        # 域名 -> {"cookies": {name: (value, expires_at)}, "generation": int}
+        self.jars = {}
+        self.generation = 0
+        # 域名 -> 正在进行验证的请求与等待者
+        self.solving = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("CHALLENGE_COOKIES_ENABLED", True):
+            raise NotConfigured("Challenge cookie reuse disabled")
+        mw = cls(
+            crawler.stats,
+            ttl=settings.getint("CHALLENGE_COOKIES_TTL", 1800),
+            solve_timeout=settings.getfloat("CHALLENGE_SOLVE_TIMEOUT", 180),
+        )
+        # 进行验证的请求被调度器丢弃时不会经过 process_response/process_exception
+        crawler.signals.connect(mw.request_dropped, signal=signals.request_dropped)
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
+
+    async def process_request(self, request, spider=None):
+        host = urlparse_cached(request).hostname or ""
+        if request.meta.get("selenium"):
+            self._invalidate(host, request.meta.get("challenge_cookies"))
+            solving = self._solving_for(host)
+            if solving is None:
+                self.solving[host] = {"request": request, "waiters": []}
+                return None
+            # 已有请求在验证同一域名，等它完成后带 cookie 重新请求
+            self.stats.inc_value("challenge/solve_waited")
+            waiter = defer.Deferred()
+            solving["waiters"].append(waiter)
+            if self.solve_timeout > 0:
+                from twisted.internet import reactor
+
+                waiter.addTimeout(self.solve_timeout, reactor)
+            try:
+                await maybe_deferred_to_future(waiter)
+            except defer.TimeoutError:
+                # 等待超时，不再等这次验证，自己进行 Selenium 验证
+                self.stats.inc_value("challenge/solve_wait_timeout")
+                return None
+            if self._cookies_for(host):
+                meta = dict(request.meta)
+                meta.pop("selenium", None)
+                return request.replace(dont_filter=True, meta=meta)
+            return None
+
+        cookies = self._cookies_for(host)
+        if cookies:
+            jar_generation, header = cookies
+            request.headers["Cookie"] = header
+            request.meta["challenge_cookies"] = jar_generation
+            self.stats.inc_value("challenge/cookies_reused")
+        return None
+
+    def process_response(self, request, response, spider=None):
+        cookies = request.meta.get("selenium_cookies")
+        if cookies:
+            self._store(cookies, urlparse_cached(request).hostname or "")
+            self.stats.inc_value("challenge/solved")
+        self._finish_solving(request)
+        return response
+
+    def process_exception(self, request, exception, spider=None):
+        self._finish_solving(request)
+        return None
+
+    def request_dropped(self, request, spider=None):
+        self._finish_solving(request)
+
+    def spider_closed(self, spider=None):
+        solving, self.solving = self.solving, {}
+        for entry in solving.values():
+            self._release(entry["waiters"])
+
+    def _solving_for(self, host):
+        for domain, solving in self.solving.items():
+            if self._domain_match(host, domain):
+                return solving
+        return None
+
+    def _finish_solving(self, request):
+        for domain, solving in list(self.solving.items()):
+            if solving["request"] is request:
+                del self.solving[domain]
+                self._release(solving["waiters"])
+
+    @staticmethod
+    def _release(waiters):
+        for waiter in waiters:
+            # 已超时的等待者不再回调
+            if not waiter.called:
+                waiter.callback(None)
+
+    @staticmethod
+    def _domain_match(host, domain):
+        return host == domain or host.endswith("." + domain)
+
+    def _store(self, cookies, host):
+        self.generation += 1
+        now = time.time()
+        for cookie in cookies:
+            domain = (cookie.get("domain") or host).lstrip(".")
+            expires_at = cookie.get("expiry") or now + self.ttl
+            jar = self.jars.setdefault(domain, {"cookies": {}, "generation": 0})
+            jar["cookies"][cookie["name"]] = (cookie.get("value", ""), expires_at)
+            jar["generation"] = self.generation
+
+    def _cookies_for(self, host):
+        now = time.time()
+        values = {}
+        generation = 0
+        for domain, jar in list(self.jars.items()):
+            if not self._domain_match(host, domain):
+                continue
+            for name, (value, expires_at) in list(jar["cookies"].items()):
+                if expires_at <= now:
+                    del jar["cookies"][name]
+                    self.stats.inc_value("challenge/cookies_expired")
+                    continue
+                values[name] = value
+            if not jar["cookies"]:
+                del self.jars[domain]
+                continue
+            generation = max(generation, jar["generation"])
+        if not values:
+            return None
+        return generation, "; ".join(f"{name}={value}" for name, value in values.items())
+
+    def _invalidate(self, host, generation):
+        # 只丢弃这次请求所携带的那一批 cookie，期间新验证得到的 cookie 保留
+        if not generation:
+            return
+        for domain, jar in list(self.jars.items()):
+            if self._domain_match(host, domain) and jar["generation"] <= generation:
+                del self.jars[domain]
+                self.stats.inc_value("challenge/cookies_invalidated")
+
+
+class AntiBotDetectorMiddleware:
+    """统一识别反爬验证页
+
+    每个响应只检测一次，结果记录在 request.meta["antibot"]（"challenge" / "clean"）。
+    验证页不会交给 spider 回调：普通请求改为带 selenium 标记重新调度，
+    Selenium 渲染后仍是验证页则丢弃该请求。
+    """
+
+    def __init__(self, detector, stats, signals=None):
+        self.detector = detector
+        self.stats = stats
+        self.signals = signals
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(AntiBotDetector.from_settings(crawler.settings), crawler.stats, crawler.signals)
+
+    def process_response(self, request, response, spider=None):
+        if not isinstance(response, TextResponse):
+            return response
+        if not self.detector.is_challenge(response.body):
+            request.meta["antibot"] = "clean"
+            self.stats.inc_value("antibot/clean")
+            self._send_checked(request, response, spider, False)
+            return response
+        request.meta["antibot"] = "challenge"
+        self.stats.inc_value("antibot/challenge")
+        self._send_checked(request, response, spider, True)
+        if request.meta.get("selenium"):
+            self.stats.inc_value("antibot/fallback_failed")
+            logger.error(f"Selenium 仍然未能绕过反爬虫: {request.url}")
+            raise IgnoreRequest(f"Selenium 仍然未能绕过反爬虫: {request.url}")
+        logger.warning(f"检测到反爬虫页面，交由Selenium重新获取: {request.url}")
+        return request.replace(dont_filter=True, meta={**request.meta, "selenium": True})
+
+    def _send_checked(self, request, response, spider, challenge):
+        if self.signals is not None:
+            self.signals.send_catch_log(
+                novel_signals.antibot_checked,
+                request=request,
+                response=response,
+                spider=spider,
+                challenge=challenge,
+            )
+
+
+class StageTimingMiddleware:
+    """测量 spider 回调耗时，通过 stage_timed 信号交给 StageMetrics 扩展
+
+    放在最靠近 spider 的位置，只累计从回调取下一个输出所花的时间，
+    不含下游中间件与 item pipeline 处理输出的时间；异步回调等待解析进程池的时间计入在内。
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("STAGE_METRICS_ENABLED", False):
+            raise NotConfigured("Stage metrics disabled")
+        return cls(crawler)
+
+    def process_spider_output(self, response, result, spider):
+        elapsed = 0.0
+        iterator = iter(result)
+        while True:
+            started = time.perf_counter()
+            try:
+                entry = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - started
+            yield entry
+        self._send(response, elapsed, spider)
+
+    async def process_spider_output_async(self, response, result, spider):
+        elapsed = 0.0
+        iterator = result.__aiter__()
+        while True:
+            started = time.perf_counter()
+            try:
+                entry = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - started
+            yield entry
+        self._send(response, elapsed, spider)
+
+    def _send(self, response, elapsed, spider):
+        if response.request is not None:
+            novel_signals.send_stage_timed(
+                self.crawler, "callback", callback_name(response.request), elapsed, spider
+            )
+
+
+# 记入断点日志的请求 meta：章节字段与调度优先级所需的信息
+CHECKPOINT_META_KEYS = (*NovelChapterItem.fields, "ranking", "chapter_kind")
+
+
+class CrawlCheckpointMiddleware:
+    """把带 checkpoint 标记的章节正文请求记入 spider.checkpoint 的断点日志
+
+    一个响应的输出全部记录后才提交；章节列表响应（meta 中有 checkpoint_listing）
+    处理完后同时标记该小说已列出。spider 没有 checkpoint 时原样放行。
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("CRAWL_CHECKPOINT_ENABLED", False):
+            raise NotConfigured("Crawl checkpoint disabled")
+        return cls()
+
+    def process_spider_output(self, response, result, spider):
+        checkpoint = getattr(spider, "checkpoint", None)
+        for entry in result:
+            self._record(checkpoint, entry)
+            yield entry
+        self._commit(checkpoint, response)
+
+    async def process_spider_output_async(self, response, result, spider):
+        checkpoint = getattr(spider, "checkpoint", None)
+        async for entry in result:
+            self._record(checkpoint, entry)
+            yield entry
+        self._commit(checkpoint, response)
+
+    @staticmethod
+    def _record(checkpoint, entry):
+        if checkpoint is None or not isinstance(entry, Request) or not entry.meta.get("checkpoint"):
+            return
+        meta = {key: entry.meta[key] for key in CHECKPOINT_META_KEYS if key in entry.meta}
+        checkpoint.record(meta.get("NovelName"), meta.get("ChapterName"), entry.url, meta)
+
+    @staticmethod
+    def _commit(checkpoint, response):
+        if checkpoint is None:
+            return
+        novel_name = response.meta.get("checkpoint_listing")
+        if novel_name:
+            checkpoint.mark_listed(novel_name)
+        checkpoint.commit()
@@ -0,0 +1,81 @@
+# 章节正文解析引擎：可选地把解析交给进程池，避免单个 reactor 线程成为 CPU 瓶颈
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy import signals
+from twisted.internet import defer
+
+from .extractors import extract_chapter_content, extract_chapter_lines
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_chapter(body, encoding):
+    # 在工作进程中执行，只传递 bytes 和编码，避免序列化 Response
+    return "\n".join(extract_chapter_lines(body, encoding))
+
+
+class ChapterParseEngine:
+    """CHAPTER_PARSE_WORKERS 为 0 时在当前线程解析；大于 0 时提交到进程池，
+    同时在途的解析任务不超过 CHAPTER_PARSE_MAX_IN_FLIGHT 个。
+    """
+
+    def __init__(self, workers=0, max_in_flight=0, crawler=None):
+        self.workers = max(int(workers), 0)
+        self.max_in_flight = max(int(max_in_flight), 0) or self.workers * 4
+        # 爬虫在 from_crawler 中创建引擎时 crawler.stats 尚未就绪，用到时再取
+        self.crawler = crawler
+        self.executor = None
+        self.semaphore = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        engine = cls(
+            workers=settings.getint("CHAPTER_PARSE_WORKERS", 0),
+            max_in_flight=settings.getint("CHAPTER_PARSE_MAX_IN_FLIGHT", 0),
+            crawler=crawler,
+        )
+        crawler.signals.connect(engine.close, signal=signals.spider_closed)
+        return engine
+
+    def extract(self, response):
+        """返回 Deferred，结果为章节正文"""
+        if not self.workers:
+            return defer.succeed(extract_chapter_content(response))
+        if self.executor is None:
+            # 使用 spawn，避免在已有 Selenium/数据库线程的进程中 fork
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            self.semaphore = defer.DeferredSemaphore(self.max_in_flight)
+            logger.info(f"章节解析进程池已启动，进程数: {self.workers}，最大在途任务: {self.max_in_flight}")
+        return self.semaphore.run(self._submit, response.body, response.encoding)  # type: ignore
+
+    def _submit(self, body, encoding):
+        from twisted.internet import reactor
+
+        d = defer.Deferred()
+
+        def done(future):
+            # 在工作进程结果回调线程中触发，需切回 reactor 线程
+            if future.cancelled():
+                reactor.callFromThread(d.cancel)  # type: ignore
+                return
+            error = future.exception()
+            if error is not None:
+                reactor.callFromThread(d.errback, error)  # type: ignore
+            else:
+                reactor.callFromThread(d.callback, future.result())  # type: ignore
+
+        self.executor.submit(_parse_chapter, body, encoding).add_done_callback(done)  # type: ignore
+        if self.crawler is not None:
+            self.crawler.stats.inc_value("chapter_parse/offloaded")
+        return d
+
+    def close(self, spider):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
@@ -2,14 +2,51 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+import io
 import os
 import sqlite3
-from .items import SeventeenNovelsItem, NovelChapterItem
+from .items import SeventeenNovelsItem, NovelChapterItem, CrawlWatermarkItem
+from .codec import ContentCodec, content_hash, create_content_storage
+from .database import PgDatabase
+from .schema import NovelIdCache, migrate_schema
+from .writebehind import WriteBehindPipeline
 
 # useful for handling different item types with a single interface
 from scrapy.exporters import CsvItemExporter
 from scrapy.exceptions import NotConfigured
-from psycopg2 import pool
+
+
+def release_watermarks(pipeline, spider, keys):
+    """keys 为已提交正文的 (小说名, 章节名)；小说的章节正文全部入库后把暂存的增量水位交给 pipeline 写入"""
+    pending_watermarks = getattr(spider, "pending_watermarks", None)
+    if pending_watermarks is None:
+        return
+    for watermark in pending_watermarks.complete(keys):
+        pipeline.enqueue(watermark, spider)
+
+
+# 章节 upsert 的正文列：新数据没有正文（章节列表）或正文哈希未变时保留已有正文，
+# PostgreSQL 中沿用原有的 TOAST 值，不重写大字段
+KEEP_CONTENT = "excluded.content_hash IS NULL OR excluded.content_hash = novel_chapter.content_hash"
+CONTENT_UPDATE = f"""
+    chapter_content=CASE WHEN {KEEP_CONTENT} THEN novel_chapter.chapter_content ELSE excluded.chapter_content END,
+    content_blob=CASE WHEN {KEEP_CONTENT} THEN novel_chapter.content_blob ELSE excluded.content_blob END,
+    dict_id=CASE WHEN {KEEP_CONTENT} THEN novel_chapter.dict_id ELSE excluded.dict_id END,
+    content_hash=COALESCE(excluded.content_hash, novel_chapter.content_hash)"""
+
+
+def chapter_changed(distinct="IS NOT"):
+    """章节 upsert 的 WHERE 条件：正文哈希和章节信息都没有变化时跳过更新，重复抓取只需比较哈希
+
+    distinct 为空值安全的不等比较，SQLite 用 IS NOT，PostgreSQL 用 IS DISTINCT FROM。
+    """
+    return f"""
+    WHERE (excluded.content_hash IS NOT NULL AND novel_chapter.content_hash {distinct} excluded.content_hash)
+        OR novel_chapter.volume_title {distinct} excluded.volume_title
+        OR novel_chapter.chapter_link {distinct} excluded.chapter_link
+        OR novel_chapter.chapter_info {distinct} excluded.chapter_info
+        OR (excluded.volume_index IS NOT NULL AND novel_chapter.volume_index {distinct} excluded.volume_index)
+        OR (excluded.chapter_index IS NOT NULL AND novel_chapter.chapter_index {distinct} excluded.chapter_index)"""
 
 
 class FreeNovelTop100Pipeline:
@@ -111,18 +148,59 @@ class NovelAllChaptersPipeline:
         return item
 
 
-class AutoNovelsTop100Pipeline:
-    def __init__(self):
-        self.db_path = "output/novel_data.db"
+class AutoNovelsTop100Pipeline(WriteBehindPipeline):
+    backend = "SQLite"
+
+    def __init__(
+        self,
+        batch_size=1,
+        flush_interval_ms=0,
+        journal_mode=None,
+        synchronous=None,
+        content_codec=None,
+        db_path=None,
+        **write_behind,
+    ):
+        # 批量写入配置：缓冲满 batch_size 条或超过 flush_interval 秒即在一个事务中写入
+        super().__init__(
+            batch_size=batch_size,
+            flush_interval=max(int(flush_interval_ms), 0) / 1000.0,
+            **write_behind,
+        )
+        self.db_path = db_path or "output/novel_data.db"
         self.conn = None
         self.cursor = None
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        # 章节正文存储编码，见 codec.ContentCodec
+        self.content_codec = content_codec or ContentCodec()
+        # 小说名到 novels.id 的缓存，章节按 novel_id 关联小说
+        self.novel_ids = NovelIdCache()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            batch_size=settings.getint("SQLITE_BATCH_SIZE", 1),
+            flush_interval_ms=settings.getint("SQLITE_FLUSH_INTERVAL_MS", 0),
+            journal_mode=settings.get("SQLITE_JOURNAL_MODE"),
+            synchronous=settings.get("SQLITE_SYNCHRONOUS"),
+            content_codec=ContentCodec.from_settings(settings),
+            db_path=settings.get("SQLITE_DB_PATH"),
+            **cls.write_behind_settings(settings),
+        )
 
     def open_spider(self, spider):
         if spider.name != "auto_novel_top100":
             return
-        os.makedirs("output", exist_ok=True)
-        self.conn = sqlite3.connect(self.db_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        # 建表在 reactor 线程中完成，之后的写入可能在写线程中进行
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
         self.cursor = self.conn.cursor()
+        if self.journal_mode:
+            self.cursor.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        if self.synchronous:
+            self.cursor.execute(f"PRAGMA synchronous={self.synchronous}")
         # Top100榜单表
         self.cursor.execute(
             """
@@ -153,46 +231,100 @@ class AutoNovelsTop100Pipeline:
             """
             CREATE TABLE IF NOT EXISTS novel_chapter (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                novel_id INTEGER REFERENCES novels(id),
                 novel_name TEXT,
                 volume_title TEXT,
                 chapter_name TEXT,
                 chapter_link TEXT,
                 chapter_info TEXT,
-                chapter_content TEXT
+                chapter_content TEXT,
+                volume_index INTEGER,
+                chapter_index INTEGER
             )
         """
         )
+        # 旧库补充章节顺序列
+        columns = {row[1] for row in self.cursor.execute("PRAGMA table_info(novel_chapter)")}
+        for column in ("volume_index", "chapter_index"):
+            if column not in columns:
+                self.cursor.execute(f"ALTER TABLE novel_chapter ADD COLUMN {column} INTEGER")
+        # 升级数据库结构：novel_id 关联、旧章节回填 chapter_index（只执行一次）
+        migrate_schema(self.cursor, logger=spider.logger)
+        # 压缩正文列和字典表
+        create_content_storage(self.cursor)
+        self.content_codec.load_dictionaries(self.cursor)
+        # 增量爬取水位表
         self.cursor.execute(
             """
-            CREATE UNIQUE INDEX IF NOT EXISTS idx_chapter_name ON novel_chapter(novel_name, chapter_name)
+            CREATE TABLE IF NOT EXISTS crawl_watermark (
+                novel_name TEXT PRIMARY KEY,
+                latest_chapter TEXT,
+                update_time TEXT,
+                crawled_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
         """
         )
         self.conn.commit()
+        self.start_writing(spider)
 
-    def close_spider(self, spider):
+    async def close_spider(self, spider):
         if self.conn:
-            self.conn.close()
-            self.conn = None
-            self.cursor = None
+            await self.stop_writing(spider, self._close_connection)
 
-    def process_item(self, item, spider):
-        if spider.name != "auto_novel_top100":
-            return item
+    def _close_connection(self):
+        self.conn.close()  # type: ignore
+        self.conn = None
+        self.cursor = None
+
+    def accepts(self, item, spider):
+        return (
+            spider.name == "auto_novel_top100"
+            and self.conn is not None
+            and isinstance(item, (SeventeenNovelsItem, NovelChapterItem, CrawlWatermarkItem))
+        )
+
+    def operation_name(self, items):
+        return "sqlite_flush"
+
+    def write_batch(self, items, spider):
+        """在一个事务中写入一批 item"""
+        novel_rows = []
+        chapter_list_rows = []
+        chapter_content_rows = []
+        watermark_rows = []
+        for item in items:
+            self._append_rows(item, novel_rows, chapter_list_rows, chapter_content_rows, watermark_rows)
+        try:
+            self._write_rows(novel_rows, chapter_list_rows, chapter_content_rows, watermark_rows)
+            self.conn.commit()  # type: ignore
+        except Exception:
+            self.conn.rollback()  # type: ignore
+            # 缓存中可能有随事务回滚的新小说 id
+            self.novel_ids.clear()
+            raise
+
+    def after_commit(self, items, spider):
+        # 提交成功后同步爬虫的已入库章节索引，章节正文全部入库的小说写入增量水位
+        known_chapters = getattr(spider, "known_chapters", None)
+        committed = []
+        for item in items:
+            if not isinstance(item, NovelChapterItem):
+                continue
+            if item.get("ChapterContent"):
+                committed.append((item.get("NovelName"), item.get("ChapterName")))
+                if known_chapters is not None:
+                    known_chapters.mark_content(
+                        item.get("NovelName"), item.get("ChapterName"), item.get("ChapterIndex")
+                    )
+            elif known_chapters is not None:
+                known_chapters.mark_listed(item.get("NovelName"), item.get("ChapterName"), item.get("ChapterIndex"))
+        release_watermarks(self, spider, committed)
+
+    def _append_rows(self, item, novel_rows, chapter_list_rows, chapter_content_rows, watermark_rows):
         # Top100榜单
         if isinstance(item, SeventeenNovelsItem):
-            self.cursor.execute(  # type: ignore
-                """
-                INSERT OR REPLACE INTO novels (
-                    id, ranking, type, type_link, name, link,
-                    latest_chapter, latest_chapter_link, update_time,
-                    author, author_link, status, ranking_values
-                ) VALUES (
-                    (SELECT id FROM novels WHERE name = ?),
-                    ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
-                )
-            """,
+            novel_rows.append(
                 (
-                    item.get("NovelName"),
                     item.get("NovelRanking"),
                     item.get("NovelType"),
                     item.get("NovelTypeLink"),
@@ -205,67 +337,164 @@ class AutoNovelsTop100Pipeline:
                     item.get("AuthorLink"),
                     item.get("NovelStatus"),
                     item.get("RankingValues"),
-                ),
+                )
             )
-            self.conn.commit()  # type: ignore
-            return item
-
         # 章节内容
-        if isinstance(item, NovelChapterItem) and item.get("ChapterContent"):
-            self.cursor.execute(  # type: ignore
-                """
-                INSERT OR REPLACE INTO novel_chapter (
-                    id, novel_name, volume_title, chapter_name,
-                    chapter_link, chapter_info, chapter_content
-                ) VALUES (
-                    (SELECT id FROM novel_chapter WHERE novel_name = ? AND chapter_name = ?),
-                    ?, ?, ?, ?, ?, ?
-                )
-            """,
+        elif isinstance(item, NovelChapterItem) and item.get("ChapterContent"):
+            content, content_blob, dict_id = self.content_codec.encode(
+                item.get("NovelName"), item.get("ChapterContent")
+            )
+            chapter_content_rows.append(
                 (
-                    item.get("NovelName"),
-                    item.get("ChapterName"),
                     item.get("NovelName"),
                     item.get("VolumeTitle"),
                     item.get("ChapterName"),
                     item.get("ChapterLink"),
                     item.get("ChapterInfo"),
-                    item.get("ChapterContent"),
-                ),
+                    content,
+                    item.get("VolumeIndex"),
+                    item.get("ChapterIndex"),
+                    content_blob,
+                    dict_id,
+                    content_hash(item.get("ChapterContent")),
+                )
             )
-            self.conn.commit()  # type: ignore
-            return item
-
         # 章节列表（无正文）
-        if isinstance(item, NovelChapterItem):
-            self.cursor.execute(  # type: ignore
-                """
-                INSERT OR REPLACE INTO novel_chapter (
-                    id, novel_name, volume_title, chapter_name,
-                    chapter_link, chapter_info
-                ) VALUES (
-                    (SELECT id FROM novel_chapter WHERE novel_name = ? AND chapter_name = ?),
-                    ?, ?, ?, ?, ?
-                )
-            """,
+        elif isinstance(item, NovelChapterItem):
+            chapter_list_rows.append(
                 (
-                    item.get("NovelName"),
-                    item.get("ChapterName"),
                     item.get("NovelName"),
                     item.get("VolumeTitle"),
                     item.get("ChapterName"),
                     item.get("ChapterLink"),
                     item.get("ChapterInfo"),
-                ),
+                    item.get("VolumeIndex"),
+                    item.get("ChapterIndex"),
+                )
+            )
+        # 增量水位
+        elif isinstance(item, CrawlWatermarkItem):
+            watermark_rows.append(
+                (
+                    item.get("NovelName"),
+                    item.get("NewlesetChapter"),
+                    item.get("NovelLastUpdateTime"),
+                )
             )
-            self.conn.commit()  # type: ignore
-            return item
-
-        return item
 
+    def _write_rows(self, novel_rows, chapter_list_rows, chapter_content_rows, watermark_rows):
+        # 先写榜单、再写章节列表、最后写正文，保证同一章节的正文不会被列表数据覆盖
+        # 水位最后写入，与章节数据在同一事务中提交
+        if novel_rows:
+            self.cursor.executemany(  # type: ignore
+                """
+                INSERT INTO novels (
+                    ranking, type, type_link, name, link,
+                    latest_chapter, latest_chapter_link, update_time,
+                    author, author_link, status, ranking_values
+                ) VALUES (
+                    ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+                )
+                ON CONFLICT (name) DO UPDATE SET
+                    ranking=excluded.ranking,
+                    type=excluded.type,
+                    type_link=excluded.type_link,
+                    link=excluded.link,
+                    latest_chapter=excluded.latest_chapter,
+                    latest_chapter_link=excluded.latest_chapter_link,
+                    update_time=excluded.update_time,
+                    author=excluded.author,
+                    author_link=excluded.author_link,
+                    status=excluded.status,
+                    ranking_values=excluded.ranking_values
+            """,
+                novel_rows,
+            )
+        if chapter_list_rows:
+            self.cursor.executemany(  # type: ignore
+                f"""
+                INSERT INTO novel_chapter (
+                    novel_id, novel_name, volume_title, chapter_name,
+                    chapter_link, chapter_info, volume_index, chapter_index
+                ) VALUES (
+                    ?, ?, ?, ?, ?, ?, ?, ?
+                )
+                ON CONFLICT (novel_id, chapter_name) DO UPDATE SET
+                    volume_title=excluded.volume_title,
+                    chapter_link=excluded.chapter_link,
+                    chapter_info=excluded.chapter_info,
+                    volume_index=COALESCE(excluded.volume_index, novel_chapter.volume_index),
+                    chapter_index=COALESCE(excluded.chapter_index, novel_chapter.chapter_index)
+                {chapter_changed()}
+            """,
+                self._with_novel_id(chapter_list_rows),
+            )
+        if chapter_content_rows:
+            self.cursor.executemany(  # type: ignore
+                f"""
+                INSERT INTO novel_chapter (
+                    novel_id, novel_name, volume_title, chapter_name,
+                    chapter_link, chapter_info, chapter_content,
+                    volume_index, chapter_index, content_blob, dict_id, content_hash
+                ) VALUES (
+                    ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+                )
+                ON CONFLICT (novel_id, chapter_name) DO UPDATE SET
+                    volume_title=excluded.volume_title,
+                    chapter_link=excluded.chapter_link,
+                    chapter_info=excluded.chapter_info,
+                    volume_index=COALESCE(excluded.volume_index, novel_chapter.volume_index),
+                    chapter_index=COALESCE(excluded.chapter_index, novel_chapter.chapter_index),{CONTENT_UPDATE}
+                {chapter_changed()}
+            """,
+                self._with_novel_id(chapter_content_rows),
+            )
+        if watermark_rows:
+            self.cursor.executemany(  # type: ignore
+                """
+                INSERT INTO crawl_watermark (
+                    novel_name, latest_chapter, update_time
+                ) VALUES (
+                    ?, ?, ?
+                )
+                ON CONFLICT (novel_name) DO UPDATE SET
+                    latest_chapter=excluded.latest_chapter,
+                    update_time=excluded.update_time,
+                    crawled_at=CURRENT_TIMESTAMP
+            """,
+                watermark_rows,
+            )
 
-class AutoNovelsTop100PostgrePipeline:
-    def __init__(self, host, port, user, password, dbname, minconn, maxconn):
+    def _with_novel_id(self, rows):
+        # 章节行首列为小说名，写入时在前面加上对应的 novel_id
+        return [(self.novel_ids.resolve(self.cursor, row[0]),) + row for row in rows]
+
+
+class AutoNovelsTop100PostgrePipeline(WriteBehindPipeline):
+    backend = "PostgreSQL"
+
+    def __init__(
+        self,
+        host,
+        port,
+        user,
+        password,
+        dbname,
+        minconn,
+        maxconn,
+        bulk_mode=False,
+        flush_size=1000,
+        flush_interval_ms=0,
+        content_codec=None,
+        **write_behind,
+    ):
+        # 批量模式：一批章节按 (novel_name, chapter_name) 合并，COPY 到临时表后统一合并；
+        # 否则每个 item 单独提交
+        super().__init__(
+            batch_size=flush_size if bulk_mode else 1,
+            flush_interval=max(int(flush_interval_ms), 0) / 1000.0 if bulk_mode else 0.0,
+            **write_behind,
+        )
         self.host = host
         self.port = port
         self.user = user
@@ -273,7 +502,15 @@ class AutoNovelsTop100PostgrePipeline:
         self.dbname = dbname
         self.minconn = minconn
         self.maxconn = maxconn
+        # 与 spider 共用的 PgDatabase；spider 没有时自建，并在 close_spider 中关闭
+        self.database = None
+        self.owns_database = False
         self.connection_pool = None
+        self.bulk_mode = bulk_mode
+        # 章节正文存储编码，见 codec.ContentCodec
+        self.content_codec = content_codec or ContentCodec()
+        # 小说名到 novels.id 的缓存，章节按 novel_id 关联小说
+        self.novel_ids = NovelIdCache(use_pg=True)
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -291,23 +528,42 @@ class AutoNovelsTop100PostgrePipeline:
         if not all([host, port, user, password, dbname]):
             raise NotConfigured("PostgreSQL settings not configured")
 
-        return cls(host, port, user, password, dbname, minconn, maxconn)
+        return cls(
+            host,
+            port,
+            user,
+            password,
+            dbname,
+            minconn,
+            maxconn,
+            bulk_mode=settings.getbool("PG_BULK_MODE", False),
+            flush_size=settings.getint("PG_BULK_FLUSH_SIZE", 1000),
+            flush_interval_ms=settings.getint("PG_BULK_FLUSH_INTERVAL_MS", 0),
+            content_codec=ContentCodec.from_settings(settings),
+            **cls.write_behind_settings(settings),
+        )
 
     def open_spider(self, spider):
         if spider.name != "auto_novel_top100_postgre":
             return
-        # 在爬虫开始时创建连接池
-        self.connection_pool = pool.SimpleConnectionPool(
-            self.minconn,
-            self.maxconn,
-            host=self.host,
-            port=self.port,
-            user=self.user,
-            password=self.password,
-            dbname=self.dbname,
-        )
-        if not self.connection_pool:
-            raise Exception("Failed to create PostgreSQL connection pool")
+        # 在爬虫开始时打开连接池，优先使用 spider 的 PgDatabase，与回调中的查询共用连接
+        self.database = getattr(spider, "database", None)
+        self.owns_database = self.database is None
+        if self.owns_database:
+            self.database = PgDatabase(
+                {
+                    "host": self.host,
+                    "port": self.port,
+                    "user": self.user,
+                    "password": self.password,
+                    "dbname": self.dbname,
+                },
+                minconn=self.minconn,
+                maxconn=self.maxconn,
+                writers=1 if self.write_behind else 0,
+            )
+        self.database.open()
+        self.connection_pool = self.database.pool
         # 从连接池中获取连接
         conn = self.connection_pool.getconn()
         if not conn:
@@ -345,19 +601,40 @@ class AutoNovelsTop100PostgrePipeline:
                 """
                 CREATE TABLE IF NOT EXISTS novel_chapter (
                     id SERIAL PRIMARY KEY,
+                    novel_id INTEGER REFERENCES novels(id),
                     novel_name TEXT,
                     volume_title TEXT,
                     chapter_name TEXT,
                     chapter_link TEXT,
                     chapter_info TEXT,
                     chapter_content TEXT,
-                    UNIQUE(novel_name, chapter_name)
+                    volume_index INTEGER,
+                    chapter_index INTEGER
                 )
             """
             )
+            # 旧库补充章节顺序列
             cursor.execute(
                 """
-                CREATE UNIQUE INDEX IF NOT EXISTS idx_chapter_name ON novel_chapter(novel_name, chapter_name)
+                ALTER TABLE novel_chapter
+                    ADD COLUMN IF NOT EXISTS volume_index INTEGER,
+                    ADD COLUMN IF NOT EXISTS chapter_index INTEGER
+            """
+            )
+            # 升级数据库结构：novel_id 关联、旧章节回填 chapter_index（只执行一次）
+            migrate_schema(cursor, use_pg=True, logger=spider.logger)
+            # 压缩正文列和字典表
+            create_content_storage(cursor, use_pg=True)
+            self.content_codec.load_dictionaries(cursor)
+            # 增量爬取水位表
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS crawl_watermark (
+                    novel_name TEXT PRIMARY KEY,
+                    latest_chapter TEXT,
+                    update_time TEXT,
+                    crawled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
             """
             )
             conn.commit()
@@ -368,147 +645,336 @@ class AutoNovelsTop100PostgrePipeline:
         finally:
             # 将连接返回到连接池
             self.connection_pool.putconn(conn)
+        self.start_writing(spider)
 
-    def close_spider(self, spider):
-        # 在爬虫结束时关闭连接池
+    async def close_spider(self, spider):
+        # 在爬虫结束时写入剩余数据；共用的连接池由 spider 在 spider_closed 时关闭
         if self.connection_pool:
-            self.connection_pool.closeall()
+            await self.stop_writing(spider, self._release_database)
+        else:
+            self._release_database()
 
-    def process_item(self, item, spider):
-        if spider.name != "auto_novel_top100_postgre":
-            return item
-        if not self.connection_pool:
-            return item
+    def _release_database(self):
+        self.connection_pool = None
+        if self.owns_database:
+            self.database.close()  # type: ignore
+        self.database = None
+
+    def accepts(self, item, spider):
+        return (
+            spider.name == "auto_novel_top100_postgre"
+            and self.connection_pool is not None
+            and isinstance(item, (SeventeenNovelsItem, NovelChapterItem, CrawlWatermarkItem))
+        )
+
+    def operation_name(self, items):
+        if self.bulk_mode:
+            return "bulk_flush"
+        # 非批量模式每批只有一个 item
+        item = items[0]
         if isinstance(item, SeventeenNovelsItem):
-            return self._process_novel_item(item, spider)
-        elif isinstance(item, NovelChapterItem) and item.get("ChapterContent"):
-            return self._process_chapter_content_item(item, spider)
-        elif isinstance(item, NovelChapterItem):
-            return self._process_chapter_list_item(item, spider)
-        return item
+            return "novel"
+        if isinstance(item, CrawlWatermarkItem):
+            return "watermark"
+        return "chapter_content" if item.get("ChapterContent") else "chapter_list"
 
-    def _process_novel_item(self, item, spider):
+    def write_batch(self, items, spider):
+        """在一个事务中依次写入榜单、章节、水位；批量模式下章节合并后 COPY 写入"""
         conn = self.connection_pool.getconn()  # type: ignore
         if not conn:
-            spider.logger.error("Failed to get connection from pool")
-            return item
+            raise Exception("Failed to get connection from pool")
         try:
             cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO novels (
-                    ranking, type, type_link, name, link,
-                    latest_chapter, latest_chapter_link, update_time,
-                    author, author_link, status, ranking_values
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                )
-                ON CONFLICT (name) DO UPDATE SET
-                    ranking=EXCLUDED.ranking,
-                    type=EXCLUDED.type,
-                    type_link=EXCLUDED.type_link,
-                    link=EXCLUDED.link,
-                    latest_chapter=EXCLUDED.latest_chapter,
-                    latest_chapter_link=EXCLUDED.latest_chapter_link,
-                    update_time=EXCLUDED.update_time,
-                    author=EXCLUDED.author,
-                    author_link=EXCLUDED.author_link,
-                    status=EXCLUDED.status,
-                    ranking_values=EXCLUDED.ranking_values
-            """,
-                (
-                    item.get("NovelRanking"),
-                    item.get("NovelType"),
-                    item.get("NovelTypeLink"),
-                    item.get("NovelName"),
-                    item.get("NovelLink"),
-                    item.get("NewlesetChapter"),
-                    item.get("NewlesetChapterLink"),
-                    item.get("NovelLastUpdateTime"),
-                    item.get("Author"),
-                    item.get("AuthorLink"),
-                    item.get("NovelStatus"),
-                    item.get("RankingValues"),
-                ),
-            )
+            chapter_items = []
+            watermark_rows = {}
+            for item in items:
+                if isinstance(item, SeventeenNovelsItem):
+                    self._write_novel(cursor, item)
+                elif isinstance(item, NovelChapterItem):
+                    chapter_items.append(item)
+                elif isinstance(item, CrawlWatermarkItem):
+                    # 水位需在同批章节合并之后提交
+                    watermark_rows[item.get("NovelName")] = self._watermark_row(item)
+            if self.bulk_mode and chapter_items:
+                rows = self._merge_chapter_rows(chapter_items)
+                self._copy_chapters(cursor, rows)
+                spider.logger.debug(f"批量写入章节 {len(rows)} 条")
+            else:
+                for item in chapter_items:
+                    if item.get("ChapterContent"):
+                        self._write_chapter_content(cursor, item)
+                    else:
+                        self._write_chapter_list(cursor, item)
+            if watermark_rows:
+                self._write_watermarks(cursor, list(watermark_rows.values()))
             conn.commit()
-        except Exception as e:
+        except Exception:
             conn.rollback()
-            spider.logger.error(f"Error inserting data into PostgreSQL: {e}")
+            # 缓存中可能有随事务回滚的新小说 id
+            self.novel_ids.clear()
+            raise
         finally:
             self.connection_pool.putconn(conn)  # type: ignore
-        return item
 
-    def _process_chapter_content_item(self, item, spider):
-        conn = self.connection_pool.getconn()  # type: ignore
-        if not conn:
-            spider.logger.error("Failed to get connection from pool")
-            return item
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO novel_chapter (
-                    novel_name, volume_title, chapter_name,
-                    chapter_link, chapter_info, chapter_content
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s
-                )
-                ON CONFLICT (novel_name, chapter_name) DO UPDATE SET
-                    volume_title=EXCLUDED.volume_title,
-                    chapter_link=EXCLUDED.chapter_link,
-                    chapter_info=EXCLUDED.chapter_info,
-                    chapter_content=EXCLUDED.chapter_content
-            """,
-                (
-                    item.get("NovelName"),
-                    item.get("VolumeTitle"),
-                    item.get("ChapterName"),
-                    item.get("ChapterLink"),
-                    item.get("ChapterInfo"),
-                    item.get("ChapterContent"),
-                ),
+    def after_commit(self, items, spider):
+        # 提交成功后同步已入库章节索引，有正文的章节从断点日志中确认，章节正文全部入库的小说写入增量水位
+        known_chapters = getattr(spider, "known_chapters", None)
+        acked = []
+        for item in items:
+            if not isinstance(item, NovelChapterItem):
+                continue
+            key = (item.get("NovelName"), item.get("ChapterName"))
+            if item.get("ChapterContent"):
+                acked.append(key)
+                if known_chapters is not None:
+                    known_chapters.mark_content(*key, item.get("ChapterIndex"))
+            elif known_chapters is not None:
+                known_chapters.mark_listed(*key, item.get("ChapterIndex"))
+        self._ack_chapters(spider, acked)
+        release_watermarks(self, spider, acked)
+
+    def _write_novel(self, cursor, item):
+        cursor.execute(
+            """
+            INSERT INTO novels (
+                ranking, type, type_link, name, link,
+                latest_chapter, latest_chapter_link, update_time,
+                author, author_link, status, ranking_values
+            ) VALUES (
+                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
             )
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            spider.logger.error(f"Error inserting data into PostgreSQL: {e}")
-        finally:
-            self.connection_pool.putconn(conn)  # type: ignore
-        return item
+            ON CONFLICT (name) DO UPDATE SET
+                ranking=EXCLUDED.ranking,
+                type=EXCLUDED.type,
+                type_link=EXCLUDED.type_link,
+                link=EXCLUDED.link,
+                latest_chapter=EXCLUDED.latest_chapter,
+                latest_chapter_link=EXCLUDED.latest_chapter_link,
+                update_time=EXCLUDED.update_time,
+                author=EXCLUDED.author,
+                author_link=EXCLUDED.author_link,
+                status=EXCLUDED.status,
+                ranking_values=EXCLUDED.ranking_values
+        """,
+            (
+                item.get("NovelRanking"),
+                item.get("NovelType"),
+                item.get("NovelTypeLink"),
+                item.get("NovelName"),
+                item.get("NovelLink"),
+                item.get("NewlesetChapter"),
+                item.get("NewlesetChapterLink"),
+                item.get("NovelLastUpdateTime"),
+                item.get("Author"),
+                item.get("AuthorLink"),
+                item.get("NovelStatus"),
+                item.get("RankingValues"),
+            ),
+        )
 
-    def _process_chapter_list_item(self, item, spider):
-        conn = self.connection_pool.getconn()  # type: ignore
-        if not conn:
-            spider.logger.error("Failed to get connection from pool")
-            return item
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO novel_chapter (
-                    novel_name, volume_title, chapter_name,
-                    chapter_link, chapter_info
-                ) VALUES (
-                    %s, %s, %s, %s, %s
-                )
-                ON CONFLICT (novel_name, chapter_name) DO UPDATE SET
-                    volume_title=EXCLUDED.volume_title,
-                    chapter_link=EXCLUDED.chapter_link,
-                    chapter_info=EXCLUDED.chapter_info
-            """,
-                (
-                    item.get("NovelName"),
-                    item.get("VolumeTitle"),
-                    item.get("ChapterName"),
-                    item.get("ChapterLink"),
-                    item.get("ChapterInfo"),
-                ),
+    def _write_chapter_content(self, cursor, item):
+        content, content_blob, dict_id = self.content_codec.encode(
+            item.get("NovelName"), item.get("ChapterContent")
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO novel_chapter (
+                novel_id, novel_name, volume_title, chapter_name,
+                chapter_link, chapter_info, chapter_content,
+                volume_index, chapter_index, content_blob, dict_id, content_hash
+            ) VALUES (
+                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
             )
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            spider.logger.error(f"Error inserting data into PostgreSQL: {e}")
-        finally:
-            self.connection_pool.putconn(conn)  # type: ignore
-        return item
+            ON CONFLICT (novel_id, chapter_name) DO UPDATE SET
+                volume_title=EXCLUDED.volume_title,
+                chapter_link=EXCLUDED.chapter_link,
+                chapter_info=EXCLUDED.chapter_info,
+                volume_index=COALESCE(EXCLUDED.volume_index, novel_chapter.volume_index),
+                chapter_index=COALESCE(EXCLUDED.chapter_index, novel_chapter.chapter_index),{CONTENT_UPDATE}
+            {chapter_changed("IS DISTINCT FROM")}
+        """,
+            (
+                self.novel_ids.resolve(cursor, item.get("NovelName")),
+                item.get("NovelName"),
+                item.get("VolumeTitle"),
+                item.get("ChapterName"),
+                item.get("ChapterLink"),
+                item.get("ChapterInfo"),
+                content,
+                item.get("VolumeIndex"),
+                item.get("ChapterIndex"),
+                content_blob,
+                dict_id,
+                content_hash(item.get("ChapterContent")),
+            ),
+        )
+
+    def _write_chapter_list(self, cursor, item):
+        cursor.execute(
+            f"""
+            INSERT INTO novel_chapter (
+                novel_id, novel_name, volume_title, chapter_name,
+                chapter_link, chapter_info, volume_index, chapter_index
+            ) VALUES (
+                %s, %s, %s, %s, %s, %s, %s, %s
+            )
+            ON CONFLICT (novel_id, chapter_name) DO UPDATE SET
+                volume_title=EXCLUDED.volume_title,
+                chapter_link=EXCLUDED.chapter_link,
+                chapter_info=EXCLUDED.chapter_info,
+                volume_index=COALESCE(EXCLUDED.volume_index, novel_chapter.volume_index),
+                chapter_index=COALESCE(EXCLUDED.chapter_index, novel_chapter.chapter_index)
+            {chapter_changed("IS DISTINCT FROM")}
+        """,
+            (
+                self.novel_ids.resolve(cursor, item.get("NovelName")),
+                item.get("NovelName"),
+                item.get("VolumeTitle"),
+                item.get("ChapterName"),
+                item.get("ChapterLink"),
+                item.get("ChapterInfo"),
+                item.get("VolumeIndex"),
+                item.get("ChapterIndex"),
+            ),
+        )
+
+    @staticmethod
+    def _ack_chapters(spider, keys):
+        checkpoint = getattr(spider, "checkpoint", None)
+        if checkpoint is not None:
+            checkpoint.ack(keys)
+
+    @staticmethod
+    def _watermark_row(item):
+        return (
+            item.get("NovelName"),
+            item.get("NewlesetChapter"),
+            item.get("NovelLastUpdateTime"),
+        )
+
+    def _write_watermarks(self, cursor, rows):
+        cursor.executemany(
+            """
+            INSERT INTO crawl_watermark (
+                novel_name, latest_chapter, update_time
+            ) VALUES (
+                %s, %s, %s
+            )
+            ON CONFLICT (novel_name) DO UPDATE SET
+                latest_chapter=EXCLUDED.latest_chapter,
+                update_time=EXCLUDED.update_time,
+                crawled_at=CURRENT_TIMESTAMP
+        """,
+            rows,
+        )
+
+    def _merge_chapter_rows(self, items):
+        """同一批次内的章节按 (novel_name, chapter_name) 合并为一行"""
+        chapter_rows = {}
+        for item in items:
+            key = (item.get("NovelName"), item.get("ChapterName"))
+            content, content_blob, dict_id = self.content_codec.encode(
+                item.get("NovelName"), item.get("ChapterContent") or None
+            )
+            digest = content_hash(item.get("ChapterContent"))
+            volume_index = item.get("VolumeIndex")
+            chapter_index = item.get("ChapterIndex")
+            previous = chapter_rows.get(key)
+            if previous:
+                # 同一批次内先到的正文和章节位置不能被缺少这些字段的数据覆盖
+                if digest is None:
+                    content, content_blob, dict_id, digest = previous[5], previous[8], previous[9], previous[10]
+                if volume_index is None:
+                    volume_index = previous[6]
+                if chapter_index is None:
+                    chapter_index = previous[7]
+            chapter_rows[key] = (
+                item.get("NovelName"),
+                item.get("VolumeTitle"),
+                item.get("ChapterName"),
+                item.get("ChapterLink"),
+                item.get("ChapterInfo"),
+                content,
+                volume_index,
+                chapter_index,
+                content_blob,
+                dict_id,
+                digest,
+            )
+        return list(chapter_rows.values())
+
+    @staticmethod
+    def _copy_value(value):
+        # COPY text 格式：\N 表示 NULL，反斜杠与控制字符需转义
+        if value is None:
+            return "\\N"
+        if isinstance(value, (bytes, memoryview)):
+            # bytea 十六进制格式，反斜杠在 COPY 中需转义
+            return "\\\\x" + bytes(value).hex()
+        return (
+            str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+
+    def _copy_chapters(self, cursor, rows):
+        """COPY 章节到临时表，再一次性合并到 novel_chapter"""
+        # 小说名先解析为 novel_id（新小说在同一事务中插入），再随章节一起 COPY
+        buffer = io.StringIO()
+        for row in rows:
+            novel_id = self.novel_ids.resolve(cursor, row[0])
+            buffer.write("\t".join(self._copy_value(value) for value in (novel_id,) + row))
+            buffer.write("\n")
+        buffer.seek(0)
+        cursor.execute(
+            """
+            CREATE TEMP TABLE novel_chapter_stage (
+                novel_id INTEGER,
+                novel_name TEXT,
+                volume_title TEXT,
+                chapter_name TEXT,
+                chapter_link TEXT,
+                chapter_info TEXT,
+                chapter_content TEXT,
+                volume_index INTEGER,
+                chapter_index INTEGER,
+                content_blob BYTEA,
+                dict_id INTEGER,
+                content_hash TEXT
+            ) ON COMMIT DROP
+        """
+        )
+        cursor.copy_expert(
+            """
+            COPY novel_chapter_stage (
+                novel_id, novel_name, volume_title, chapter_name,
+                chapter_link, chapter_info, chapter_content,
+                volume_index, chapter_index, content_blob, dict_id, content_hash
+            ) FROM STDIN
+        """,
+            buffer,
+        )
+        # 只有带正文且哈希变化的行才替换正文（明文或压缩），章节列表数据保留已有正文
+        cursor.execute(
+            f"""
+            INSERT INTO novel_chapter (
+                novel_id, novel_name, volume_title, chapter_name,
+                chapter_link, chapter_info, chapter_content,
+                volume_index, chapter_index, content_blob, dict_id, content_hash
+            )
+            SELECT
+                novel_id, novel_name, volume_title, chapter_name,
+                chapter_link, chapter_info, chapter_content,
+                volume_index, chapter_index, content_blob, dict_id, content_hash
+            FROM novel_chapter_stage
+            ON CONFLICT (novel_id, chapter_name) DO UPDATE SET
+                volume_title=EXCLUDED.volume_title,
+                chapter_link=EXCLUDED.chapter_link,
+                chapter_info=EXCLUDED.chapter_info,
+                volume_index=COALESCE(EXCLUDED.volume_index, novel_chapter.volume_index),
+                chapter_index=COALESCE(EXCLUDED.chapter_index, novel_chapter.chapter_index),{CONTENT_UPDATE}
+            {chapter_changed("IS DISTINCT FROM")}
+        """
+        )
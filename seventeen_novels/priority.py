@@ -0,0 +1,62 @@
+# 章节请求调度优先级：榜单靠前的小说、新发布的章节先抓，缺正文的旧章节回填排在后面
+NEW_CHAPTER = "new"
+BACKFILL_CHAPTER = "backfill"
+
+
+class ChapterPriorityPolicy:
+    """priority = 排名分 + 新章节加分 + 目录位置分，数值越大越先调度
+
+    排名分：(max_ranking + 1 - 排名) * rank_weight，排名未知按榜尾计算
+    新章节：小说已有章节入库、本次目录中新出现的章节；首次抓取的小说和缺正文的旧章节都算回填
+    目录位置分：chapter_index / 章节总数 * recency_weight，同一本小说越新的章节越先抓
+    重试次数由 RetryMiddleware 按 RETRY_PRIORITY_ADJUST 降低优先级，见 update_settings
+    """
+
+    def __init__(self, rank_weight=10, new_chapter_bonus=2000, recency_weight=9, max_ranking=100):
+        self.rank_weight = rank_weight
+        self.new_chapter_bonus = new_chapter_bonus
+        self.recency_weight = recency_weight
+        self.max_ranking = max_ranking
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            rank_weight=settings.getint("CHAPTER_PRIORITY_RANK_WEIGHT", 10),
+            new_chapter_bonus=settings.getint("CHAPTER_PRIORITY_NEW_BONUS", 2000),
+            recency_weight=settings.getint("CHAPTER_PRIORITY_RECENCY_WEIGHT", 9),
+        )
+
+    @staticmethod
+    def update_settings(settings):
+        """供使用本策略的 spider 在 update_settings 中调用：每次重试降低 CHAPTER_PRIORITY_RETRY_PENALTY
+
+        只设置为 spider 级别，不影响其他 spider，命令行 -s RETRY_PRIORITY_ADJUST 仍可覆盖。
+        """
+        penalty = settings.getint("CHAPTER_PRIORITY_RETRY_PENALTY", 50)
+        settings.set("RETRY_PRIORITY_ADJUST", -penalty, priority="spider")
+
+    @staticmethod
+    def classify(novel_known, chapter_known):
+        """novel_known：解析目录前该小说已有章节入库；chapter_known：该章节已入库"""
+        if novel_known and not chapter_known:
+            return NEW_CHAPTER
+        return BACKFILL_CHAPTER
+
+    def rank_score(self, ranking):
+        try:
+            ranking = int(ranking)
+        except (TypeError, ValueError):
+            ranking = self.max_ranking
+        return max(self.max_ranking + 1 - ranking, 0) * self.rank_weight
+
+    def chapter_priority(self, ranking, kind, chapter_index=None, chapter_total=None):
+        priority = self.rank_score(ranking)
+        if kind == NEW_CHAPTER:
+            priority += self.new_chapter_bonus
+        if chapter_index and chapter_total:
+            priority += int(chapter_index / chapter_total * self.recency_weight)
+        return priority
+
+    def list_priority(self, ranking):
+        # 章节列表先于同一本小说的任何章节正文，尽早发现新章节
+        return self.rank_score(ranking) + self.new_chapter_bonus + self.recency_weight + 1
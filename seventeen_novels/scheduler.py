@@ -0,0 +1,93 @@
+# 限制回填请求的并发占比：新章节与章节列表始终有空闲的下载并发可用
+import math
+import weakref
+
+from scrapy import signals
+from scrapy.core.scheduler import Scheduler
+
+from .priority import BACKFILL_CHAPTER
+
+
+class ChapterPriorityScheduler(Scheduler):
+    """在 Scrapy 默认调度器之上限制 meta["chapter_kind"] 为回填的请求同时在途数量
+
+    上限为 CONCURRENT_REQUESTS * CHAPTER_BACKFILL_MAX_SHARE（至少 1，share 不小于 1 时不限制）。
+    达到上限时最多在内存中暂存一个出队的回填请求，继续取队列中排在它后面的请求；
+    队首又是回填请求时只 peek 不出队，等有空位后再取，请求不会反复出入队列。
+    在途请求用 WeakSet 记录，下载结束或请求被释放时自动移除。
+    """
+
+    def __init__(self, *args, backfill_limit=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.backfill_limit = backfill_limit
+        self.backfill_in_flight = weakref.WeakSet()
+        self.held_backfill = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        scheduler = super().from_crawler(crawler)
+        share = crawler.settings.getfloat("CHAPTER_BACKFILL_MAX_SHARE", 1.0)
+        if share < 1:
+            concurrency = crawler.settings.getint("CONCURRENT_REQUESTS")
+            scheduler.backfill_limit = max(math.floor(concurrency * share), 1)
+        crawler.signals.connect(scheduler._request_done, signal=signals.response_received)
+        crawler.signals.connect(scheduler._request_done, signal=signals.request_left_downloader)
+        return scheduler
+
+    def __len__(self):
+        return super().__len__() + (self.held_backfill is not None)
+
+    def next_request(self):
+        if not self.backfill_limit:
+            return super().next_request()
+        if self.held_backfill is not None and not self._backfill_full():
+            # 暂存的请求出队更早，优先级不低于队列中的请求
+            request, self.held_backfill = self.held_backfill, None
+            return self._start_backfill(request)
+        while True:
+            if self.held_backfill is not None and self._next_is_backfill():
+                # 已暂存一个回填请求，队首的回填请求留在队列中
+                return None
+            request = super().next_request()
+            if request is None or not self._is_backfill(request):
+                return request
+            if not self._backfill_full():
+                return self._start_backfill(request)
+            self.held_backfill = request
+            self.stats.inc_value("scheduler/backfill_held")  # type: ignore
+
+    def close(self, reason):
+        # 暂存的请求放回队列，设置了 JOBDIR 时随磁盘队列一起保存
+        if self.held_backfill is not None:
+            if not self._dqpush(self.held_backfill):
+                self._mqpush(self.held_backfill)
+            self.held_backfill = None
+        return super().close(reason)
+
+    def _start_backfill(self, request):
+        self.backfill_in_flight.add(request)
+        return request
+
+    def _next_is_backfill(self):
+        """不出队查看下一个请求（与 Scheduler.next_request 一样先内存队列后磁盘队列）是否为回填请求
+
+        队列类不支持 peek 时按回填处理，暂存的请求放行前不再出队。
+        """
+        queue = self.mqs if len(self.mqs) else self.dqs
+        if queue is None or not len(queue):
+            return False
+        try:
+            request = queue.peek()
+        except NotImplementedError:
+            return True
+        return request is not None and self._is_backfill(request)
+
+    @staticmethod
+    def _is_backfill(request):
+        return request.meta.get("chapter_kind") == BACKFILL_CHAPTER
+
+    def _backfill_full(self):
+        return len(self.backfill_in_flight) >= self.backfill_limit
+
+    def _request_done(self, request, spider=None, response=None):
+        self.backfill_in_flight.discard(request)
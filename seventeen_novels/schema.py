@@ -0,0 +1,150 @@
+# 数据库结构版本与迁移：novel_chapter 通过整数 novel_id 关联 novels.id
+from .chapter_number import extract_chapter_number
+
+# 版本 1：章节以 (novel_name, chapter_name) 为唯一键
+# 版本 2：章节以 (novel_id, chapter_name) 为唯一键，novel_name 仅作冗余展示字段，不再建索引
+# 版本 3：旧章节按章节名回填 chapter_index，只在升级时执行一次，解析不出章节号的保持 NULL
+SCHEMA_VERSION = 3
+
+# 按小说名筛选章节时使用，走 novel_id 索引；{} 处填入占位符
+NOVEL_ID_FILTER = "novel_id = (SELECT id FROM novels WHERE name = {})"
+
+# 有正文的章节：明文或压缩正文二者之一非空
+HAS_CONTENT = "(chapter_content is not null OR content_blob is not null)"
+
+# 增量爬取使用的水位：仍有章节缺少正文的小说不返回水位，增量爬取时不会被跳过
+COMPLETE_WATERMARK_SQL = """
+    SELECT w.novel_name, w.latest_chapter, w.update_time FROM crawl_watermark w
+    WHERE NOT EXISTS (
+        SELECT 1 FROM novel_chapter c
+        WHERE c.novel_id = (SELECT id FROM novels WHERE name = w.novel_name)
+        AND (c.chapter_content IS NULL OR c.chapter_content = '') AND c.content_blob IS NULL
+    )
+"""
+
+
+def get_schema_version(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    return cursor.fetchone()[0] or 1
+
+
+def set_schema_version(cursor, version):
+    cursor.execute("DELETE FROM schema_version")
+    cursor.execute(f"INSERT INTO schema_version (version) VALUES ({int(version)})")
+
+
+def migrate_schema(cursor, use_pg=False, logger=None):
+    """把章节表升级到 SCHEMA_VERSION，已是最新版本时只做检查；调用方负责提交事务"""
+    version = get_schema_version(cursor)
+    if version >= SCHEMA_VERSION:
+        return version
+    if version < 2:
+        migrated = migrate_novel_id(cursor, use_pg)
+        if logger is not None:
+            logger.info(f"章节已关联 novel_id: {migrated}")
+    backfilled = backfill_chapter_index(cursor, "%s" if use_pg else "?")
+    if backfilled and logger is not None:
+        logger.info(f"已为 {backfilled} 个旧章节回填 chapter_index")
+    set_schema_version(cursor, SCHEMA_VERSION)
+    if logger is not None:
+        logger.info(f"数据库结构已从版本 {version} 升级到 {SCHEMA_VERSION}")
+    return SCHEMA_VERSION
+
+
+def migrate_novel_id(cursor, use_pg=False):
+    """版本 1 -> 2：章节关联 novels.id，唯一键和排序索引改为 novel_id 开头，返回关联的章节数"""
+    if use_pg:
+        cursor.execute(
+            "ALTER TABLE novel_chapter ADD COLUMN IF NOT EXISTS novel_id INTEGER REFERENCES novels(id)"
+        )
+    else:
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(novel_chapter)")}
+        if "novel_id" not in columns:
+            cursor.execute("ALTER TABLE novel_chapter ADD COLUMN novel_id INTEGER REFERENCES novels(id)")
+    # 章节所属小说不在榜单表中时补一条只有名称的记录
+    cursor.execute(
+        """
+        INSERT INTO novels (name)
+        SELECT DISTINCT novel_name FROM novel_chapter
+        WHERE novel_name IS NOT NULL AND novel_name NOT IN (SELECT name FROM novels WHERE name IS NOT NULL)
+    """
+    )
+    if use_pg:
+        cursor.execute(
+            """
+            UPDATE novel_chapter c SET novel_id = n.id
+            FROM novels n WHERE n.name = c.novel_name AND c.novel_id IS NULL
+        """
+        )
+    else:
+        cursor.execute(
+            """
+            UPDATE novel_chapter SET novel_id = (
+                SELECT id FROM novels WHERE novels.name = novel_chapter.novel_name
+            ) WHERE novel_id IS NULL
+        """
+        )
+    migrated = cursor.rowcount
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_chapter_novel_id ON novel_chapter(novel_id, chapter_name)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chapter_novel_order ON novel_chapter(novel_id, chapter_index)"
+    )
+    # 旧的字符串键索引不再使用
+    if use_pg:
+        cursor.execute(
+            "ALTER TABLE novel_chapter DROP CONSTRAINT IF EXISTS novel_chapter_novel_name_chapter_name_key"
+        )
+    cursor.execute("DROP INDEX IF EXISTS idx_chapter_name")
+    cursor.execute("DROP INDEX IF EXISTS idx_chapter_order")
+    return migrated
+
+
+def backfill_chapter_index(cursor, placeholder="?"):
+    """版本 2 -> 3：为旧数据中缺少 chapter_index 的章节按章节名解析出的章节号回填，解析不出的保持 NULL"""
+    cursor.execute("SELECT id, chapter_name FROM novel_chapter WHERE chapter_index IS NULL")
+    rows = []
+    for chapter_id, chapter_name in cursor.fetchall():
+        number = extract_chapter_number(chapter_name or "")
+        if number != float("inf"):
+            rows.append((number, chapter_id))
+    if rows:
+        cursor.executemany(
+            f"UPDATE novel_chapter SET chapter_index = {placeholder} WHERE id = {placeholder}",
+            rows,
+        )
+    return len(rows)
+
+
+class NovelIdCache:
+    """小说名到 novels.id 的进程内缓存
+
+    查不到时插入一条只有名称的小说记录。缓存的 id 可能来自尚未提交的事务，
+    事务回滚后需调用 clear。
+    """
+
+    def __init__(self, use_pg=False):
+        self.placeholder = "%s" if use_pg else "?"
+        self.ids = {}
+
+    def resolve(self, cursor, novel_name):
+        novel_id = self.ids.get(novel_name)
+        if novel_id is not None:
+            return novel_id
+        select_sql = f"SELECT id FROM novels WHERE name = {self.placeholder}"
+        cursor.execute(select_sql, (novel_name,))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute(
+                f"INSERT INTO novels (name) VALUES ({self.placeholder}) ON CONFLICT (name) DO NOTHING",
+                (novel_name,),
+            )
+            cursor.execute(select_sql, (novel_name,))
+            row = cursor.fetchone()
+        self.ids[novel_name] = row[0]
+        return row[0]
+
+    def clear(self):
+        self.ids.clear()
@@ -24,6 +24,14 @@ PG_PASSWORD = os.environ.get("PG_PASSWORD", "novel_spider")
 PG_DBNAME = os.environ.get("PG_DBNAME", "postgres")
 PG_MINCONN = int(os.environ.get("PG_MINCONN", 1))
 PG_MAXCONN = int(os.environ.get("PG_MAXCONN", 4))
+# spider 回调中查询 PostgreSQL 的线程数（与 pipeline 共用连接池），
+# 不超过 PG_MAXCONN - 1，启用 WRITE_BEHIND_ENABLED 时再减去写线程占用的 1 个连接
+PG_QUERY_THREADS = int(os.environ.get("PG_QUERY_THREADS", 2))
+
+# 站点地址，auto_novel_top100 / auto_novel_top100_postgre 的榜单和相对链接以此为准（压测时指向本地模拟站点）
+NOVEL_SITE_BASE_URL = os.environ.get("NOVEL_SITE_BASE_URL", "https://www.17k.com")
+# auto_novel_top100 的 SQLite 数据库路径，为空时使用 output/novel_data.db
+SQLITE_DB_PATH = os.environ.get("SQLITE_DB_PATH", "")
 
 BOT_NAME = "seventeen_novels"
 
@@ -44,6 +52,17 @@ ROBOTSTXT_OBEY = False
 # CONCURRENT_REQUESTS = 32
 CONCURRENT_REQUESTS = 64
 
+# 章节请求调度优先级（priority.ChapterPriorityPolicy），数值越大越先抓取：
+# 排名分 = (101 - 榜单排名) * RANK_WEIGHT；已入库小说新出现的章节另加 NEW_BONUS；
+# 同一本小说中越靠后的章节加 0 ~ RECENCY_WEIGHT 分；每次重试降低 RETRY_PENALTY（只对榜单爬虫生效）
+CHAPTER_PRIORITY_RANK_WEIGHT = 10
+CHAPTER_PRIORITY_NEW_BONUS = 2000
+CHAPTER_PRIORITY_RECENCY_WEIGHT = 9
+CHAPTER_PRIORITY_RETRY_PENALTY = 50
+# 缺正文的旧章节（回填）最多占用 CONCURRENT_REQUESTS 的比例，为新章节保留下载并发；1 表示不限制
+SCHEDULER = "seventeen_novels.scheduler.ChapterPriorityScheduler"
+CHAPTER_BACKFILL_MAX_SHARE = 0.5
+
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
@@ -63,8 +82,6 @@ COOKIES_ENABLED = False
 DEFAULT_REQUEST_HEADERS = {
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
     "Accept-language": "zh-CN,zh;q=0.9",
-    "cache-control": "no-cache",
-    "pragma": "no-cache",
 }
 
 # Enable or disable spider middlewares
@@ -72,18 +89,105 @@ DEFAULT_REQUEST_HEADERS = {
 # SPIDER_MIDDLEWARES = {
 #    "seventeen_novels.middlewares.SeventeenNovelsSpiderMiddleware": 543,
 # }
+SPIDER_MIDDLEWARES = {
+    # 排在 Offsite(500)、UrlLength(800)、Depth(900) 之下，只记录没有被过滤掉的请求
+    "seventeen_novels.middlewares.CrawlCheckpointMiddleware": 450,
+    # 排在 Depth(900) 之上，最靠近 spider，只测量回调本身的耗时
+    "seventeen_novels.middlewares.StageTimingMiddleware": 950,
+}
+
+# 断点续爬配置（auto_novel_top100_postgre）
+# 章节正文请求交给调度器前记入 SQLite 断点日志，章节提交到数据库后才删除；
+# 爬虫未正常结束时日志保留，下次启动直接恢复未完成的章节请求，跳过已处理完章节列表的小说。
+# 设置了 JOBDIR 时日志写在 JOBDIR/chapter_checkpoint.db，否则写在 CRAWL_CHECKPOINT_FILE
+CRAWL_CHECKPOINT_ENABLED = True
+CRAWL_CHECKPOINT_FILE = os.environ.get("CRAWL_CHECKPOINT_FILE", "output/crawl_checkpoint.db")
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 # DOWNLOADER_MIDDLEWARES = {
 #    "seventeen_novels.middlewares.SeventeenNovelsDownloaderMiddleware": 543,
 # }
+DOWNLOADER_MIDDLEWARES = {
+    # 复用 Selenium 通过验证后的 cookie（内置 CookiesMiddleware 已由 COOKIES_ENABLED 关闭），
+    # process_response 排在反爬检测之后，只保存验证通过的 cookie
+    "seventeen_novels.middlewares.ChallengeCookiesMiddleware": 540,
+    # 在 HttpCompressionMiddleware(590) 解压之后检测，验证页不会进入 spider 回调
+    "seventeen_novels.middlewares.AntiBotDetectorMiddleware": 580,
+    # HTTP 缓存移到 HttpCompressionMiddleware(590) 之下，缓存解压后的正文并由缓存存储自行压缩
+    # 304 重新验证后刷新缓存的存入时间
+    "seventeen_novels.httpcache.RevalidatingHttpCacheMiddleware": 585,
+    "scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware": None,
+    # 放在最靠近下载器的位置，替代 meta["selenium"] 请求的下载
+    "seventeen_novels.middlewares.SeleniumFallbackMiddleware": 950,
+}
+
+# Selenium 反爬虫兜底配置（SeleniumFallbackMiddleware）
+SELENIUM_ENABLED = True
+# 同时运行的 headless Chrome 数量，也是渲染线程数
+SELENIUM_POOL_SIZE = int(os.environ.get("SELENIUM_POOL_SIZE", 2))
+# 单个 driver 渲染满该数量页面后重建，0 表示不限制
+SELENIUM_MAX_PAGES_PER_DRIVER = 200
+# driver 崩溃（会话失效等）时丢弃并重建
+SELENIUM_RECYCLE_ON_CRASH = True
+SELENIUM_CHROMEDRIVER_PATH = os.environ.get("CHROMEDRIVER_PATH", "/usr/local/bin/chromedriver")
+SELENIUM_CHROME_BIN = os.environ.get("CHROME_BIN", "/usr/bin/google-chrome")
+# 页面加载后等待脚本执行、滚动到底部后等待的秒数
+SELENIUM_RENDER_WAIT = 1.0
+SELENIUM_SCROLL_WAIT = 0.5
+SELENIUM_MAX_RETRY = 3
+SELENIUM_RETRY_WAIT = 2.0
+
+# 反爬验证页检测配置（AntiBotDetectorMiddleware）
+# 不超过 ANTIBOT_FULL_SCAN_BYTES 的页面整页匹配全部关键字，更大的页面只检查
+# 前 ANTIBOT_HEAD_SCAN_BYTES 字节内的 <head> 与 <script>；
+# 关键字可通过 ANTIBOT_KEYWORDS / ANTIBOT_WEAK_KEYWORDS 覆盖，默认见 antibot.py
+ANTIBOT_FULL_SCAN_BYTES = 16384
+ANTIBOT_HEAD_SCAN_BYTES = 65536
+
+# 反爬验证 cookie 复用配置（ChallengeCookiesMiddleware）
+CHALLENGE_COOKIES_ENABLED = True
+# 没有过期时间的会话 cookie 的保留秒数
+CHALLENGE_COOKIES_TTL = 1800
+# 等待同域名其他请求完成 Selenium 验证的最长秒数，超时后自行验证；0 表示不限制
+CHALLENGE_SOLVE_TIMEOUT = 180
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 # EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
 # }
+EXTENSIONS = {
+    "seventeen_novels.extensions.AdaptiveThrottle": 500,
+    "seventeen_novels.extensions.StageMetrics": 510,
+}
+
+# 分阶段统计配置（StageMetrics + StageTimingMiddleware）
+# 下载、Selenium 渲染、回调、数据库写入耗时及调度器/下载器/scraper/pipeline 队列长度记为直方图，
+# 每 STAGE_METRICS_INTERVAL 秒写入 stats 的 stage_metrics/*；队列长度每 SAMPLE_INTERVAL 秒采样一次。
+# 设置 STAGE_METRICS_PROMETHEUS_FILE（如 /var/lib/node_exporter/textfile/novel_spider.prom）后
+# 同时写入 Prometheus 文本格式文件，供 node_exporter 的 textfile collector 采集
+STAGE_METRICS_ENABLED = True
+STAGE_METRICS_INTERVAL = 30.0
+STAGE_METRICS_SAMPLE_INTERVAL = 1.0
+STAGE_METRICS_PROMETHEUS_FILE = os.environ.get("STAGE_METRICS_PROMETHEUS_FILE", "")
+
+# 自适应限速配置（AdaptiveThrottle，与 AUTOTHROTTLE_ENABLED 互斥）
+# 按反爬验证页比例与下载延迟的滑动平均，AIMD 方式调整每个域名的并发与下载间隔：
+# 验证页比例达到 CHALLENGE_BACKOFF 或延迟超过 TARGET_LATENCY 的 2 倍时并发乘以 BACKOFF_FACTOR、间隔翻倍；
+# 低于 CHALLENGE_WARN 且延迟正常时并发逐步加 1、间隔减少 DELAY_STEP；
+# 并发上限为 CONCURRENT_REQUESTS_PER_DOMAIN，间隔下限为 DOWNLOAD_DELAY，状态见 stats 中的 adaptive_throttle/*
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_THROTTLE_START_CONCURRENCY = 8
+ADAPTIVE_THROTTLE_MIN_CONCURRENCY = 1
+ADAPTIVE_THROTTLE_MAX_DELAY = 10.0
+ADAPTIVE_THROTTLE_DELAY_STEP = 0.05
+ADAPTIVE_THROTTLE_TARGET_LATENCY = 2.0
+ADAPTIVE_THROTTLE_CHALLENGE_WARN = 0.01
+ADAPTIVE_THROTTLE_CHALLENGE_BACKOFF = 0.05
+ADAPTIVE_THROTTLE_BACKOFF_FACTOR = 0.5
+ADAPTIVE_THROTTLE_COOLDOWN = 5.0
+ADAPTIVE_THROTTLE_EWMA_ALPHA = 0.05
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
@@ -101,6 +205,38 @@ ITEM_PIPELINES = {
     "seventeen_novels.pipelines.AutoNovelsTop100PostgrePipeline": 500,
 }
 
+# AutoNovelsTop100Pipeline（SQLite）写入配置
+# 缓冲满 SQLITE_BATCH_SIZE 条或距上次写入超过 SQLITE_FLUSH_INTERVAL_MS 毫秒时，
+# 在同一个事务中用 executemany 批量写入；SQLITE_BATCH_SIZE = 1 即逐条提交
+SQLITE_BATCH_SIZE = 500
+SQLITE_FLUSH_INTERVAL_MS = 2000
+# WAL 模式下读写互不阻塞，配合 synchronous=NORMAL 只在检查点时 fsync
+SQLITE_JOURNAL_MODE = "WAL"
+SQLITE_SYNCHRONOUS = "NORMAL"
+
+# 章节正文解析进程数，0 表示在 reactor 线程中直接解析；大于 0 时交给进程池，
+# 同时在途的解析任务不超过 CHAPTER_PARSE_MAX_IN_FLIGHT 个（0 表示进程数的 4 倍）
+CHAPTER_PARSE_WORKERS = int(os.environ.get("CHAPTER_PARSE_WORKERS", 0))
+CHAPTER_PARSE_MAX_IN_FLIGHT = 0
+# AutoNovelsTop100PostgrePipeline 批量写入配置
+# 开启后章节数据先在内存中合并缓冲，满 PG_BULK_FLUSH_SIZE 条或超过
+# PG_BULK_FLUSH_INTERVAL_MS 毫秒时通过 COPY FROM STDIN 写入临时表，
+# 再用一条 INSERT ... SELECT ... ON CONFLICT 合并到 novel_chapter
+PG_BULK_MODE = True
+PG_BULK_FLUSH_SIZE = 1000
+PG_BULK_FLUSH_INTERVAL_MS = 2000
+# 写后模式：SQLite 与 PostgreSQL pipeline 各用一个专用写线程攒批提交，reactor 线程只负责入队
+# WRITE_BEHIND_QUEUE_SIZE 为待写入队列上限，队列满时 pipeline 暂缓返回，爬取速度随之下降（背压）
+# WRITE_BEHIND_ACK_ON_COMMIT 开启后 item 在数据库提交后才算处理完成，写入失败的 item 被丢弃并计入日志；
+# 关闭时 item 入队即返回，进程被强杀可能丢失队列中尚未提交的数据（章节仍可由断点日志续爬）
+WRITE_BEHIND_ENABLED = True
+WRITE_BEHIND_QUEUE_SIZE = 10000
+WRITE_BEHIND_ACK_ON_COMMIT = False
+# 章节正文存储编码：none 为明文存入 chapter_content；zstd 为压缩后存入 content_blob
+# （需安装 zstandard），压缩字典由 run.py migrate-content 训练并保存在 content_dict 表中
+CHAPTER_CONTENT_CODEC = os.environ.get("CHAPTER_CONTENT_CODEC", "none")
+CHAPTER_CONTENT_COMPRESSION_LEVEL = 3
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 # AUTOTHROTTLE_ENABLED = True
@@ -116,11 +252,24 @@ ITEM_PIPELINES = {
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-# HTTPCACHE_ENABLED = True
-# HTTPCACHE_EXPIRATION_SECS = 0
-# HTTPCACHE_DIR = "httpcache"
-# HTTPCACHE_IGNORE_HTTP_CODES = []
-# HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+# 正式抓取默认关闭；榜单爬虫以 -a local=1 运行时自动开启，开发时也可用 -s HTTPCACHE_ENABLED=1 开启
+HTTPCACHE_ENABLED = False
+HTTPCACHE_EXPIRATION_SECS = 0
+HTTPCACHE_DIR = "httpcache"
+# 所有响应保存在 .scrapy/httpcache/httpcache.db 一个文件中
+HTTPCACHE_STORAGE = "seventeen_novels.httpcache.SqliteCacheStorage"
+HTTPCACHE_SQLITE_FILE = "httpcache.db"
+# 正文压缩方式：zstd（需安装 zstandard，未安装时自动改用 gzip）、gzip、identity
+HTTPCACHE_COMPRESSION = "zstd"
+HTTPCACHE_COMPRESSION_LEVEL = 3
+# 按 URL 设置缓存有效期（秒），过期后通过 ETag/Last-Modified 条件请求重新验证（0 表示永不过期，不要用于会修改的页面）
+# 反爬虫验证页永远不会被缓存
+HTTPCACHE_POLICY = "seventeen_novels.httpcache.NovelCachePolicy"
+HTTPCACHE_URL_TTLS = {
+    r"/chapter/\d+/\d+\.html": 86400,  # 章节正文，发布后仍可能被修改，按天重新验证
+    r"/list/\d+\.html": 3600,  # 章节列表，spider 每次都强制重新验证
+    r"/top/": 600,  # Top100 榜单
+}
 
 # Set settings whose default value is deprecated to a future-proof value
 FEED_EXPORT_ENCODING = "utf-8"
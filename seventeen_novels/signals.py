@@ -0,0 +1,15 @@
+# 项目自定义信号，通过 crawler.signals.connect 订阅
+
+# AntiBotDetectorMiddleware 每检测完一个响应发送一次
+# 参数：request, response, spider, challenge（是否为反爬验证页）
+antibot_checked = object()
+
+# 一次阶段耗时测量，由 StageMetrics 扩展汇总为直方图
+# 参数：stage（callback / pipeline）、name（回调名或写入操作）、seconds、spider
+stage_timed = object()
+
+
+def send_stage_timed(crawler, stage, name, seconds, spider=None):
+    """crawler 为 None 时（如单独实例化的 pipeline）不发送"""
+    if crawler is not None:
+        crawler.signals.send_catch_log(stage_timed, stage=stage, name=name, seconds=seconds, spider=spider)
@@ -1,86 +1,75 @@
 import scrapy
 import os
 import sqlite3
-import time
+from urllib.parse import urlparse
 
-from scrapy.selector import Selector
-from ..items import SeventeenNovelsItem, NovelChapterItem
+from scrapy.utils.defer import maybe_deferred_to_future
+
+from ..chapter_index import KnownChapterIndex, PendingWatermarks
+from ..parse_engine import ChapterParseEngine
+from ..priority import ChapterPriorityPolicy
+from ..schema import COMPLETE_WATERMARK_SQL
+from ..items import SeventeenNovelsItem, NovelChapterItem, CrawlWatermarkItem
 
-# Selenium相关
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
-from scrapy import signals
 
 class AutoNovelTop100Spider(scrapy.Spider):
     name = "auto_novel_top100"
     allowed_domains = ["17k.com", "www.17k.com"]
 
-    def __init__(self, local=False, *args, **kwargs):
+    def __init__(self, local=False, incremental=False, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.local = local
+        # 增量模式：榜单上最新章节与更新时间均未变化的小说不再抓取章节列表
+        self.incremental = incremental
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
         self.output_dir = os.path.abspath(os.path.join(self.base_dir, "..", "..", "output"))
         self.db_path = os.path.join(self.output_dir, "novel_data.db")
-        self.driver = None  # Selenium driver实例
+        self.site_url = "https://www.17k.com"
+        # 已入库章节索引，由 pipeline 在提交后同步
+        self.known_chapters = KnownChapterIndex(self.load_known_chapters)
+        # 章节正文全部入库后才由 pipeline 写入的增量水位
+        self.pending_watermarks = PendingWatermarks()
+
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        # 重试请求按 CHAPTER_PRIORITY_RETRY_PENALTY 降低优先级
+        ChapterPriorityPolicy.update_settings(settings)
 
     @classmethod
     def from_crawler(cls, crawler, *args, **kwargs):
         spider = super().from_crawler(crawler, *args, **kwargs)
-        crawler.signals.connect(spider.open_spider, signal=signals.spider_opened)
-        crawler.signals.connect(spider.close_spider, signal=signals.spider_closed)
+        if spider.local:
+            # 本地重跑开启 HTTP 缓存，已下载的页面不再重复请求站点；-s HTTPCACHE_ENABLED=0 仍可关闭
+            crawler.settings.set("HTTPCACHE_ENABLED", True, priority="spider")
+        # 章节正文解析引擎，CHAPTER_PARSE_WORKERS 大于 0 时使用进程池
+        spider.parse_engine = ChapterParseEngine.from_crawler(crawler)
+        spider.priority_policy = ChapterPriorityPolicy.from_settings(crawler.settings)
+        # 站点地址与数据库路径可通过 settings 覆盖（压测时指向本地模拟站点和临时数据库）
+        spider.site_url = crawler.settings.get("NOVEL_SITE_BASE_URL", "https://www.17k.com").rstrip("/")
+        site_host = urlparse(spider.site_url).hostname
+        if site_host and site_host not in spider.allowed_domains:
+            spider.allowed_domains = [*spider.allowed_domains, site_host]
+        if crawler.settings.get("SQLITE_DB_PATH"):
+            spider.db_path = os.path.abspath(crawler.settings.get("SQLITE_DB_PATH"))
         return spider
 
-    def open_spider(self, spider):
-        # Spider启动时创建driver
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--enable-unsafe-swiftshader")
-        user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36"
-        chrome_options.add_argument(f"user-agent={user_agent}")
-
-        chromedriver_path = r"C:\Users\wtf50\.wdm\drivers\chromedriver\win64\137.0.7151.70\chromedriver-win32\chromedriver.exe"
-        if not os.path.exists(chromedriver_path):
-            self.logger.error(f"ChromeDriver not found at {chromedriver_path}")
-            self.driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-        else:
-            self.driver = webdriver.Chrome(service=Service(chromedriver_path), options=chrome_options)
-        self.driver.implicitly_wait(15)
-        self.driver.set_page_load_timeout(25)
-
-    def close_spider(self, spider):
-        # Spider关闭时关闭driver
-        if self.driver:
-            self.driver.quit()
-            self.driver = None
+    async def start(self):
+        # Scrapy 2.13 起以 start() 作为入口，较新版本不再回退调用 start_requests()
+        for request in self.start_requests():
+            yield request
 
     def start_requests(self):
         # Step 1: 抓取Top100榜单
         if not os.path.exists(self.db_path) or not self.local:
-            url = "https://www.17k.com/top/refactor/top100/06_vipclick/06_click_freeBook_top_100_pc.html"
+            url = self.site_url + "/top/refactor/top100/06_vipclick/06_click_freeBook_top_100_pc.html"
             yield scrapy.Request(url, callback=self.parse_top100)
         else:
             # 已有榜单，直接进入下一步
             yield from self.request_chapter_list()
 
     def parse_top100(self, response):
-        anti_spider_keywords = [
-            "setCookie", "reload", "_0x", "window.location", "检测到异常请求", "访问验证", "人机验证"
-        ]
-        html_content = response.text
-        is_anti_spider = any(keyword in html_content for keyword in anti_spider_keywords)
-        if is_anti_spider:
-            self.logger.warning("检测到反爬虫页面，尝试用Selenium重新获取页面内容")
-            html_content = self.get_html_with_selenium(response.url)
-            if not html_content:
-                self.logger.error("Selenium 仍然未能绕过反爬虫，终止解析")
-                return
-            selector = Selector(text=html_content)
-        else:
-            selector = response
+        selector = response
 
         table_content = selector.xpath(
             '//div[contains(@class, "BOX") and contains(@style, "block")]//table'
@@ -110,19 +99,39 @@ class AutoNovelTop100Spider(scrapy.Spider):
             yield item
 
         # 进入下一步
-        yield from self.request_chapter_list()
+        yield from self.request_chapter_list(items)
 
-    def request_chapter_list(self):
+    def request_chapter_list(self, fresh_items=None):
         # Step 2: 直接从pipeline写入的sqlite读取榜单
-        if not os.path.exists(self.db_path):
+        novels = {}
+        if os.path.exists(self.db_path):
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT name, link, ranking, latest_chapter, update_time FROM novels WHERE link IS NOT NULL order by ranking"
+            )
+            for novel_name, novel_link, ranking, latest_chapter, update_time in cursor.fetchall():
+                novels[novel_name] = (ranking, novel_link, latest_chapter, update_time)
+            conn.close()
+        elif not fresh_items:
             self.logger.error(f"sqlite文件未找到: {self.db_path}")
             return
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, link FROM novels order by ranking")
-        rows = cursor.fetchall()
-        conn.close()
-        for novel_name, novel_link in rows:
+        # pipeline 批量写入时本次榜单可能尚未落盘，以刚解析的榜单为准
+        for item in fresh_items or []:
+            novels[item.get("NovelName")] = (
+                item.get("NovelRanking"),
+                item.get("NovelLink"),
+                item.get("NewlesetChapter"),
+                item.get("NovelLastUpdateTime"),
+            )
+        watermarks = self.load_watermarks() if self.incremental else {}
+        skipped = 0
+        rows = sorted(novels.items(), key=lambda row: self._ranking_key(row[1][0]))
+        for novel_name, (ranking, novel_link, latest_chapter, update_time) in rows:
+            if latest_chapter and watermarks.get(novel_name) == (latest_chapter, update_time):
+                self.logger.debug(f"小说未更新，跳过: {novel_name}")
+                skipped += 1
+                continue
             self.logger.info(f"抓取小说: {novel_name}, URL: {novel_link}")
             if not novel_link:
                 continue
@@ -130,36 +139,61 @@ class AutoNovelTop100Spider(scrapy.Spider):
             if novel_link.startswith("//"):
                 novel_link = "https:" + novel_link
             elif novel_link.startswith("/"):
-                novel_link = "https://www.17k.com" + novel_link
+                novel_link = self.site_url + novel_link
             if not novel_name:
                 continue
             yield scrapy.Request(
                 novel_link,
                 callback=self.parse_novel_chapter_list,
-                meta={'novel_name': novel_name}
+                meta={
+                    'novel_name': novel_name,
+                    'ranking': ranking,
+                    'latest_chapter': latest_chapter,
+                    'update_time': update_time,
+                },
+                priority=self.priority_policy.list_priority(ranking),
+                # 章节列表随时会新增章节，启用 HTTP 缓存时也强制重新验证，未变化时只需一次 304
+                headers={"Cache-Control": "no-cache"},
             )
+        if self.incremental:
+            self.logger.info(f"增量模式: 共 {len(rows)} 本小说，未更新跳过 {skipped} 本")
+
+    def load_watermarks(self):
+        # 读取上次爬取记录的最新章节与更新时间；仍有章节缺正文的小说不返回水位，不会被跳过
+        watermarks = {}
+        if not os.path.exists(self.db_path):
+            return watermarks
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(COMPLETE_WATERMARK_SQL)
+            for novel_name, latest_chapter, update_time in cursor.fetchall():
+                watermarks[novel_name] = (latest_chapter, update_time)
+        except sqlite3.Error as e:
+            self.logger.error(f"sqlite crawl_watermark表读取失败: {e}")
+        finally:
+            conn.close()
+        return watermarks
+
+    @staticmethod
+    def _ranking_key(ranking):
+        try:
+            return int(ranking)
+        except (TypeError, ValueError):
+            return float("inf")
 
     def parse_novel_chapter_list(self, response):
         novel_name = response.meta.get('novel_name', '')
         self.logger.info(f"抓取小说: {novel_name}, URL: {response.url}")
 
-        html_content = response.text
-        anti_spider_keywords = [
-            "setCookie", "reload", "_0x", "window.location", "检测到异常请求", "访问验证", "人机验证"
-        ]
-        is_anti_spider = any(keyword in html_content for keyword in anti_spider_keywords)
-        if is_anti_spider:
-            self.logger.warning(f"检测到反爬虫页面，尝试用Selenium重新获取: {novel_name}")
-            html_content = self.get_html_with_selenium(response.url)
-            if not html_content:
-                self.logger.error(f"Selenium 仍然未能绕过反爬虫，未保存: {novel_name}")
-                return
-
-        selector = Selector(text=html_content)
+        selector = response
         chapter_items = []
-        for volume in selector.xpath('//dl[@class="Volume"]'):
+        # 章节在目录页中的位置即阅读顺序，作为 chapter_index 入库
+        chapter_index = 0
+        for volume_index, volume in enumerate(selector.xpath('//dl[@class="Volume"]'), start=1):
             volume_title = volume.xpath('./dt/span[@class="tit"]/text()').get(default='').strip()
             for chapter in volume.xpath('./dd/a'):
+                chapter_index += 1
                 chapter_name = chapter.xpath('.//span/text()').get(default='').strip()
                 chapter_link = chapter.xpath('./@href').get(default='').strip()
                 if chapter_link.startswith('/'):
@@ -171,65 +205,91 @@ class AutoNovelTop100Spider(scrapy.Spider):
                 item["ChapterName"] = chapter_name
                 item["ChapterLink"] = chapter_link
                 item["ChapterInfo"] = chapter_info
+                item["VolumeIndex"] = volume_index
+                item["ChapterIndex"] = chapter_index
                 chapter_items.append(item)
 
+        exist_chapters, content_exist_chapters = self.known_chapters.load(novel_name)
+        self.logger.info(
+            f"总章节数: {len(chapter_items)}, 已存在: {len(exist_chapters)}, 有内容: {len(content_exist_chapters)}"
+        )
+        # pipeline 提交后会把章节加入 exist_chapters，需在 yield 之前判断新章节
+        novel_known = bool(exist_chapters)
+        ranking = response.meta.get('ranking')
+        # 目录中的章节总数，用于计算目录位置分
+        chapter_total = chapter_index
+        # 记录本次的最新章节作为增量水位，需要抓取的正文全部入库后才写入；须在 yield 请求之前暂存
+        if chapter_items:
+            watermark = CrawlWatermarkItem()
+            watermark["NovelName"] = novel_name
+            watermark["NewlesetChapter"] = response.meta.get('latest_chapter')
+            watermark["NovelLastUpdateTime"] = response.meta.get('update_time')
+            watermark = self.pending_watermarks.hold(
+                watermark,
+                [
+                    item["ChapterName"]
+                    for item in chapter_items
+                    if not self.known_chapters.has_content(item["NovelName"], item["ChapterName"])
+                ],
+            )
+        else:
+            watermark = None
         # 只 yield item，写入交由 pipeline
         for item in chapter_items:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-            SELECT count(*) FROM novel_chapter
-            WHERE novel_name = ? AND chapter_name = ? AND chapter_content IS NOT NULL AND chapter_content <> ''
-            ''',
-            (item["NovelName"], item["ChapterName"]))
-            count = cursor.fetchone()[0]
-            conn.close()
-            if count == 1:
-                self.logger.warning(f"小说{item['NovelName']}章节内容已存在: {item['ChapterName']}")
+            if self.known_chapters.has_content(item["NovelName"], item["ChapterName"]):
+                self.logger.debug(f"小说{item['NovelName']}章节内容已存在: {item['ChapterName']}")
+                if self.known_chapters.index_of(item["NovelName"], item["ChapterName"]) != item["ChapterIndex"]:
+                    # 正文已存在但目录位置有变化（或旧数据没有位置），只更新章节列表
+                    yield item
                 continue
+            chapter_kind = self.priority_policy.classify(
+                novel_known, self.known_chapters.exists(item["NovelName"], item["ChapterName"])
+            )
             yield item
             # 进入下一步：抓取章节内容
             yield scrapy.Request(
                 url=item["ChapterLink"],
                 callback=self.parse_chapter_content,
-                meta=item
+                meta={**item, 'ranking': ranking, 'chapter_kind': chapter_kind},
+                priority=self.priority_policy.chapter_priority(
+                    ranking, chapter_kind, item["ChapterIndex"], chapter_total
+                ),
             )
 
-    def is_ad_line(self, line):
-        AD_FILTER_KEYWORDS = [
-            "本书首发来自", "第一时间看正版内容", "17K小说网", "作者寄语", "banner_content", "二维码", "17K客户端", "签到即送VIP", "免费读全站"
-        ]
-        return any(keyword in line for keyword in AD_FILTER_KEYWORDS)
+        # 正文都已入库时水位随章节列表一起写入
+        if watermark is not None:
+            yield watermark
 
-    def parse_chapter_content(self, response):
+    def load_known_chapters(self, novel_name):
+        # 一次性查询该小说所有已存在的章节信息
+        if not os.path.exists(self.db_path):
+            return []
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''
+                SELECT chapter_name,
+                (chapter_content IS NOT NULL AND chapter_content <> '') OR content_blob IS NOT NULL AS has_content,
+                chapter_index
+                FROM novel_chapter
+                WHERE novel_id = (SELECT id FROM novels WHERE name = ?)
+                ''',
+                (novel_name,),
+            )
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            self.logger.error(f"sqlite novel_chapter表查询失败: {e}")
+            return []
+        finally:
+            conn.close()
+
+    async def parse_chapter_content(self, response):
         novel_name = response.meta.get('NovelName', '').strip()
         chapter_name = response.meta.get("ChapterName", "").strip()
         chapter_link = response.meta.get("ChapterLink", "").strip()
-        self.logger.info(f"抓取小说章节: {chapter_name}, URL: {chapter_link}")
-
-        html_content = response.text
-        anti_spider_keywords = [
-            "setCookie", "reload", "_0x", "window.location", "检测到异常请求", "访问验证", "人机验证"
-        ]
-        is_anti_spider = any(keyword in html_content for keyword in anti_spider_keywords)
-        if is_anti_spider:
-            self.logger.warning(f"检测到反爬虫页面，尝试用Selenium重新获取: {novel_name}_{chapter_name}")
-            html_content = self.get_html_with_selenium(chapter_link)
-            if not html_content:
-                self.logger.error(f"Selenium 仍然未能绕过反爬虫，未保存: {novel_name}_{chapter_name}")
-                return
-
-        selector = Selector(text=html_content)
-        # content = selector.xpath('//div[contains(@class,"readAreaBox")]/div[contains(@class,"content")]/text()').getall()
-        # if not content:
-        #     content = selector.xpath('//div[contains(@class,"readAreaBox")]//text()').getall()
-        # content = [line.strip() for line in content if line.strip()]
-        content_nodes = selector.xpath(
-               '//div[contains(@class,"readAreaBox")]/div[contains(@class,"content")]//text()'
-               '| //div[contains(@class,"readAreaBox")]//text()'
-           ).getall()
-        content = [line.strip() for line in content_nodes if line.strip()]
-        content = [line for line in content if not self.is_ad_line(line)]
+        # 每章一条，只在 DEBUG 级别输出，参数延迟格式化
+        self.logger.debug("抓取小说章节: %s, URL: %s", chapter_name, chapter_link)
 
         # 只 yield item，写入交由 pipeline
         item = NovelChapterItem()
@@ -238,31 +298,9 @@ class AutoNovelTop100Spider(scrapy.Spider):
         item["ChapterName"] = chapter_name
         item["ChapterLink"] = chapter_link
         item["ChapterInfo"] = response.meta.get("ChapterInfo", "")
-        item["ChapterContent"] = "\n".join(content)
+        item["VolumeIndex"] = response.meta.get("VolumeIndex")
+        item["ChapterIndex"] = response.meta.get("ChapterIndex")
+        item["ChapterContent"] = await maybe_deferred_to_future(
+            self.parse_engine.extract(response)
+        )
         yield item
-
-    def get_html_with_selenium(self, url, max_retry=3):
-        html = ""
-        for attempt in range(1, max_retry + 1):
-            try:
-                if not self.driver:
-                    self.logger.error("Selenium driver未初始化")
-                    return ""
-                self.driver.get(url)
-                self.driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
-                    "source": """
-                    Object.defineProperty(navigator, 'webdriver', {
-                        get: () => undefined
-                    });
-                    """
-                })
-                time.sleep(1)
-                self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                time.sleep(0.5)
-                html = self.driver.page_source
-                return html
-            except Exception as e:
-                self.logger.warning(f"Selenium 第{attempt}次抓取失败: {e}")
-                time.sleep(0.5)
-        self.logger.error(f"Selenium 多次重试仍失败: {url}")
-        return html
@@ -1,138 +1,128 @@
 import scrapy
 import os
-import time
+from urllib.parse import urlparse
 
-from scrapy.selector import Selector
-from ..items import SeventeenNovelsItem, NovelChapterItem
+from ..chapter_index import KnownChapterIndex, PendingWatermarks
+from ..checkpoint import CrawlCheckpoint
+from ..database import PgDatabase
+from ..parse_engine import ChapterParseEngine
+from ..priority import ChapterPriorityPolicy
+from ..schema import COMPLETE_WATERMARK_SQL
+from ..items import SeventeenNovelsItem, NovelChapterItem, CrawlWatermarkItem
 
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
 from scrapy import signals
-import psycopg2
+from scrapy.utils.defer import maybe_deferred_to_future
 
 
 class AutoNovelTop100PostgreSpider(scrapy.Spider):
     name = "auto_novel_top100_postgre"
     allowed_domains = ["17k.com", "www.17k.com"]
 
-    def __init__(self, local=False, *args, **kwargs):
+    def __init__(self, local=False, incremental=False, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.local = local
+        # 增量模式：榜单上最新章节与更新时间均未变化的小说不再抓取章节列表
+        self.incremental = incremental
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
         self.output_dir = os.path.abspath(
             os.path.join(self.base_dir, "..", "..", "output")
         )
-        self.pg_conn_params = None  # 由 from_crawler 注入
-        self.driver = None
-        self.pg_conn = None
-        self.cursor = None
+        # 与 pipeline 共用的连接池，由 from_crawler 注入；查询在线程池中进行，回调中 await 结果
+        self.database = None
+        self.site_url = "https://www.17k.com"
+        # 已入库章节索引，由 load_known_chapters 异步填充，pipeline 在提交后同步
+        self.known_chapters = KnownChapterIndex()
+        # 章节正文全部入库后才由 pipeline 写入的增量水位
+        self.pending_watermarks = PendingWatermarks()
+        # 断点续爬日志，CRAWL_CHECKPOINT_ENABLED 关闭时为 None
+        self.checkpoint = None
+
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        # 重试请求按 CHAPTER_PRIORITY_RETRY_PENALTY 降低优先级
+        ChapterPriorityPolicy.update_settings(settings)
 
     @classmethod
     def from_crawler(cls, crawler, *args, **kwargs):
         spider = super().from_crawler(crawler, *args, **kwargs)
+        if spider.local:
+            # 本地重跑开启 HTTP 缓存，已下载的页面不再重复请求站点；-s HTTPCACHE_ENABLED=0 仍可关闭
+            crawler.settings.set("HTTPCACHE_ENABLED", True, priority="spider")
         settings = crawler.settings
-        spider.pg_conn_params = {
-            "host": settings.get("PG_HOST"),
-            "port": settings.get("PG_PORT"),
-            "user": settings.get("PG_USER"),
-            "password": settings.get("PG_PASSWORD"),
-            "database": settings.get("PG_DBNAME"),
-        }
+        spider.database = PgDatabase.from_settings(settings)
         crawler.signals.connect(spider.open_spider, signal=signals.spider_opened)
         crawler.signals.connect(spider.close_spider, signal=signals.spider_closed)
+        # 章节正文解析引擎，CHAPTER_PARSE_WORKERS 大于 0 时使用进程池
+        spider.parse_engine = ChapterParseEngine.from_crawler(crawler)
+        spider.checkpoint = CrawlCheckpoint.from_crawler(crawler)
+        spider.priority_policy = ChapterPriorityPolicy.from_settings(settings)
+        # 站点地址可通过 settings 覆盖（压测时指向本地模拟站点）
+        spider.site_url = settings.get("NOVEL_SITE_BASE_URL", "https://www.17k.com").rstrip("/")
+        site_host = urlparse(spider.site_url).hostname
+        if site_host and site_host not in spider.allowed_domains:
+            spider.allowed_domains = [*spider.allowed_domains, site_host]
         return spider
 
     def open_spider(self, spider):
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--enable-unsafe-swiftshader")
-        user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36"
-        chrome_options.add_argument(f"user-agent={user_agent}")
-        chrome_options.binary_location = os.environ.get("CHROME_BIN", "/usr/bin/google-chrome")
-
-        # 优先从环境变量读取chromedriver路径
-        chromedriver_path = os.environ.get("CHROMEDRIVER_PATH", r"/usr/local/bin/chromedriver")
-        if not os.path.exists(chromedriver_path):
-            self.logger.error(f"ChromeDriver not found at {chromedriver_path}")
-            self.driver = webdriver.Chrome(
-                service=Service(ChromeDriverManager().install()), options=chrome_options
-            )
-        else:
-            self.driver = webdriver.Chrome(
-                service=Service(chromedriver_path), options=chrome_options
-            )
-        self.driver.implicitly_wait(15)
-        self.driver.set_page_load_timeout(25)
+        # pipeline 的 open_spider 先于 spider_opened 执行，连接池可能已经打开
         try:
-            self.pg_conn = psycopg2.connect(
-                host=self.pg_conn_params["host"],  # type: ignore
-                port=self.pg_conn_params["port"],  # type: ignore
-                user=self.pg_conn_params["user"],  # type: ignore
-                password=self.pg_conn_params["password"],  # type: ignore
-                database=self.pg_conn_params["database"],  # type: ignore
-            )
-            self.cursor = self.pg_conn.cursor()
+            self.database.open()  # type: ignore
         except Exception as e:
             raise Exception(f"Failed to create PostgreSQL connection: {e}")
 
     def close_spider(self, spider):
-        if self.driver:
-            self.driver.quit()
-            self.driver = None
-        if hasattr(self, "cursor") and self.cursor:
-            self.cursor.close()
-            self.cursor = None
-        if hasattr(self, "pg_conn") and self.pg_conn:
-            self.pg_conn.close()
-            self.pg_conn = None
+        # spider_closed 在 pipeline 的 close_spider 之后发送，剩余缓冲已写入
+        if self.database is not None:
+            self.database.close()
 
-    def start_requests(self):
-        if not self.local or not self.pg_novels_exist():
-            url = "https://www.17k.com/top/refactor/top100/06_vipclick/06_click_freeBook_top_100_pc.html"
+    async def start(self):
+        # Scrapy 2.13 起以 start() 作为入口，较新版本不再回退调用 start_requests()
+        resuming = self.checkpoint is not None and self.checkpoint.resuming
+        novels_exist = await self.pg_novels_exist() if resuming or self.local else False
+        if resuming and novels_exist:
+            async for request in self.resume_requests():
+                yield request
+            return
+        if not self.local or not novels_exist:
+            url = self.site_url + "/top/refactor/top100/06_vipclick/06_click_freeBook_top_100_pc.html"
             yield scrapy.Request(url, callback=self.parse_top100)
         else:
             self.logger.info("PostgreSQL novels表已存在，跳过爬取")
-            yield from self.request_chapter_list() # type: ignore
+            async for request in self.request_chapter_list():
+                yield request
 
-    def pg_novels_exist(self):
+    async def resume_requests(self):
+        # 上一轮未正常结束：先重新调度未入库的章节，再只请求尚未处理完的章节列表
+        pending = self.checkpoint.pending()  # type: ignore
+        listed_novels = self.checkpoint.listed_novels()  # type: ignore
+        self.logger.info(f"断点续爬: 恢复章节请求 {len(pending)} 个，跳过已列出的小说 {len(listed_novels)} 本")
+        for url, meta in pending:
+            yield scrapy.Request(
+                url,
+                callback=self.parse_chapter_content,
+                meta={**meta, "checkpoint": True},
+                priority=self.priority_policy.chapter_priority(
+                    meta.get("ranking"), meta.get("chapter_kind"), meta.get("ChapterIndex")
+                ),
+            )
+        async for request in self.request_chapter_list(skip_novels=listed_novels):
+            yield request
+
+    async def pg_novels_exist(self):
         exit_flag = False
         try:
-            self.cursor.execute("SELECT COUNT(*) FROM novels")  # type: ignore
-            count = self.cursor.fetchone()[0]  # type: ignore
-            exit_flag = count > 0
+            rows = await maybe_deferred_to_future(
+                self.database.fetchall("SELECT COUNT(*) FROM novels WHERE link IS NOT NULL")  # type: ignore
+            )
+            exit_flag = rows[0][0] > 0
         except Exception as e:
             self.logger.error(f"PostgreSQL novels表检测失败: {e}")
             exit_flag = False
         return exit_flag
 
-    def parse_top100(self, response):
-        anti_spider_keywords = [
-            "setCookie",
-            "reload",
-            "_0x",
-            "window.location",
-            "检测到异常请求",
-            "访问验证",
-            "人机验证",
-        ]
-        html_content = response.text
-        is_anti_spider = any(
-            keyword in html_content for keyword in anti_spider_keywords
-        )
-        if is_anti_spider:
-            self.logger.warning("检测到反爬虫页面，尝试用Selenium重新获取页面内容")
-            html_content = self.get_html_with_selenium(response.url) # type: ignore
-            if not html_content:
-                self.logger.error("Selenium 仍然未能绕过反爬虫，终止解析")
-                return
-            selector = Selector(text=html_content)
-        else:
-            selector = response
+    async def parse_top100(self, response):
+        selector = response
 
         table_content = selector.xpath(
             '//div[contains(@class, "BOX") and contains(@style, "block")]//table'
@@ -161,17 +151,39 @@ class AutoNovelTop100PostgreSpider(scrapy.Spider):
         for item in items:
             yield item
 
-        yield from self.request_chapter_list()
+        async for request in self.request_chapter_list(items):
+            yield request
 
-    def request_chapter_list(self):
-        rows = []
+    async def request_chapter_list(self, fresh_items=None, skip_novels=None):
+        novels = {}
         try:
-            self.cursor.execute("SELECT name, link FROM novels ORDER BY ranking")  # type: ignore
-            rows = self.cursor.fetchall()  # type: ignore
+            rows = await maybe_deferred_to_future(
+                self.database.fetchall(  # type: ignore
+                    "SELECT name, link, ranking, latest_chapter, update_time FROM novels WHERE link IS NOT NULL ORDER BY ranking"
+                )
+            )
+            for novel_name, novel_link, ranking, latest_chapter, update_time in rows:
+                novels[novel_name] = (ranking, novel_link, latest_chapter, update_time)
         except Exception as e:
             self.logger.error(f"PostgreSQL novels表读取失败: {e}")
-
-        for novel_name, novel_link in rows:
+        # 本次榜单可能尚未经 pipeline 落库，以刚解析的榜单为准
+        for item in fresh_items or []:
+            novels[item.get("NovelName")] = (
+                item.get("NovelRanking"),
+                item.get("NovelLink"),
+                item.get("NewlesetChapter"),
+                item.get("NovelLastUpdateTime"),
+            )
+        watermarks = await self.load_watermarks() if self.incremental else {}
+        skipped = 0
+        rows = sorted(novels.items(), key=lambda row: self._ranking_key(row[1][0]))
+        for novel_name, (ranking, novel_link, latest_chapter, update_time) in rows:
+            if skip_novels and novel_name in skip_novels:
+                continue
+            if latest_chapter and watermarks.get(novel_name) == (latest_chapter, update_time):
+                self.logger.debug(f"小说未更新，跳过: {novel_name}")
+                skipped += 1
+                continue
             self.logger.info(f"抓取小说: {novel_name}, URL: {novel_link}")
             if not novel_link:
                 continue
@@ -179,47 +191,60 @@ class AutoNovelTop100PostgreSpider(scrapy.Spider):
             if novel_link.startswith("//"):
                 novel_link = "https:" + novel_link
             elif novel_link.startswith("/"):
-                novel_link = "https://www.17k.com" + novel_link
+                novel_link = self.site_url + novel_link
             if not novel_name:
                 continue
             yield scrapy.Request(
                 novel_link,
                 callback=self.parse_novel_chapter_list,
-                meta={"novel_name": novel_name},
+                meta={
+                    "novel_name": novel_name,
+                    "ranking": ranking,
+                    "latest_chapter": latest_chapter,
+                    "update_time": update_time,
+                    # 章节列表的输出全部记入断点日志后标记该小说已列出
+                    "checkpoint_listing": novel_name,
+                },
+                priority=self.priority_policy.list_priority(ranking),
+                # 章节列表随时会新增章节，启用 HTTP 缓存时也强制重新验证，未变化时只需一次 304
+                headers={"Cache-Control": "no-cache"},
             )
+        if self.incremental:
+            self.logger.info(f"增量模式: 共 {len(rows)} 本小说，未更新跳过 {skipped} 本")
 
-    def parse_novel_chapter_list(self, response):
-        novel_name = response.meta.get("novel_name", "")
-
-        html_content = response.text
-        anti_spider_keywords = [
-            "setCookie",
-            "reload",
-            "_0x",
-            "window.location",
-            "检测到异常请求",
-            "访问验证",
-            "人机验证",
-        ]
-        is_anti_spider = any(
-            keyword in html_content for keyword in anti_spider_keywords
-        )
-        if is_anti_spider:
-            self.logger.warning(
-                f"检测到反爬虫页面，尝试用Selenium重新获取: {novel_name}"
+    async def load_watermarks(self):
+        # 读取上次爬取记录的最新章节与更新时间；仍有章节缺正文的小说不返回水位，不会被跳过
+        watermarks = {}
+        try:
+            rows = await maybe_deferred_to_future(
+                self.database.fetchall(COMPLETE_WATERMARK_SQL)  # type: ignore
             )
-            html_content = self.get_html_with_selenium(response.url) # type: ignore
-            if not html_content:
-                self.logger.error(f"Selenium 仍然未能绕过反爬虫，未保存: {novel_name}")
-                return
+            for novel_name, latest_chapter, update_time in rows:
+                watermarks[novel_name] = (latest_chapter, update_time)
+        except Exception as e:
+            self.logger.error(f"PostgreSQL crawl_watermark表读取失败: {e}")
+        return watermarks
+
+    @staticmethod
+    def _ranking_key(ranking):
+        try:
+            return int(ranking)
+        except (TypeError, ValueError):
+            return float("inf")
 
-        selector = Selector(text=html_content)
+    async def parse_novel_chapter_list(self, response):
+        novel_name = response.meta.get("novel_name", "")
+
+        selector = response
         chapter_items = []
-        for volume in selector.xpath('//dl[@class="Volume"]'):
+        # 章节在目录页中的位置即阅读顺序，作为 chapter_index 入库（VIP 章节也占位，保证位置稳定）
+        chapter_index = 0
+        for volume_index, volume in enumerate(selector.xpath('//dl[@class="Volume"]'), start=1):
             volume_title = (
                 volume.xpath('./dt/span[@class="tit"]/text()').get(default="").strip()
             )
             for chapter in volume.xpath("./dd/a"):
+                chapter_index += 1
                 chapter_name = chapter.xpath(".//span/text()").get(default="").strip()
                 # span 的 class 为 ellipsis vip 时 跳过该章节
                 vip_chapter = chapter.xpath('.//span[@class="ellipsis vip"]')
@@ -236,103 +261,99 @@ class AutoNovelTop100PostgreSpider(scrapy.Spider):
                 item["ChapterName"] = chapter_name
                 item["ChapterLink"] = chapter_link
                 item["ChapterInfo"] = chapter_info
+                item["VolumeIndex"] = volume_index
+                item["ChapterIndex"] = chapter_index
                 chapter_items.append(item)
 
-        # 一次性查询所有已存在的章节信息
-        exist_chapters = set()
-        content_exist_chapters = set()
-        try:
-            self.cursor.execute(  # type: ignore
-                """
-                SELECT chapter_name,
-                CASE WHEN chapter_content IS NOT NULL AND chapter_content != ''
-                THEN 1 ELSE 0 END as has_content
-                FROM novel_chapter
-                WHERE novel_name = %s
-                """,
-                (novel_name,),
-            )
-            for row in self.cursor.fetchall():  # type: ignore
-                chapter_name, has_content = row
-                exist_chapters.add(chapter_name)
-                if has_content:
-                    content_exist_chapters.add(chapter_name)
-        except Exception as e:
-            self.logger.error(f"PostgreSQL novel_chapter表查询失败: {e}")
+        await self.load_known_chapters(novel_name)
+        exist_chapters, content_exist_chapters = self.known_chapters.load(novel_name)
 
         self.logger.info(
             f"总章节数: {len(chapter_items)}, 已存在: {len(exist_chapters)}, 有内容: {len(content_exist_chapters)}"
         )
 
+        # pipeline 提交后会把章节加入 exist_chapters，需在 yield 之前判断新章节
+        novel_known = bool(exist_chapters)
+        ranking = response.meta.get("ranking")
+        # 目录中的章节总数（含 VIP 占位），用于计算目录位置分
+        chapter_total = chapter_index
+        # 记录本次的最新章节作为增量水位，需要抓取的正文全部入库后才写入；须在 yield 请求之前暂存
+        if chapter_items:
+            watermark = CrawlWatermarkItem()
+            watermark["NovelName"] = novel_name
+            watermark["NewlesetChapter"] = response.meta.get("latest_chapter")
+            watermark["NovelLastUpdateTime"] = response.meta.get("update_time")
+            watermark = self.pending_watermarks.hold(
+                watermark,
+                [item["ChapterName"] for item in chapter_items if item["ChapterName"] not in content_exist_chapters],
+            )
+        else:
+            watermark = None
         for item in chapter_items:
             chapter_name = item["ChapterName"]
             if chapter_name not in exist_chapters:
                 # 新章节，插入并抓取内容
+                request = self.chapter_content_request(item, ranking, novel_known, chapter_total)
                 yield item
-                yield scrapy.Request(
-                    url=item["ChapterLink"],
-                    callback=self.parse_chapter_content,
-                    meta=item,
-                )
-            elif chapter_name not in content_exist_chapters:
+                yield request
+                continue
+            if self.known_chapters.index_of(novel_name, chapter_name) != item["ChapterIndex"]:
+                # 目录位置有变化（或旧数据没有位置），更新章节列表
+                yield item
+            if chapter_name not in content_exist_chapters:
                 # 已有章节但内容为空，抓取内容
-                yield scrapy.Request(
-                    url=item["ChapterLink"],
-                    callback=self.parse_chapter_content,
-                    meta=item,
-                )
+                yield self.chapter_content_request(item, ranking, True, chapter_total)
 
-    def is_ad_line(self, line):
-        AD_FILTER_KEYWORDS = [
-            "本书首发来自",
-            "第一时间看正版内容",
-            "17K小说网",
-            "作者寄语",
-            "banner_content",
-            "二维码",
-            "17K客户端",
-            "签到即送VIP",
-            "免费读全站",
-        ]
-        return any(keyword in line for keyword in AD_FILTER_KEYWORDS)
+        # 正文都已入库时水位随章节列表一起写入
+        if watermark is not None:
+            yield watermark
 
-    def parse_chapter_content(self, response):
-        novel_name = response.meta.get("NovelName", "").strip()
-        chapter_name = response.meta.get("ChapterName", "").strip()
-        chapter_link = response.meta.get("ChapterLink", "").strip()
-        self.logger.info(f"抓取小说章节: {chapter_name}, URL: {chapter_link}")
-
-        html_content = response.text
-        anti_spider_keywords = [
-            "setCookie",
-            "reload",
-            "_0x",
-            "window.location",
-            "检测到异常请求",
-            "访问验证",
-            "人机验证",
-        ]
-        is_anti_spider = any(
-            keyword in html_content for keyword in anti_spider_keywords
+    def chapter_content_request(self, item, ranking, novel_known, chapter_total):
+        # checkpoint 标记的请求由 CrawlCheckpointMiddleware 记入断点日志，章节入库后由 pipeline 确认
+        chapter_kind = self.priority_policy.classify(
+            novel_known, self.known_chapters.exists(item["NovelName"], item["ChapterName"])
         )
-        if is_anti_spider:
-            self.logger.warning(
-                f"检测到反爬虫页面，尝试用Selenium重新获取: {novel_name}_{chapter_name}"
-            )
-            html_content = self.get_html_with_selenium(chapter_link)
-            if not html_content:
-                self.logger.error(
-                    f"Selenium 仍然未能绕过反爬虫，未保存: {novel_name}_{chapter_name}"
+        return scrapy.Request(
+            url=item["ChapterLink"],
+            callback=self.parse_chapter_content,
+            meta={**item, "checkpoint": True, "ranking": ranking, "chapter_kind": chapter_kind},
+            priority=self.priority_policy.chapter_priority(
+                ranking, chapter_kind, item["ChapterIndex"], chapter_total
+            ),
+        )
+
+    async def load_known_chapters(self, novel_name):
+        # 一次性查询该小说所有已存在的章节信息，放入已入库章节索引
+        if self.known_chapters.loaded(novel_name):
+            return
+        try:
+            rows = await maybe_deferred_to_future(
+                self.database.fetchall(  # type: ignore
+                    """
+                    SELECT chapter_name,
+                    CASE WHEN (chapter_content IS NOT NULL AND chapter_content != '')
+                    OR content_blob IS NOT NULL
+                    THEN 1 ELSE 0 END as has_content,
+                    chapter_index
+                    FROM novel_chapter
+                    WHERE novel_id = (SELECT id FROM novels WHERE name = %s)
+                    """,
+                    (novel_name,),
                 )
-                return
+            )
+        except Exception as e:
+            self.logger.error(f"PostgreSQL novel_chapter表查询失败: {e}")
+            rows = []
+        # 等待查询期间可能已由其他回调加载
+        if not self.known_chapters.loaded(novel_name):
+            self.known_chapters.store(novel_name, rows)
 
-        selector = Selector(text=html_content)
-        content_nodes = selector.xpath(
-            '//div[contains(@class,"readAreaBox")]/div[contains(@class,"content")]//text()'
-            '| //div[contains(@class,"readAreaBox")]//text()'
-        ).getall()
-        content = [line.strip() for line in content_nodes if line.strip()]
-        content = [line for line in content if not self.is_ad_line(line)]
+    async def parse_chapter_content(self, response):
+        novel_name = response.meta.get("NovelName", "").strip()
+        chapter_name = response.meta.get("ChapterName", "").strip()
+        chapter_link = response.meta.get("ChapterLink", "").strip()
+        # 每章一条，只在 DEBUG 级别输出，参数延迟格式化
+        self.logger.debug("抓取小说章节: %s, URL: %s", chapter_name, chapter_link)
 
         item = NovelChapterItem()
         item["NovelName"] = novel_name
@@ -340,36 +361,9 @@ class AutoNovelTop100PostgreSpider(scrapy.Spider):
         item["ChapterName"] = chapter_name
         item["ChapterLink"] = chapter_link
         item["ChapterInfo"] = response.meta.get("ChapterInfo", "")
-        item["ChapterContent"] = "\n".join(content)
+        item["VolumeIndex"] = response.meta.get("VolumeIndex")
+        item["ChapterIndex"] = response.meta.get("ChapterIndex")
+        item["ChapterContent"] = await maybe_deferred_to_future(
+            self.parse_engine.extract(response)
+        )
         yield item
-
-    def get_html_with_selenium(self, url, max_retry=3):
-        html = ""
-        for attempt in range(1, max_retry + 1):
-            try:
-                if not self.driver:
-                    self.logger.error("Selenium driver未初始化")
-                    return ""
-                self.driver.get(url)
-                self.driver.execute_cdp_cmd(
-                    "Page.addScriptToEvaluateOnNewDocument",
-                    {
-                        "source": """
-                    Object.defineProperty(navigator, 'webdriver', {
-                        get: () => undefined
-                    });
-                    """
-                    },
-                )
-                time.sleep(0.5)
-                self.driver.execute_script(
-                    "window.scrollTo(0, document.body.scrollHeight);"
-                )
-                time.sleep(0.1)
-                html = self.driver.page_source
-                return html
-            except Exception as e:
-                self.logger.warning(f"Selenium 第{attempt}次抓取失败: {e}")
-                time.sleep(2)
-        self.logger.error(f"Selenium 多次重试仍失败: {url}")
-        return html
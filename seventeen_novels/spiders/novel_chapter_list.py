@@ -3,13 +3,6 @@ import csv
 import os
 from ..items import NovelChapterItem
 
-from parsel import Selector
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
-import time
-from scrapy import signals
 
 class NovelChapterListSpider(scrapy.Spider):
     name = "novel_chapter_list"
@@ -19,39 +12,6 @@ class NovelChapterListSpider(scrapy.Spider):
     novel_top100_path = os.path.abspath(os.path.join(output_dir, "novel_top100_html"))
     os.makedirs(novel_top100_path, exist_ok=True)
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.driver = None  # Selenium driver实例
-
-    @classmethod
-    def from_crawler(cls, crawler, *args, **kwargs):
-        spider = super().from_crawler(crawler, *args, **kwargs)
-        crawler.signals.connect(spider.open_spider, signal=signals.spider_opened)
-        crawler.signals.connect(spider.close_spider, signal=signals.spider_closed)
-        return spider
-
-    def open_spider(self, spider):
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--no-sandbox")
-        user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36"
-        chrome_options.add_argument(f"user-agent={user_agent}")
-
-        chromedriver_path = r"C:\Users\wtf50\.wdm\drivers\chromedriver\win64\137.0.7151.70\chromedriver-win32\chromedriver.exe"
-        if not os.path.exists(chromedriver_path):
-            self.logger.error(f"ChromeDriver not found at {chromedriver_path}")
-            self.driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-        else:
-            self.driver = webdriver.Chrome(service=Service(chromedriver_path), options=chrome_options)
-        self.driver.implicitly_wait(15)
-        self.driver.set_page_load_timeout(25)
-
-    def close_spider(self, spider):
-        if self.driver:
-            self.driver.quit()
-            self.driver = None
-
     async def start(self):
         csv_path = os.path.abspath(os.path.join(self.output_dir, "free_novel_top100.csv"))
         self.logger.info(f"CSV文件路径: {csv_path}")
@@ -86,53 +46,18 @@ class NovelChapterListSpider(scrapy.Spider):
                     meta={'novel_name': row.get("NovelName", ""), 'html_file': html_file}
                 )
 
-    def get_html_with_selenium(self, url, max_retry=3):
-        html = ""
-        for attempt in range(1, max_retry + 1):
-            try:
-                if not self.driver:
-                    self.logger.error("Selenium driver未初始化")
-                    return ""
-                self.driver.get(url)
-                self.driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
-                    "source": """
-                    Object.defineProperty(navigator, 'webdriver', {
-                        get: () => undefined
-                    });
-                    """
-                })
-                time.sleep(3)
-                self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                time.sleep(1)
-                html = self.driver.page_source
-                return html
-            except Exception as e:
-                self.logger.warning(f"Selenium 第{attempt}次抓取失败: {e}")
-                time.sleep(2)
-        self.logger.error(f"Selenium 多次重试仍失败: {url}")
-        return html
-
     def parse_novel(self, response):
         novel_name = response.meta.get('novel_name', '')
         html_file = response.meta.get('html_file', '')
         self.logger.info(f"抓取小说: {novel_name}，URL: {response.url}")
 
-        html_content = response.text
-        anti_spider_keywords = [
-            "setCookie", "reload", "_0x", "window.location", "检测到异常请求", "访问验证", "人机验证"
-        ]
-        is_anti_spider = any(keyword in html_content for keyword in anti_spider_keywords)
-        if is_anti_spider:
-            self.logger.warning(f"检测到反爬虫页面，尝试用Selenium重新获取: {novel_name}")
-            html_content = self.get_html_with_selenium(response.url)
-            if not html_content:
-                self.logger.error(f"Selenium 仍然未能绕过反爬虫，未保存: {novel_name}")
-                return
-            else:
-                with open(html_file, "w", encoding="utf-8") as f:
-                    f.write(html_content)
+        # 反爬虫验证页已由 AntiBotDetectorMiddleware 处理，Selenium 渲染的页面另存一份
+        if response.meta.get("selenium"):
+            html_content = response.text
+            with open(html_file, "w", encoding="utf-8") as f:
+                f.write(html_content)
 
-        selector = Selector(text=html_content)
+        selector = response
         # 解析所有卷
         for volume in selector.xpath('//dl[@class="Volume"]'):
             volume_title = volume.xpath('./dt/span[@class="tit"]/text()').get(default='').strip()
@@ -0,0 +1,235 @@
+# 写后（write-behind）pipeline：item 放入有界队列，由专用写线程攒批写入数据库，提交不再阻塞 reactor
+import queue
+import threading
+import time
+from collections import deque
+
+from scrapy.exceptions import DropItem
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet import defer, task, threads
+
+from .signals import send_stage_timed
+
+# 写线程收到后写完当前批次并退出
+_STOP = object()
+
+
+class WriteBehindPipeline:
+    """数据库 pipeline 基类
+
+    子类实现：
+    - accepts(item, spider)：是否由本 pipeline 写入，其余 item 原样返回
+    - write_batch(items, spider)：在一个事务中写入并提交，失败时回滚后抛出异常
+    - after_commit(items, spider)：提交成功后在 reactor 线程中执行（同步已入库章节索引、确认断点等）
+    并在 open_spider 建好连接后调用 start_writing，close_spider 中调用 stop_writing。
+
+    write-behind 模式下每个 pipeline 一个写线程，write_batch 在写线程中执行：
+    - 满 batch_size 条、距批次第一条超过 flush_interval 秒即写入；flush_interval 为 0
+      或 ack_on_commit 时队列一空就写入，多个 item 合并为一次提交
+    - ack_on_commit 为真时 process_item 等到提交成功才返回，写入失败则抛出 DropItem（至少一次）；
+      否则入队即返回 item
+    - 队列已满时 process_item 等 item 入队后才返回，scraper 积压后引擎暂停取新请求，形成背压
+    - stop_writing 先写完等待入队的 item 和队列中的剩余 item，再关闭连接
+    after_commit 中可以用 enqueue 追加 pipeline 自己产生的 item，随后续批次写入。
+    未开启时在 reactor 线程中缓冲，满 batch_size 条或每 flush_interval 秒写入一次。
+    """
+
+    # 日志中的数据库名称
+    backend = "database"
+
+    def __init__(self, batch_size=1, flush_interval=0.0, write_behind=False, queue_size=10000, ack_on_commit=False):
+        self.batch_size = max(int(batch_size), 1)
+        self.flush_interval = max(float(flush_interval), 0.0)
+        self.write_behind = write_behind
+        self.queue_size = max(int(queue_size), 1)
+        self.ack_on_commit = ack_on_commit
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.flush_task = None
+        self.queue = None
+        self.writer = None
+        # 队列满时等待入队的 ((item, committed), accepted)，只在 reactor 线程中追加
+        self.waiting = deque()
+        self.closing = False
+
+    @staticmethod
+    def write_behind_settings(settings):
+        return {
+            "write_behind": settings.getbool("WRITE_BEHIND_ENABLED", False),
+            "queue_size": settings.getint("WRITE_BEHIND_QUEUE_SIZE", 10000),
+            "ack_on_commit": settings.getbool("WRITE_BEHIND_ACK_ON_COMMIT", False),
+        }
+
+    def accepts(self, item, spider):
+        raise NotImplementedError
+
+    def write_batch(self, items, spider):
+        raise NotImplementedError
+
+    def after_commit(self, items, spider):
+        pass
+
+    def operation_name(self, items):
+        """写入耗时在 StageMetrics 中的操作名"""
+        return "write"
+
+    def start_writing(self, spider):
+        self.last_flush = time.monotonic()
+        self.closing = False
+        if self.write_behind:
+            self.queue = queue.Queue(self.queue_size)
+            self.writer = threading.Thread(
+                target=self._run_writer, args=(spider,), name=f"{type(self).__name__}-writer", daemon=True
+            )
+            self.writer.start()
+        elif self.batch_size > 1 and self.flush_interval > 0:
+            # 定时刷新，避免爬取间隙缓冲长时间不落盘
+            self.flush_task = task.LoopingCall(self._flush_if_due, spider)
+            self.flush_task.start(self.flush_interval, now=False)
+
+    async def stop_writing(self, spider, callback):
+        """写完剩余 item 后调用 callback()；write-behind 模式在线程中等待写线程结束"""
+        if self.flush_task and self.flush_task.running:
+            self.flush_task.stop()
+        self.flush_task = None
+        if self.writer is not None:
+            self.closing = True
+            await maybe_deferred_to_future(threads.deferToThread(self._stop_writer))
+        # 写入过程中 after_commit 可能又追加了 item（见 enqueue），直到缓冲写空
+        while self.buffer:
+            self.flush(spider)
+        callback()
+
+    async def process_item(self, item, spider):
+        if not self.accepts(item, spider):
+            return item
+        if self.writer is None:
+            self.buffer.append(item)
+            if len(self.buffer) >= self.batch_size:
+                self.flush(spider)
+            return item
+        committed = defer.Deferred() if self.ack_on_commit else None
+        entry = (item, committed)
+        if self.waiting or not self._offer(entry):
+            # 队列已满：等写线程腾出空位后再入队
+            accepted = defer.Deferred()
+            self.waiting.append((entry, accepted))
+            self._inc_stats(spider, "write_behind/backpressure")
+            await maybe_deferred_to_future(accepted)
+        if committed is not None:
+            return await maybe_deferred_to_future(committed)
+        return item
+
+    def enqueue(self, item, spider):
+        """在 reactor 线程中追加由 pipeline 自己产生的 item（如 after_commit 中放行的水位），不等待入队"""
+        if self.writer is None or self.closing:
+            # 关闭过程中写线程可能已退出，留给 stop_writing 写入
+            self.buffer.append(item)
+            return
+        entry = (item, None)
+        if self.waiting or not self._offer(entry):
+            self.waiting.append((entry, defer.Deferred()))
+
+    def flush(self, spider):
+        """未开启 write-behind 时在 reactor 线程中写入缓冲"""
+        self.last_flush = time.monotonic()
+        items, self.buffer = self.buffer, []
+        if items:
+            self._finish([(item, None) for item in items], *self._write(items, spider), spider)
+
+    def _flush_if_due(self, spider):
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush(spider)
+
+    def _offer(self, entry):
+        try:
+            self.queue.put_nowait(entry)  # type: ignore
+        except queue.Full:
+            return False
+        return True
+
+    def _admit_waiting(self):
+        while self.waiting and not self.closing:
+            entry, accepted = self.waiting[0]
+            if not self._offer(entry):
+                break
+            self.waiting.popleft()
+            accepted.callback(None)
+
+    def _write(self, items, spider):
+        """返回 (是否成功, 耗时秒数)"""
+        started = time.perf_counter()
+        try:
+            self.write_batch(items, spider)
+        except Exception as e:
+            spider.logger.error(f"Error inserting data into {self.backend}: {e}")
+            return False, time.perf_counter() - started
+        return True, time.perf_counter() - started
+
+    def _finish(self, entries, ok, seconds, spider):
+        # reactor 线程中执行
+        items = [item for item, _ in entries]
+        if ok:
+            send_stage_timed(
+                getattr(spider, "crawler", None), "pipeline", self.operation_name(items), seconds, spider
+            )
+            self.after_commit(items, spider)
+        elif self.write_behind:
+            self._inc_stats(spider, "write_behind/failed_items", len(items))
+        for item, committed in entries:
+            if committed is None:
+                continue
+            if ok:
+                committed.callback(item)
+            else:
+                committed.errback(DropItem(f"写入 {self.backend} 失败，未提交"))
+
+    def _run_writer(self, spider):
+        from twisted.internet import reactor
+
+        batch = []
+        deadline = 0.0
+        stopping = False
+        while not stopping:
+            try:
+                entry = self.queue.get(timeout=max(deadline - time.monotonic(), 0) if batch else None)  # type: ignore
+            except queue.Empty:
+                entry = None
+            if entry is _STOP:
+                stopping = True
+            elif entry is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(entry)
+                if self.waiting:
+                    reactor.callFromThread(self._admit_waiting)
+                if len(batch) < self.batch_size and not self._batch_due(deadline):
+                    continue
+            if batch:
+                ok, seconds = self._write([item for item, _ in batch], spider)
+                reactor.callFromThread(self._finish, batch, ok, seconds, spider)
+                batch = []
+
+    def _batch_due(self, deadline):
+        if (self.ack_on_commit or not self.flush_interval) and self.queue.empty():  # type: ignore
+            return True
+        return time.monotonic() >= deadline
+
+    def _stop_writer(self):
+        # 在 reactor 之外的线程中执行，可以阻塞等待队列空位
+        from twisted.internet import reactor
+
+        while self.waiting:
+            entry, accepted = self.waiting.popleft()
+            self.queue.put(entry)  # type: ignore
+            reactor.callFromThread(accepted.callback, None)
+        self.queue.put(_STOP)  # type: ignore
+        self.writer.join()  # type: ignore
+        self.writer = None
+        self.queue = None
+
+    @staticmethod
+    def _inc_stats(spider, key, count=1):
+        crawler = getattr(spider, "crawler", None)
+        if crawler is not None and crawler.stats is not None:
+            crawler.stats.inc_value(key, count)